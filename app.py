@@ -1,10 +1,14 @@
 import os
 import uuid
+import atexit
 import argparse
 import re
 import secrets
+import json
+import time
+import shutil
 from pathlib import Path
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context
 import torch
 import pandas as pd
 from services.crossmodal_service import CrossModalAttentionService
@@ -13,6 +17,15 @@ from services.cleanup_service import CleanupService
 from services.protection_service import ProtectionService
 from services.storage_audit_service import StorageAuditService
 from services.verification_service import VerificationService
+from services.job_service import JobManager, FINISHED_STATES
+from services.join_engine import CsvDicomJoinEngine, SqliteDicomIndex, MatchResultStore
+from services.dicom_catalog import DicomCatalog
+from services.local_import_service import LocalDicomImporter, LocalImportError
+from services.archive_service import extract_archive_stream, ArchiveError, MultipartFileStream
+from services.file_digest import save_stream_sha256
+from services.upload_session_service import UploadSessionManager, UploadSessionError, UploadOffsetMismatch
+from services.table_reader import get_table_dialect, iter_table_chunks, configure_sidecar_roots
+from services.service_registry import ServiceRegistry
 
 def create_app(config=None):
     """应用工厂函数"""
@@ -21,11 +34,19 @@ def create_app(config=None):
     
     # 设置最大文件上传大小为500MB（支持批量上传）
     app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
+    # 归档接口流式解包，单独放宽到20GB
+    app.config.setdefault('MAX_ARCHIVE_LENGTH', 20 * 1024 * 1024 * 1024)
 
+    # 初始化共享服务注册表（NER、DICOM处理器等长生命周期实例），WARM_UP_SERVICES为真时启动即预热
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    app.services = ServiceRegistry(device=device, ner_workers=app.config.get('NER_WORKERS'),
+                                   dicom_workers=app.config.get('DICOM_WORKERS'))
+    if app.config.get('WARM_UP_SERVICES', False):
+        app.services.warm_up()
+    
     # 初始化服务组件
-    app.crossmodal_svc = CrossModalAttentionService(
-        device='cuda' if torch.cuda.is_available() else 'cpu'
-    )
+    app.crossmodal_svc = CrossModalAttentionService(device=device, registry=app.services,
+                                                    batch_workers=app.config.get('BATCH_WORKERS'))
     app.audit_logger = AuditLogger()
     app.cleanup_service = CleanupService(upload_dir=app.config['UPLOAD_FOLDER'], max_age_hours=24)
     
@@ -40,6 +61,32 @@ def create_app(config=None):
     # 初始化验证服务
     app.verification_svc = VerificationService()
     
+    # DICOM元数据提取进程池（DICOM_WORKERS<=1时串行处理），与批量检测建索引共用注册表中的实例
+    app.dicom_extractor = app.services.dicom_extractor
+    
+    def shutdown_services():
+        """关闭各进程池（NER、跨模态批量检测、DICOM元数据提取），解释器退出时自动调用"""
+        app.crossmodal_svc.shutdown()
+        app.services.shutdown()
+    
+    app.shutdown_services = shutdown_services
+    atexit.register(shutdown_services)
+    
+    # 初始化DICOM元数据目录（上传时写入，批量检测按dicom_id连接）
+    app.dicom_catalog = DicomCatalog(db_path=str(Path(storage_repo) / "db" / "dicom_catalog.sqlite"))
+    
+    # 初始化本地目录登记（仅允许白名单内的服务端目录）
+    app.local_importer = LocalDicomImporter(allowed_roots=app.config.get('DICOM_ALLOWED_ROOTS'))
+    
+    # 初始化分块上传会话管理器（分块直接写入上传目录，随上传目录一起过期清理）
+    app.upload_sessions = UploadSessionManager(upload_dir=app.config['UPLOAD_FOLDER'])
+    
+    # 初始化后台任务管理器（任务状态与存储索引放在同一db目录）
+    app.job_manager = JobManager(
+        db_path=str(Path(storage_repo) / "db" / "jobs.sqlite"),
+        max_workers=app.config.get('JOB_WORKERS', 2)
+    )
+    
     # 启动定期清理任务（每1小时清理一次）
     app.cleanup_service.start_periodic_cleanup(interval_hours=1)
     print("[INFO] 文件清理服务已启动")
@@ -49,6 +96,8 @@ def create_app(config=None):
     # 确保目录存在
     os.makedirs(app.config.get('UPLOAD_FOLDER'), exist_ok=True)
     os.makedirs(app.config.get('OUTPUT_DIR'), exist_ok=True)
+    # 列式缓存只为上传目录中的表格生成（接口收到的其他服务端路径只读不写）
+    configure_sidecar_roots([app.config['UPLOAD_FOLDER']])
     
     # 添加请求错误处理
     @app.errorhandler(413)
@@ -59,6 +108,57 @@ def create_app(config=None):
     def handle_exception(e):
         app.logger.error(f'未处理的异常: {str(e)}')
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
+    
+    def wants_async():
+        """请求是否要求以后台任务方式运行（?async=1、表单或JSON字段async）"""
+        flag = request.args.get("async") or request.form.get("async")
+        if flag is None and request.is_json:
+            flag = (request.get_json(silent=True) or {}).get("async")
+        return str(flag).lower() in ("1", "true", "yes")
+    
+    def job_accepted(job_id):
+        """后台任务已受理的响应"""
+        return jsonify({
+            "job_id": job_id,
+            "status": "accepted",
+            "status_url": f"/api/jobs/{job_id}",
+            "result_url": f"/api/jobs/{job_id}/result"
+        }), 202
+    
+    def resolve_known_dicoms(digests):
+        """
+        查询服务端已有的DICOM内容：先查上传目录（可复用已提取的元数据），再查存储层CAS
+        上传目录登记的是原始文件摘要（上传时边写盘边计算）；CAS中存放的是保护后的输出，
+        只有客户端重新上传受保护文件时才会命中
+        :param digests: 客户端计算的SHA-256列表
+        :return: {sha256: (源文件路径, 缓存的元数据或None)}
+        """
+        digests = [d.lower() for d in digests if isinstance(d, str)]
+        digests = [d for d in digests if re.fullmatch(r"[0-9a-f]{64}", d)]
+        known = {sha: (Path(m['filepath']), m) for sha, m in app.dicom_catalog.lookup_digests(digests).items()
+                 if catalog_file_unchanged(m)}
+        for sha, cas_path in app.storage_svc.cas_lookup([d for d in digests if d not in known]).items():
+            known[sha] = (cas_path, None)
+        return known
+    
+    def catalog_file_unchanged(record, path=None):
+        """
+        目录记录对应的文件是否仍是提取元数据时的内容（大小与修改时间一致）
+        没有记录大小/修改时间的旧记录无法确认，按未知文件处理（要求客户端重新上传）
+        :param path: 要检查的文件（默认记录中的filepath；链接/复制后传入目标文件）
+        """
+        try:
+            st = os.stat(path or record['filepath'])
+        except (OSError, KeyError, TypeError):
+            return False
+        return st.st_size == record.get('file_size') and st.st_mtime_ns == record.get('file_mtime_ns')
+    
+    def link_or_copy(src, dst):
+        """优先硬链接（同一文件系统时不复制数据），否则复制（copy2保留修改时间）"""
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
 
     @app.route("/api/ingest", methods=["POST"])
     def ingest():
@@ -112,8 +212,7 @@ def create_app(config=None):
                 print(f"CSV检测结果: 实体数量={len(result.get('text_entities', []))}")
             elif dicom_path and Path(dicom_path).exists():
                 # 只有DICOM文件，处理DICOM的ROI和元数据
-                from services.roi_service import DicomProcessor
-                processor = DicomProcessor(device='cpu')
+                processor = app.services.dicom_processor('cpu')
                 dicom_result = processor.process_dicom(Path(dicom_path), try_burnedin=True)
                 
                 if dicom_result:
@@ -166,20 +265,16 @@ def create_app(config=None):
                             "roi_type": dicom_result.roi_type or "unknown"
                         }
                     
-                    image_features_serializable = None
-                    if dicom_result.normalized_tensor is not None:
-                        image_features_serializable = {
-                            "shape": list(dicom_result.normalized_tensor.shape),
-                            "dtype": str(dicom_result.normalized_tensor.dtype),
-                            "device": str(dicom_result.normalized_tensor.device)
-                        }
+                    # 只序列化tensor的形状信息（由header推出，不解码生成tensor）
+                    image_features_serializable = dicom_result.tensor_info()
                     
                     result = {
                         "text_entities": text_entities,
                         "image_regions": {
                             "roi_mask": roi_mask_serializable,
                             "image_features": image_features_serializable,
-                            "roi_type": dicom_result.roi_type
+                            "roi_type": dicom_result.roi_type,
+                            "pixel_error": dicom_result.pixel_error
                         },
                         "mappings": [],
                         "cross_modal_risks": [],
@@ -273,8 +368,10 @@ def create_app(config=None):
             csv_id = f"csv_{uuid.uuid4().hex[:8]}"
             csv_path = str(Path(app.config['UPLOAD_FOLDER']) / f"{csv_id}.csv")
             csv_file.save(csv_path)
+            # 上传时即嗅探格式/编码/分隔符，后续detect、batch_detect等读取直接复用
+            dialect = get_table_dialect(csv_path)
             
-            print(f"[SUCCESS] CSV文件已保存: {csv_path}")
+            print(f"[SUCCESS] CSV文件已保存: {csv_path} ({dialect.format}, {dialect.encoding}, {dialect.sep!r})")
             app.audit_logger.log(csv_id, "csv_upload", "client")
             
             return jsonify({
@@ -282,6 +379,7 @@ def create_app(config=None):
                 "csv_id": csv_id,
                 "csv_path": csv_path,
                 "filename": csv_file.filename,
+                "dialect": dialect.to_dict(),
                 "status": "success"
             })
         except Exception as e:
@@ -319,186 +417,445 @@ def create_app(config=None):
             app.audit_logger.log("system", "dicom_upload_error", str(e))
             return jsonify({"error": str(e)}), 500
     
+    def extract_dicom_batch(dicom_id, dicom_dir, saved_paths, try_burnedin, include_metadata, total_files,
+                            reused=(), missing=(), progress_callback=None, digests=None):
+        """
+        提取一个上传批次的DICOM元数据并写入目录
+        :param saved_paths: 需要解析的文件（已保存到dicom_dir）
+        :param reused: 直接复用的元数据记录（排在解析结果之后）
+        :param missing: 未能接收的文件，计入failed
+        :param total_files: 文件总数，None时按提取结果计算
+        :param digests: 写盘时已算出的SHA-256 {路径: 摘要}（记入目录供上传协商使用）
+        """
+        # 并行提取元数据（结果保持上传顺序）；非列表（如归档解包生成器）时边接收边提交
+        extract = app.dicom_extractor.extract if isinstance(saved_paths, list) else app.dicom_extractor.extract_iter
+        metadata_list, failures = extract(
+            saved_paths, try_burnedin=try_burnedin, progress_callback=progress_callback, digests=digests
+        )
+        if total_files is None:
+            total_files = len(metadata_list) + len(failures)
+        metadata_list += list(reused)
+        failures += list(missing)
+        
+        print(f"[SUCCESS] 成功提取 {len(metadata_list) - len(reused)} 个DICOM元数据，复用 {len(reused)} 个")
+        app.dicom_catalog.add_batch(dicom_id, metadata_list)
+        app.audit_logger.log(dicom_id, "batch_dicom_upload", "client")
+        
+        result = {
+            "dicom_id": dicom_id,
+            "dicom_dir": str(dicom_dir),
+            "total_files": total_files,
+            "processed": len(metadata_list),
+            "reused": len(reused),
+            "failed": failures,
+            "status": "success"
+        }
+        if include_metadata:
+            result["metadata_list"] = metadata_list
+        return result
+    
     @app.route("/api/batch_upload_dicom", methods=["POST"])
     def batch_upload_dicom():
         """批量上传DICOM文件并提取元数据"""
         try:
             dicom_files = request.files.getlist("dicom_files")
-            if not dicom_files:
+            # 经 /api/batch_upload_dicom/negotiate 确认服务端已有的文件：[{"filename", "sha256"}]
+            known_files = json.loads(request.form.get("known_files") or "[]")
+            if not dicom_files and not known_files:
                 return jsonify({"error": "No DICOM files provided"}), 400
             
-            print(f"[INFO] 收到 {len(dicom_files)} 个DICOM文件")
+            print(f"[INFO] 收到 {len(dicom_files)} 个DICOM文件，引用已有文件 {len(known_files)} 个")
             
             # 创建DICOM目录
             dicom_id = f"batch_{uuid.uuid4().hex[:8]}"
             dicom_dir = Path(app.config['UPLOAD_FOLDER']) / dicom_id
             dicom_dir.mkdir(parents=True, exist_ok=True)
             
-            # 保存DICOM文件并提取元数据
-            from services.roi_service import DicomProcessor
-            processor = DicomProcessor(device='cpu')
-            metadata_list = []
+            # 是否需要烧录文本检测（需要解码像素），否则只读取header
+            try_burnedin = request.form.get("try_burnedin", "false").lower() in ("1", "true", "yes")
+            # 元数据已写入服务端目录，客户端可选择不回传metadata_list
+            include_metadata = request.form.get("include_metadata", "true").lower() in ("1", "true", "yes")
             
-            for i, dicom_file in enumerate(dicom_files):
+            # 保存DICOM文件（写盘时计算SHA-256，提取元数据时不再重读整个文件）
+            saved_paths = []
+            digests = {}
+            for dicom_file in dicom_files:
                 if not dicom_file.filename.endswith('.dcm'):
                     continue
-                    
-                # 保存文件
                 file_path = dicom_dir / dicom_file.filename
-                dicom_file.save(file_path)
-                
-                # 提取元数据
+                digests[file_path] = save_stream_sha256(dicom_file.stream, file_path)
+                saved_paths.append(file_path)
+            
+            # 引用服务端已有的文件：链接到本批次目录，上传目录中的文件直接复用已提取的元数据
+            reused = []
+            missing = []
+            known = resolve_known_dicoms([k.get("sha256") for k in known_files])
+            for entry in known_files:
+                filename = Path(entry.get("filename") or "").name
+                sha = str(entry.get("sha256") or "").lower()
+                if not filename.endswith('.dcm') or sha not in known:
+                    missing.append({'filename': filename, 'sha256': sha, 'error': "服务端不存在该文件，请重新上传"})
+                    continue
+                src, cached = known[sha]
+                file_path = dicom_dir / filename
                 try:
-                    result = processor.process_dicom(file_path, try_burnedin=False)
-                    if result:
-                        metadata_list.append({
-                            'filename': dicom_file.filename,
-                            'filepath': str(file_path).replace('\\', '/'),  # 跨平台路径兼容
-                            'patient_id': result.patient_id or '',
-                            'patient_sex': result.patient_sex or '',
-                            'patient_age': result.patient_age or '',
-                            'study_date': result.study_date or '',
-                            'accession': result.accession or '',
-                            'institution': result.institution or ''
-                        })
-                        
-                    if (i + 1) % 100 == 0:
-                        print(f"[INFO] 已处理 {i + 1}/{len(dicom_files)} 个DICOM文件")
-                except Exception as e:
-                    print(f"[WARN] 处理 {dicom_file.filename} 失败: {e}")
+                    if not file_path.exists():
+                        link_or_copy(src, file_path)
+                        # 协商之后源文件可能被删除或替换：链接/复制到的内容须仍与目录记录一致
+                        if cached and not catalog_file_unchanged(cached, file_path):
+                            file_path.unlink()
+                            raise FileNotFoundError(f"{src} 已被修改")
+                except OSError as e:
+                    print(f"[WARN] 无法复用已有文件 {filename}: {e}")
+                    missing.append({'filename': filename, 'sha256': sha, 'error': "服务端不存在该文件，请重新上传"})
                     continue
-            
-            print(f"[SUCCESS] 成功提取 {len(metadata_list)} 个DICOM元数据")
-            app.audit_logger.log(dicom_id, "batch_dicom_upload", "client")
-            
-            return jsonify({
-                "dicom_id": dicom_id,
-                "dicom_dir": str(dicom_dir),
-                "total_files": len(dicom_files),
-                "processed": len(metadata_list),
-                "metadata_list": metadata_list,
-                "status": "success"
-            })
+                if cached:
+                    reused.append({**cached, 'filename': filename, 'filepath': str(file_path).replace('\\', '/')})
+                else:
+                    saved_paths.append(file_path)  # 仅CAS中存在，需解析header
+                    digests[file_path] = sha
+            
+            def run_extract(progress_callback=None):
+                return extract_dicom_batch(
+                    dicom_id, dicom_dir, saved_paths, try_burnedin, include_metadata,
+                    total_files=len(dicom_files) + len(known_files), reused=reused, missing=missing,
+                    progress_callback=progress_callback, digests=digests
+                )
+            
+            if wants_async():
+                job_id = app.job_manager.submit(
+                    "batch_upload_dicom", lambda ctx: run_extract(ctx.update),
+                    total=len(saved_paths), stage="upload"
+                )
+                return job_accepted(job_id)
+            
+            return jsonify(run_extract())
         except Exception as e:
             error_msg = str(e)
             print(f"[ERROR] 批量DICOM上传失败: {error_msg}")
             app.audit_logger.log("system", "batch_dicom_error", error_msg)
             return jsonify({"error": error_msg, "status": "error"}), 500
 
+    @app.route("/api/uploads", methods=["POST"])
+    def create_upload_session():
+        """创建可续传上传会话：{"files": [{"filename", "size", "sha256"(可选)}]}"""
+        try:
+            data = request.json or {}
+            return jsonify(app.upload_sessions.create(data.get("files", []))), 201
+        except UploadSessionError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e), "status": "error"}), 500
+    
+    @app.route("/api/uploads/<upload_id>", methods=["GET"])
+    def get_upload_session(upload_id):
+        """查询会话状态（各文件已接收字节数，用于断点续传）"""
+        try:
+            return jsonify(app.upload_sessions.status(upload_id))
+        except UploadSessionError as e:
+            return jsonify({"error": str(e)}), 404
+    
+    @app.route("/api/uploads/<upload_id>", methods=["DELETE"])
+    def abort_upload_session(upload_id):
+        """放弃会话并删除已接收的数据"""
+        try:
+            if not app.upload_sessions.abort(upload_id):
+                return jsonify({"error": "Upload session not found"}), 404
+            return jsonify({"upload_id": upload_id, "status": "aborted"})
+        except UploadSessionError as e:
+            return jsonify({"error": str(e)}), 404
+    
+    @app.route("/api/uploads/<upload_id>/files/<int:file_index>", methods=["PUT"])
+    def upload_chunk(upload_id, file_index):
+        """
+        上传一个分块（请求体为原始字节）
+        偏移量通过 ?offset= 或 Upload-Offset 头传入，须等于服务端已接收的字节数，否则返回409及expected_offset
+        """
+        try:
+            offset = int(request.args.get("offset", request.headers.get("Upload-Offset", 0)))
+            received = app.upload_sessions.write_chunk(
+                upload_id, file_index, offset, request.stream, request.content_length
+            )
+            return jsonify({"upload_id": upload_id, "file_index": file_index, "received": received})
+        except UploadOffsetMismatch as e:
+            return jsonify({"error": str(e), "expected_offset": e.expected_offset}), 409
+        except UploadSessionError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e), "status": "error"}), 500
+    
+    @app.route("/api/uploads/<upload_id>/commit", methods=["POST"])
+    def commit_upload_session(upload_id):
+        """提交会话：文件移入新的DICOM批次目录并提取元数据（响应同 /api/batch_upload_dicom）"""
+        try:
+            data = request.get_json(silent=True) or {}
+            try_burnedin = str(data.get("try_burnedin", "false")).lower() in ("1", "true", "yes")
+            include_metadata = str(data.get("include_metadata", "true")).lower() in ("1", "true", "yes")
+            
+            dicom_id = f"batch_{uuid.uuid4().hex[:8]}"
+            dicom_dir = Path(app.config['UPLOAD_FOLDER']) / dicom_id
+            digests = {}
+            paths = app.upload_sessions.commit(upload_id, dicom_dir, digests=digests)
+            saved_paths = [p for p in paths if p.name.endswith('.dcm')]
+            
+            def run_extract(progress_callback=None):
+                return extract_dicom_batch(
+                    dicom_id, dicom_dir, saved_paths, try_burnedin, include_metadata,
+                    total_files=len(paths), progress_callback=progress_callback, digests=digests
+                )
+            
+            if wants_async():
+                return job_accepted(app.job_manager.submit(
+                    "batch_upload_dicom", lambda ctx: run_extract(ctx.update),
+                    total=len(saved_paths), stage="upload"
+                ))
+            return jsonify(run_extract())
+        except UploadSessionError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[ERROR] 分块上传提交失败: {error_msg}")
+            app.audit_logger.log("system", "batch_dicom_error", error_msg)
+            return jsonify({"error": error_msg, "status": "error"}), 500
+    
+    @app.route("/api/batch_upload_dicom/archive", methods=["POST"])
+    def batch_upload_dicom_archive():
+        """
+        上传单个zip / tar(.gz) 归档：请求体为归档原始字节（或multipart字段archive），
+        逐个解出.dcm成员并立即提交元数据提取，响应同 /api/batch_upload_dicom
+        """
+        try:
+            # 归档按块读取，不受整体请求大小限制的内存约束
+            request.max_content_length = app.config.get('MAX_ARCHIVE_LENGTH')
+            # multipart时直接解析原始请求流（不访问request.files，否则整个归档会先被缓存到临时文件）
+            boundary = request.mimetype_params.get("boundary")
+            if request.mimetype == "multipart/form-data" and boundary:
+                stream = MultipartFileStream(request.stream, boundary.encode("latin-1"), "archive")
+            else:
+                stream = request.stream
+            
+            try_burnedin = request.args.get("try_burnedin", "false").lower() in ("1", "true", "yes")
+            include_metadata = request.args.get("include_metadata", "true").lower() in ("1", "true", "yes")
+            
+            dicom_id = f"batch_{uuid.uuid4().hex[:8]}"
+            dicom_dir = Path(app.config['UPLOAD_FOLDER']) / dicom_id
+            print(f"[INFO] 接收DICOM归档 -> {dicom_id}")
+            
+            digests = {}
+            result = extract_dicom_batch(
+                dicom_id, dicom_dir, extract_archive_stream(stream, dicom_dir, digests=digests),
+                try_burnedin, include_metadata, total_files=None, digests=digests
+            )
+            return jsonify(result)
+        except ArchiveError as e:
+            print(f"[ERROR] DICOM归档解包失败: {e}")
+            return jsonify({"error": str(e), "status": "error"}), 400
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[ERROR] DICOM归档上传失败: {error_msg}")
+            app.audit_logger.log("system", "batch_dicom_error", error_msg)
+            return jsonify({"error": error_msg, "status": "error"}), 500
+    
+    @app.route("/api/batch_register_dicom", methods=["POST"])
+    def batch_register_dicom():
+        """
+        登记服务端已有的DICOM目录（白名单内），不经HTTP传输文件
+        mode=link（默认）：硬链接到上传目录下的新批次；mode=inplace：原地索引，dicom_dir即源目录
+        """
+        try:
+            data = request.json or {}
+            source_dir = app.local_importer.resolve(data.get("path", ""))
+            mode = data.get("mode", "link")
+            if mode not in ("link", "inplace"):
+                return jsonify({"error": f"Invalid mode: {mode}"}), 400
+            recursive = str(data.get("recursive", "true")).lower() in ("1", "true", "yes")
+            try_burnedin = str(data.get("try_burnedin", "false")).lower() in ("1", "true", "yes")
+            include_metadata = str(data.get("include_metadata", "true")).lower() in ("1", "true", "yes")
+            
+            files = app.local_importer.scan(source_dir, recursive=recursive)
+            if not files:
+                return jsonify({"error": "No DICOM files found"}), 400
+            
+            dicom_id = f"batch_{uuid.uuid4().hex[:8]}"
+            if mode == "inplace":
+                dicom_dir = source_dir
+                saved_paths = files
+            else:
+                dicom_dir = Path(app.config['UPLOAD_FOLDER']) / dicom_id
+                saved_paths = app.local_importer.link_into(files, source_dir, dicom_dir)
+            print(f"[INFO] 登记本地DICOM目录 {source_dir}（{mode}）: {len(files)} 个文件 -> {dicom_id}")
+            
+            def run_extract(progress_callback=None):
+                return extract_dicom_batch(
+                    dicom_id, dicom_dir, saved_paths, try_burnedin, include_metadata,
+                    total_files=len(saved_paths), progress_callback=progress_callback
+                )
+            
+            if wants_async():
+                return job_accepted(app.job_manager.submit(
+                    "batch_register_dicom", lambda ctx: run_extract(ctx.update),
+                    total=len(saved_paths), stage="upload"
+                ))
+            return jsonify(run_extract())
+        except LocalImportError as e:
+            return jsonify({"error": str(e), "status": "error"}), 403
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[ERROR] 本地目录登记失败: {error_msg}")
+            app.audit_logger.log("system", "batch_dicom_error", error_msg)
+            return jsonify({"error": error_msg, "status": "error"}), 500
+    
+    @app.route("/api/batch_upload_dicom/negotiate", methods=["POST"])
+    def negotiate_dicom_upload():
+        """
+        上传前校验和协商：客户端提交文件SHA-256，服务端返回已有/缺失的摘要
+        客户端只需上传missing中的文件，其余通过known_files引用
+        """
+        try:
+            data = request.json or {}
+            digests = [d.get("sha256") if isinstance(d, dict) else d for d in data.get("digests", [])]
+            known = resolve_known_dicoms(digests)
+            have = [d.lower() for d in digests if isinstance(d, str) and d.lower() in known]
+            missing = [d for d in digests if not (isinstance(d, str) and d.lower() in known)]
+            print(f"[INFO] 上传协商: 已有 {len(have)} 个，缺失 {len(missing)} 个")
+            return jsonify({
+                "have": have,
+                "missing": missing,
+                "cached_metadata": sum(1 for d in have if known[d][1] is not None),
+                "status": "success"
+            })
+        except Exception as e:
+            return jsonify({"error": str(e), "status": "error"}), 500
+    
+    def iter_csv_chunks(csv_path, chunksize=50000):
+        """分块读取CSV（格式、编码与分隔符按上传文件嗅探一次后复用，之后从列式缓存读取）"""
+        yield from iter_table_chunks(csv_path, chunksize)
+    
+    def iter_batch_matches(csv_path, join_engine, stats, chunksize=50000):
+        """
+        分块读取CSV，逐块与DICOM元数据做列式连接并按行顺序生成匹配记录
+        :param join_engine: CsvDicomJoinEngine 或 SqliteDicomIndex
+        :param stats: 累计统计（total_patients / matched），由生成器更新
+        """
+        for chunk in iter_csv_chunks(csv_path, chunksize):
+            yield from join_engine.iter_matches(chunk, stats)
+    
+    def detect_result_path(result_id):
+        """磁盘匹配结果文件路径（位于上传目录，由清理服务定期删除）"""
+        return Path(app.config['UPLOAD_FOLDER']) / "detect_results" / f"{result_id}.sqlite"
+    
+    def batch_summary(csv_path, stats):
+        """批量检测汇总信息"""
+        total = stats['total_patients']
+        matched_count = stats['matched']
+        return {
+            'csv_file': Path(csv_path).name,
+            'total_patients': total,
+            'processed': total,
+            'matched': matched_count,
+            'unmatched': total - matched_count,
+            'match_rate': (matched_count / total * 100) if total else 0,
+            'status': 'success'
+        }
+    
     @app.route("/api/batch_detect", methods=["POST"])
     def batch_detect():
-        """批量跨模态检测（CSV + DICOM元数据列表）"""
+        """批量跨模态检测（CSV + DICOM元数据列表，或已上传批次的dicom_id）"""
         try:
             data = request.json
             csv_path = data.get("csv_path")
+            dicom_id = data.get("dicom_id")
             dicom_metadata_list = data.get("dicom_metadata_list", [])
+            # 流式模式：逐行输出NDJSON（每个匹配一行，最后一行为汇总）
+            stream = bool(data.get("stream")) or request.accept_mimetypes.best == "application/x-ndjson"
             
             if not csv_path:
                 return jsonify({"error": "Missing csv_path"}), 400
             
-            print(f"[INFO] 批量检测: CSV={csv_path}, DICOM元数据数={len(dicom_metadata_list)}")
-            
-            # 读取CSV（自动检测编码）
-            try:
-                df = pd.read_csv(csv_path, encoding='utf-8')
-            except UnicodeDecodeError:
-                try:
-                    print(f"[WARN] UTF-8解码失败，尝试GBK编码...")
-                    df = pd.read_csv(csv_path, encoding='gbk')
-                except UnicodeDecodeError:
-                    print(f"[WARN] GBK解码失败，尝试latin1编码...")
-                    df = pd.read_csv(csv_path, encoding='latin1')
-            
-            # 提取CSV中的patient_id
-            csv_patients = []
-            for idx, row in df.iterrows():
-                path_value = str(row.get('Path', ''))
-                match = re.search(r'patient(\d+)', path_value, re.IGNORECASE)
-                if match:
-                    csv_patients.append({
-                        'row_index': idx,
-                        'patient_id': 'patient' + match.group(1),
-                        'patient_number': match.group(1),
-                        'row_data': row.to_dict()
-                    })
-            
-            print(f"[INFO] CSV中找到 {len(csv_patients)} 个patient记录")
-            
-            # 创建DICOM patient_id索引
-            dicom_index = {}
-            for dicom_meta in dicom_metadata_list:
-                patient_id = dicom_meta.get('patient_id', '')
-                if patient_id:
-                    dicom_index[patient_id] = dicom_meta
-            
-            print(f"[INFO] DICOM元数据中找到 {len(dicom_index)} 个patient_id")
-            
-            # 匹配CSV和DICOM
-            matches = []
-            matched_count = 0
-            
-            for csv_patient in csv_patients:
-                csv_pid = csv_patient['patient_id']
-                dicom_meta = dicom_index.get(csv_pid)
-                
-                if dicom_meta:
-                    matched_count += 1
-                    matches.append({
-                        'patient_id': csv_pid,
-                        'row_index': csv_patient['row_index'],
-                        'dicom_file': dicom_meta.get('filename'),
-                        'matched': True,
-                        'csv_data': csv_patient['row_data'],
-                        'dicom_metadata': dicom_meta,
-                        'match_type': 'patient_id_exact_match',
-                        'confidence': 1.0,
-                        'risk_level': 'critical'
-                    })
+            # 传dicom_id时直接与服务端目录连接，无需回传元数据列表
+            catalog_batch = None
+            if dicom_id:
+                catalog_batch = app.dicom_catalog.batch(dicom_id)
+                if not app.dicom_catalog.count(dicom_id):
+                    return jsonify({"error": f"Unknown dicom_id: {dicom_id}"}), 404
+                print(f"[INFO] 批量检测: CSV={csv_path}, DICOM目录批次={dicom_id}")
+            else:
+                print(f"[INFO] 批量检测: CSV={csv_path}, DICOM元数据数={len(dicom_metadata_list)}")
+            
+            # 磁盘模式：DICOM索引与匹配结果均落盘，内存占用只与分块大小有关
+            if data.get("out_of_core"):
+                chunksize = int(data.get("chunksize", 50000))
+                result_id = f"match_{uuid.uuid4().hex[:12]}"
+                db_path = detect_result_path(result_id)
+                if catalog_batch is not None:
+                    index = catalog_batch
                 else:
-                    matches.append({
-                        'patient_id': csv_pid,
-                        'row_index': csv_patient['row_index'],
-                        'dicom_file': 'None',
-                        'matched': False
-                    })
-            
-            print(f"[SUCCESS] 匹配完成: {matched_count}/{len(csv_patients)}")
-            print(f"[DEBUG] matches数组长度: {len(matches)}")
-            print(f"[DEBUG] 前3个match: {matches[:3] if len(matches) >= 3 else matches}")
-            
-            result = {
-                'csv_file': Path(csv_path).name,
-                'total_patients': len(csv_patients),
-                'processed': len(csv_patients),
-                'matched': matched_count,
-                'unmatched': len(csv_patients) - matched_count,
-                'match_rate': (matched_count / len(csv_patients) * 100) if csv_patients else 0,
-                'results': matches,
-                'status': 'success'
-            }
-            
-            print(f"[DEBUG] result keys: {result.keys()}")
-            print(f"[DEBUG] result['results']长度: {len(result['results'])}")
+                    index = SqliteDicomIndex(str(db_path))
+                    index.add(dicom_metadata_list)
+                print(f"[INFO] DICOM元数据中找到 {len(index)} 个patient_id（磁盘索引）")
+                del dicom_metadata_list, data
+                
+                def run_out_of_core(progress_callback=None):
+                    store = MatchResultStore(str(db_path))
+                    stats = {'total_patients': 0, 'matched': 0}
+                    try:
+                        for chunk in iter_csv_chunks(csv_path, chunksize):
+                            store.append(index.iter_matches(chunk, stats))
+                            if progress_callback:
+                                progress_callback(stats['total_patients'])
+                        summary = batch_summary(csv_path, stats)
+                        summary.update({
+                            'result_id': result_id,
+                            'results_url': f"/api/batch_detect/results/{result_id}"
+                        })
+                        store.set_summary(summary)
+                    finally:
+                        store.close()
+                        index.close()
+                    print(f"[SUCCESS] 匹配完成: {stats['matched']}/{stats['total_patients']}（结果已落盘）")
+                    app.audit_logger.log("batch_detect", "complete", f"matched={stats['matched']}")
+                    return summary
+                
+                if wants_async():
+                    return job_accepted(app.job_manager.submit(
+                        "batch_detect", lambda ctx: run_out_of_core(ctx.update), stage="detect"
+                    ))
+                return jsonify(run_out_of_core())
+            
+            # 构建DICOM元数据表（patient_id为连接键）
+            join_engine = catalog_batch if catalog_batch is not None else CsvDicomJoinEngine(dicom_metadata_list)
+            
+            print(f"[INFO] DICOM元数据中找到 {join_engine.patient_count} 个patient_id")
+            
+            stats = {'total_patients': 0, 'matched': 0}
+            
+            if stream:
+                def generate():
+                    try:
+                        for match in iter_batch_matches(csv_path, join_engine, stats):
+                            yield json.dumps(match, ensure_ascii=False, default=str) + "\n"
+                        summary = batch_summary(csv_path, stats)
+                        print(f"[SUCCESS] 匹配完成: {stats['matched']}/{stats['total_patients']}")
+                        app.audit_logger.log("batch_detect", "complete", f"matched={stats['matched']}")
+                    except Exception as e:
+                        print(f"[ERROR] 批量检测失败: {e}")
+                        app.audit_logger.log("batch_detect", "error", str(e))
+                        summary = {**batch_summary(csv_path, stats), 'status': 'error', 'error': str(e)}
+                    yield json.dumps({'summary': summary}, ensure_ascii=False) + "\n"
+                
+                return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
             
-            app.audit_logger.log("batch_detect", "complete", f"matched={matched_count}")
+            # 匹配CSV和DICOM
+            matches = list(iter_batch_matches(csv_path, join_engine, stats))
             
-            # 清理NaN值，转换为JSON安全的格式
-            import json
-            import numpy as np
+            print(f"[INFO] CSV中找到 {stats['total_patients']} 个patient记录")
+            print(f"[SUCCESS] 匹配完成: {stats['matched']}/{stats['total_patients']}")
             
-            def clean_nan(obj):
-                """递归清理NaN值"""
-                if isinstance(obj, dict):
-                    return {k: clean_nan(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [clean_nan(item) for item in obj]
-                elif isinstance(obj, float) and (np.isnan(obj) or np.isinf(obj)):
-                    return None
-                else:
-                    return obj
+            result = batch_summary(csv_path, stats)
+            result['results'] = matches
             
-            result_cleaned = clean_nan(result)
-            return jsonify(result_cleaned)
+            app.audit_logger.log("batch_detect", "complete", f"matched={stats['matched']}")
+            return jsonify(result)
             
         except Exception as e:
             error_msg = str(e)
@@ -508,6 +865,48 @@ def create_app(config=None):
             app.audit_logger.log("batch_detect", "error", error_msg)
             return jsonify({"error": error_msg, "status": "error"}), 500
     
+    @app.route("/api/batch_detect/results/<result_id>", methods=["GET"])
+    def batch_detect_results(result_id):
+        """分页读取磁盘模式的批量检测结果（?offset=&limit=&matched=true|false）"""
+        try:
+            if not re.fullmatch(r"match_[0-9a-f]{12}", result_id):
+                return jsonify({"error": "Invalid result_id"}), 400
+            db_path = detect_result_path(result_id)
+            if not db_path.exists():
+                return jsonify({"error": "Result not found"}), 404
+            
+            offset = int(request.args.get("offset", 0))
+            limit = min(int(request.args.get("limit", 1000)), 10000)
+            matched = request.args.get("matched")
+            if matched is not None:
+                matched = matched.lower() in ("1", "true", "yes")
+            
+            store = MatchResultStore(str(db_path))
+            try:
+                return jsonify({
+                    "result_id": result_id,
+                    "summary": store.get_summary(),
+                    "offset": offset,
+                    "limit": limit,
+                    "total": store.count(matched),
+                    "results": store.page(offset=offset, limit=limit, matched=matched)
+                })
+            finally:
+                store.close()
+        except Exception as e:
+            return jsonify({"error": str(e), "status": "error"}), 500
+    
+    @app.route("/api/dicom_catalog", methods=["GET"])
+    def dicom_catalog_lookup():
+        """按标识查询DICOM目录（?patient_id=&sop_instance_uid=&accession=&dicom_id=）"""
+        keys = ("patient_id", "sop_instance_uid", "accession", "dicom_id")
+        query = {k: request.args.get(k) for k in keys if request.args.get(k)}
+        if not query:
+            return jsonify({"error": f"At least one of {', '.join(keys)} is required"}), 400
+        limit = min(int(request.args.get("limit", 100)), 1000)
+        records = app.dicom_catalog.find(limit=limit, **query)
+        return jsonify({"query": query, "count": len(records), "records": records})
+    
     @app.route("/api/process_batch", methods=["POST"])
     def process_batch():
         """批量处理CSV和DICOM数据（旧接口，保留兼容性）"""
@@ -519,11 +918,28 @@ def create_app(config=None):
             if not csv_path or not dicom_dir:
                 return jsonify({"error": "Missing csv_path or dicom_dir"}), 400
 
+            output_path = str(Path(app.config['OUTPUT_DIR']) / f"batch_{uuid.uuid4().hex[:8]}")
+            
+            if wants_async():
+                def run_job(ctx):
+                    result = app.crossmodal_svc.process_batch_data(
+                        csv_path=csv_path,
+                        dicom_dir=dicom_dir,
+                        output_path=output_path,
+                        progress_callback=ctx.update
+                    )
+                    if result.get("status") == "failed":
+                        raise RuntimeError(result.get("error"))
+                    app.audit_logger.log("batch", "process_complete", "system")
+                    return result
+                
+                return job_accepted(app.job_manager.submit("process_batch", run_job, stage="detect"))
+            
             # 使用跨模态服务进行批量处理
             result = app.crossmodal_svc.process_batch_data(
                 csv_path=csv_path,
                 dicom_dir=dicom_dir,
-                output_path=str(Path(app.config['OUTPUT_DIR']) / f"batch_{uuid.uuid4().hex[:8]}")
+                output_path=output_path
             )
             
             app.audit_logger.log("batch", "process_complete", "system")
@@ -545,14 +961,25 @@ def create_app(config=None):
             
             # 执行保护
             output_dir = Path(app.config['OUTPUT_DIR']) / batch_id
-            result = app.protection_svc.protect_batch(
-                detection_result=detection_result,
-                output_dir=output_dir,
-                batch_id=batch_id
-            )
             
-            app.audit_logger.log(batch_id, "protect_execute", "system")
-            return jsonify(result)
+            def run_protect(progress_callback=None):
+                result = app.protection_svc.protect_batch(
+                    detection_result=detection_result,
+                    output_dir=output_dir,
+                    batch_id=batch_id,
+                    progress_callback=progress_callback
+                )
+                app.audit_logger.log(batch_id, "protect_execute", "system")
+                return result
+            
+            if wants_async():
+                job_id = app.job_manager.submit(
+                    "protect_execute", lambda ctx: run_protect(ctx.update),
+                    total=len(detection_result.get('results', [])), stage="protect"
+                )
+                return job_accepted(job_id)
+            
+            return jsonify(run_protect())
             
         except Exception as e:
             error_msg = str(e)
@@ -580,15 +1007,23 @@ def create_app(config=None):
             if not protected_dicom.exists() or not protected_text.exists():
                 return jsonify({"error": "Protected files not found"}), 404
             
-            # 入库
-            result = app.storage_svc.ingest_batch(
-                protected_dicom=protected_dicom,
-                protected_text=protected_text,
-                batch_id=batch_id
-            )
+            def run_ingest(progress_callback=None):
+                # 入库
+                result = app.storage_svc.ingest_batch(
+                    protected_dicom=protected_dicom,
+                    protected_text=protected_text,
+                    batch_id=batch_id,
+                    progress_callback=progress_callback
+                )
+                app.audit_logger.log(batch_id, "storage_ingest", "system")
+                return result
             
-            app.audit_logger.log(batch_id, "storage_ingest", "system")
-            return jsonify(result)
+            if wants_async():
+                return job_accepted(
+                    app.job_manager.submit("storage_ingest", lambda ctx: run_ingest(ctx.update), stage="ingest")
+                )
+            
+            return jsonify(run_ingest())
             
         except Exception as e:
             error_msg = str(e)
@@ -714,6 +1149,67 @@ def create_app(config=None):
         except Exception as e:
             return jsonify({"error": str(e), "status": "error"}), 500
     
+    @app.route("/api/jobs", methods=["GET"])
+    def list_jobs():
+        """列出后台任务"""
+        try:
+            limit = int(request.args.get("limit", 20))
+            return jsonify({"jobs": app.job_manager.list_jobs(limit=limit), "limit": limit})
+        except Exception as e:
+            return jsonify({"error": str(e), "status": "error"}), 500
+    
+    @app.route("/api/jobs/<job_id>", methods=["GET"])
+    def job_status(job_id):
+        """查询后台任务状态"""
+        job = app.job_manager.get(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job)
+    
+    @app.route("/api/jobs/<job_id>/events", methods=["GET"])
+    def job_events(job_id):
+        """任务进度SSE流（阶段进度、吞吐量、预计剩余时间）"""
+        if not app.job_manager.get(job_id):
+            return jsonify({"error": "Job not found"}), 404
+        interval = max(0.1, float(request.args.get("interval", 0.5)))
+        
+        def stream():
+            while True:
+                progress = app.job_manager.get_progress(job_id)
+                if progress is None:
+                    return
+                yield f"event: progress\ndata: {json.dumps(progress, ensure_ascii=False)}\n\n"
+                if progress["status"] in FINISHED_STATES:
+                    yield f"event: done\ndata: {json.dumps(app.job_manager.get(job_id), ensure_ascii=False)}\n\n"
+                    return
+                time.sleep(interval)
+        
+        return Response(stream(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁止反向代理缓冲
+        })
+    
+    @app.route("/api/jobs/<job_id>/result", methods=["GET"])
+    def job_result(job_id):
+        """获取后台任务结果"""
+        job = app.job_manager.get(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        if job["status"] != "succeeded":
+            return jsonify({"error": "Job has no result", "job": job}), 409
+        return jsonify(app.job_manager.get_result(job_id))
+    
+    @app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+    def cancel_job(job_id):
+        """取消后台任务"""
+        job = app.job_manager.get(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        if not app.job_manager.cancel(job_id):
+            return jsonify({"error": f"Job already {job['status']}", "job": job}), 409
+        app.audit_logger.log(job_id, "job_cancel", "client")
+        return jsonify(app.job_manager.get(job_id))
+    
     @app.route("/api/key_info", methods=["GET"])
     def key_info():
         """获取密钥信息"""
@@ -738,12 +1234,25 @@ def parse_args():
     parser.add_argument('--port', type=int, default=5000, help='监听端口')
     parser.add_argument('--upload-folder', default='./uploads', help='文件上传目录')
     parser.add_argument('--output-dir', default='./output', help='结果输出目录')
+    parser.add_argument('--dicom-workers', type=int, default=None, help='DICOM元数据提取进程数（默认CPU核数）')
+    parser.add_argument('--job-workers', type=int, default=2, help='同时运行的后台任务数')
+    parser.add_argument('--ner-workers', type=int, default=None, help='批量/长文本NER进程数（默认CPU核数）')
+    parser.add_argument('--batch-workers', type=int, default=None, help='/api/process_batch 跨模态检测进程数（默认CPU核数）')
+    parser.add_argument('--no-warm-up', action='store_true', help='启动时不预热NER与DICOM处理服务')
+    parser.add_argument('--allow-dicom-root', action='append', default=[],
+                        help='允许通过 /api/batch_register_dicom 登记的服务端DICOM根目录（可重复）')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
     app = create_app({
         'UPLOAD_FOLDER': args.upload_folder,
-        'OUTPUT_DIR': args.output_dir
+        'OUTPUT_DIR': args.output_dir,
+        'DICOM_WORKERS': args.dicom_workers,
+        'JOB_WORKERS': args.job_workers,
+        'NER_WORKERS': args.ner_workers,
+        'BATCH_WORKERS': args.batch_workers,
+        'WARM_UP_SERVICES': not args.no_warm_up,
+        'DICOM_ALLOWED_ROOTS': args.allow_dicom_root
     })
-    app.run(host=args.host, port=args.port)
\ No newline at end of file
+    app.run(host=args.host, port=args.port)
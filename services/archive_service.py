@@ -0,0 +1,253 @@
+"""
+归档流式解包服务
+从请求流中逐个解出zip / tar(.gz/.bz2/.xz) 成员，无需先把整个归档落盘
+"""
+import re, struct, tarfile, zlib
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Data, Epilogue, Field, File
+from services.file_digest import write_chunks_sha256
+
+# 读取块大小
+BLOCK_SIZE = 1 << 20
+
+ZIP_LOCAL_HEADER = b"PK\x03\x04"
+ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+
+class ArchiveError(Exception):
+    """归档格式错误或损坏"""
+
+class _PushbackStream:
+    """只读、不可回退的流包装：支持把多读的数据放回（解压结束后的剩余字节）"""
+    
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.buffer = b""
+    
+    def read(self, n: int = -1) -> bytes:
+        if not self.buffer:
+            return self.stream.read(n)
+        if 0 <= n <= len(self.buffer):
+            data, self.buffer = self.buffer[:n], self.buffer[n:]
+            return data
+        data, self.buffer = self.buffer, b""
+        return data + self.stream.read(-1 if n < 0 else n - len(data))
+    
+    def read_exact(self, n: int) -> bytes:
+        """读满n个字节（流提前结束时返回实际读到的部分）"""
+        parts = []
+        while n > 0:
+            data = self.read(n)
+            if not data:
+                break
+            parts.append(data)
+            n -= len(data)
+        return b"".join(parts)
+    
+    def unread(self, data: bytes):
+        self.buffer = data + self.buffer
+
+class MultipartFileStream:
+    """
+    从multipart请求体中边读边取出一个文件字段的数据（其余字段丢弃），作为只读流交给归档解包
+    直接解析原始请求流，避免框架先把整个归档缓存到临时文件
+    """
+    
+    def __init__(self, stream: BinaryIO, boundary: bytes, field_name: str):
+        """
+        :param stream: 原始请求体
+        :param boundary: multipart分隔符（Content-Type的boundary参数）
+        :param field_name: 要读取的文件字段名
+        """
+        self.stream = stream
+        self.decoder = MultipartDecoder(boundary)
+        self.field_name = field_name
+        self.buffer = b""
+        self.in_field = False
+        self.found = False
+        self.done = False
+    
+    def _next_data(self) -> bytes:
+        """目标字段的下一段数据，字段结束时返回空字节"""
+        while not self.done:
+            try:
+                event = self.decoder.next_event()
+            except ValueError as e:
+                raise ArchiveError(f"multipart请求体解析失败: {e}")
+            if event is NEED_DATA:
+                self.decoder.receive_data(self.stream.read(BLOCK_SIZE) or None)
+            elif isinstance(event, (Field, File)):
+                self.in_field = isinstance(event, File) and event.name == self.field_name
+                self.found = self.found or self.in_field
+            elif isinstance(event, Data) and self.in_field:
+                self.done = not event.more_data
+                if event.data:
+                    return event.data
+            elif isinstance(event, Epilogue):
+                self.done = True
+        if not self.found:
+            raise ArchiveError(f"multipart请求中缺少文件字段 {self.field_name}")
+        return b""
+    
+    def read(self, n: int = -1) -> bytes:
+        while n < 0 or len(self.buffer) < n:
+            data = self._next_data()
+            if not data:
+                break
+            self.buffer += data
+        if n < 0:
+            n = len(self.buffer)
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+def _iter_zip_members(reader: _PushbackStream) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    """
+    按本地文件头顺序解析zip（不依赖末尾的中央目录），支持stored / deflate、数据描述符与zip64
+    """
+    while True:
+        signature = reader.read_exact(4)
+        if signature != ZIP_LOCAL_HEADER:
+            # 到达中央目录（或归档结束）
+            return
+        header = reader.read_exact(26)
+        if len(header) < 26:
+            raise ArchiveError("zip本地文件头不完整")
+        _, flags, method, _, _, crc, csize, usize, name_len, extra_len = struct.unpack("<HHHHHIIIHH", header)
+        raw_name = reader.read_exact(name_len)
+        extra = reader.read_exact(extra_len)
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        if flags & 0x1:
+            raise ArchiveError(f"不支持加密的zip成员: {name}")
+        
+        # zip64扩展字段中的真实大小
+        zip64 = False
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, size = struct.unpack("<HH", extra[pos:pos + 4])
+            if tag == 0x0001:
+                zip64 = True
+                values = extra[pos + 4:pos + 4 + size]
+                if usize == 0xFFFFFFFF and len(values) >= 8:
+                    usize = struct.unpack("<Q", values[:8])[0]
+                    values = values[8:]
+                if csize == 0xFFFFFFFF and len(values) >= 8:
+                    csize = struct.unpack("<Q", values[:8])[0]
+            pos += 4 + size
+        
+        has_descriptor = bool(flags & 0x8)
+        state = {"crc": 0}
+        
+        def iter_data():
+            if method == 0:
+                if has_descriptor and csize == 0:
+                    raise ArchiveError(f"无法流式读取大小未知的stored成员: {name}")
+                remaining = csize
+                while remaining > 0:
+                    data = reader.read(min(BLOCK_SIZE, remaining))
+                    if not data:
+                        raise ArchiveError(f"zip成员数据不完整: {name}")
+                    remaining -= len(data)
+                    state["crc"] = zlib.crc32(data, state["crc"])
+                    yield data
+            elif method == 8:
+                # deflate流自带结束标记，数据描述符模式下也能确定成员边界
+                decompressor = zlib.decompressobj(-15)
+                while not decompressor.eof:
+                    data = reader.read(BLOCK_SIZE)
+                    if not data:
+                        raise ArchiveError(f"zip成员数据不完整: {name}")
+                    try:
+                        out = decompressor.decompress(data)
+                    except zlib.error as e:
+                        raise ArchiveError(f"zip成员解压失败: {name}: {e}")
+                    if decompressor.eof:
+                        reader.unread(decompressor.unused_data)
+                    if out:
+                        state["crc"] = zlib.crc32(out, state["crc"])
+                        yield out
+            else:
+                raise ArchiveError(f"不支持的zip压缩方式 {method}: {name}")
+        
+        data_iter = iter_data()
+        yield name, data_iter
+        # 调用方未读完的数据在这里跳过
+        for _ in data_iter:
+            pass
+        
+        expected_crc = crc
+        if has_descriptor:
+            descriptor = reader.read_exact(4)
+            if descriptor != ZIP_DATA_DESCRIPTOR:
+                reader.unread(descriptor)
+            fields = reader.read_exact(20 if zip64 else 12)
+            expected_crc = struct.unpack("<I", fields[:4])[0]
+        if state["crc"] != expected_crc:
+            raise ArchiveError(f"zip成员CRC校验失败: {name}")
+
+def _iter_tar_members(reader: _PushbackStream) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    """流式读取tar（自动识别gz / bz2 / xz压缩）"""
+    try:
+        with tarfile.open(fileobj=reader, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                f = tar.extractfile(member)
+                yield member.name, iter(lambda: f.read(BLOCK_SIZE), b"")
+    except tarfile.TarError as e:
+        raise ArchiveError(f"tar归档读取失败: {e}")
+
+def iter_archive_members(stream: BinaryIO) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    """
+    按归档内顺序生成 (成员路径, 数据块迭代器)，根据文件头自动识别zip / tar
+    每个成员的数据须在取下一个成员之前读完（或放弃）
+    """
+    reader = _PushbackStream(stream)
+    head = reader.read_exact(4)
+    reader.unread(head)
+    if not head:
+        raise ArchiveError("归档为空")
+    if head == ZIP_LOCAL_HEADER:
+        yield from _iter_zip_members(reader)
+    else:
+        yield from _iter_tar_members(reader)
+
+def _flat_member_name(name: str) -> str:
+    """将成员路径展平为安全的文件名（目录分隔符替换为下划线，避免重名与路径穿越）"""
+    parts = [p for p in re.split(r"[\\/]+", name) if p not in ("", ".", "..")]
+    return re.sub(r"[^\w.\-]", "_", "_".join(parts))
+
+def extract_archive_stream(stream: BinaryIO, dest_dir: Path, suffix: str = ".dcm",
+                           digests: Optional[Dict[Path, str]] = None) -> Iterator[Path]:
+    """
+    从流中逐个解出指定后缀的成员到目标目录，每写完一个成员立即返回其路径
+    :param stream: 归档字节流（请求体等不可回退的流）
+    :param dest_dir: 目标目录
+    :param suffix: 只解出该后缀的成员（不区分大小写）
+    :param digests: 传入时，每个成员写盘的同时计算SHA-256，在返回路径前写入 {路径: 摘要}
+    解包中途出错（CRC校验失败、成员不完整、归档损坏等）时，删除本次调用写出的全部文件（含写了一半的成员）后再抛出
+    """
+    created_dir = not dest_dir.exists()
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    try:
+        for name, chunks in iter_archive_members(stream):
+            if not name.lower().endswith(suffix) or name.endswith("/"):
+                continue
+            target = dest_dir / _flat_member_name(name)
+            if target.exists():
+                target = target.with_name(f"{len(written):06d}_{target.name}")
+            written.append(target)
+            digest = write_chunks_sha256(chunks, target)
+            if digests is not None:
+                digests[target] = digest
+            yield target
+    except Exception:
+        for path in written:
+            path.unlink(missing_ok=True)
+            if digests is not None:
+                digests.pop(path, None)
+        if created_dir and not any(dest_dir.iterdir()):
+            dest_dir.rmdir()
+        print(f"[WARN] 归档解包失败，已删除本次写出的 {len(written)} 个文件")
+        raise
+    print(f"[INFO] 归档解包完成: {len(written)} 个{suffix}文件")
@@ -37,8 +37,9 @@ class CleanupService:
             for file_path in self.upload_dir.glob('**/*'):
                 if file_path.is_file():
                     try:
-                        # 获取文件修改时间
-                        file_mtime = datetime.fromtimestamp(file_path.stat().st_mtime)
+                        # 获取文件修改时间（登记目录的硬链接/符号链接保留原文件的mtime，以链接创建时间ctime为准）
+                        st = file_path.lstat()
+                        file_mtime = datetime.fromtimestamp(max(st.st_mtime, st.st_ctime))
                         
                         # 如果文件过期，删除它
                         if file_mtime < cutoff_time:
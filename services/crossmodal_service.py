@@ -1,12 +1,25 @@
+import os
+import csv
 import torch
 import numpy as np
 import pandas as pd
 import re
+import zlib
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional, Callable
 from dataclasses import dataclass
 from time import time
 import json
+from services.table_reader import get_table_dialect, load_table
+from services.span_resolver import resolve_overlaps
+from services.service_registry import ServiceRegistry
+from services.join_engine import DicomFileIndex
+from services.roi_service import DicomResultCache
 
 @dataclass
 class DetectionResult:
@@ -18,41 +31,119 @@ class DetectionResult:
     patient_id_matches: List[Dict]
     cross_modal_risks: List[Dict]
 
+class BatchResultWriter:
+    """
+    批量结果的流式写出：检测结果逐条追加到JSON数组（<output_path>_results.json，格式与一次性json.dump相同），
+    匹配记录逐行写入CSV；每条写完即刷新到文件，close时补上数组结尾，处理中途失败时已完成的部分仍是合法JSON
+    """
+    
+    MATCHED_FIELDS = ['csv_row_id', 'dicom_path', 'patient_id_match', 'entities_detected', 'cross_modal_risks']
+    
+    def __init__(self, output_path: str):
+        self.results_path = f"{output_path}_results.json"
+        self.matched_path = f"{output_path}_matched.csv"
+        self._results_file = open(self.results_path, 'w', encoding='utf-8')
+        self._results_file.write("[")
+        self._matched_file = open(self.matched_path, 'w', encoding='utf-8', newline='')
+        self._matched = csv.DictWriter(self._matched_file, fieldnames=self.MATCHED_FIELDS)
+        self._matched.writeheader()
+        self.count = 0
+    
+    def write(self, match_record: Dict, detection_result: Dict):
+        # 与 json.dump(results, indent=2) 的输出逐字节一致：元素之间 ",\n"，元素整体缩进两格
+        element = json.dumps(detection_result, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self._results_file.write(("," if self.count else "") + "\n  " + element)
+        self._matched.writerow(match_record)
+        self._results_file.flush()
+        self._matched_file.flush()
+        self.count += 1
+    
+    def close(self):
+        self._results_file.write("\n]" if self.count else "]")
+        self._results_file.close()
+        self._matched_file.close()
+
 class CrossModalAttentionService:
-    def __init__(self, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    # CSV敏感列映射（列名 -> 实体类型），Path列用于跨模态匹配
+    SENSITIVE_COLUMNS = {
+        'Path': 'PATH',
+        'Name': 'NAME',
+        'Sex': 'SEX',
+        'Age': 'AGE',
+        'Phone': 'PHONE',
+        'ID_Number': 'ID',
+        'Address': 'ADDRESS'
+    }
+    
+    # 实体类型基础置信度（ID、PATH > NAME > 其他）
+    ENTITY_BASE_CONFIDENCE = {
+        'PATIENT_ID': 0.99,   # 最高 - 主键
+        'PATH': 0.99,         # 最高 - 文件路径
+        'ID': 0.95,           # 很高 - 身份证号
+        'PHONE': 0.92,        # 高 - 电话号码
+        'NAME': 0.90,         # 高 - 姓名
+        'PATIENT_SEX': 0.88,  # 中高 - 性别
+        'PATIENT_AGE': 0.85,  # 中高 - 年龄
+        'ADDRESS': 0.80,      # 中 - 地址
+    }
+    
+    # 批量处理：少于该行数时在当前进程处理；每个工作进程最多排队的行数（乱序完成的结果在此窗口内按输入顺序重排）
+    BATCH_MIN_PARALLEL_ROWS = 64
+    BATCH_INFLIGHT_PER_WORKER = 8
+    
+    def __init__(self, device='cuda' if torch.cuda.is_available() else 'cpu',
+                 registry: Optional[ServiceRegistry] = None, batch_workers: Optional[int] = None):
+        """
+        :param device: 计算设备
+        :param registry: 共享服务注册表（由create_app创建；默认新建一个）
+        :param batch_workers: process_batch_data的进程池大小（默认CPU核数，<=1时串行处理）
+        """
         self.device = device
+        self.services = registry or ServiceRegistry(device=device)
+        self.batch_workers = batch_workers or os.cpu_count() or 1
+        self._executors: List[ProcessPoolExecutor] = []
+        self._executor_lock = threading.Lock()
+        # 批次编号：工作进程按编号为每个批次单独建DICOM缓存，批次结束时释放
+        self._batch_ids = itertools.count()
         # 简化的模型初始化，避免下载大型预训练模型
         self.text_model = None
         self.image_model = None
         self.tokenizer = None
-        
-    def detect_phi_mapping(self, text: str, dicom_path: Optional[str] = None) -> Dict:
+    
+    def detect_phi_mapping(self, text: str, dicom_path: Optional[str] = None,
+                           dicom_cache: Optional[DicomResultCache] = None) -> Dict:
         """
         检测跨模态隐私关联
         :param text: 诊断报告文本
         :param dicom_path: DICOM文件路径
+        :param dicom_cache: 批量处理时共享的DICOM解析结果缓存（同一文件只解析一次）
         :return: 检测结果字典
         """
         start_time = time()
         
         # 文本实体识别
-        from services.ner_service import NERService
-        ner_service = NERService()
-        text_entities = ner_service.detect_from_text(text)
+        # 同一区域只保留一个实体，后续匹配与风险评估不再重复处理
+        text_entities = resolve_overlaps(self.services.ner.detect_from_text(text))
         
         # DICOM处理
-        image_features = None
+        image_features_serializable = None
         roi_mask = None
+        pixel_error = None
         dicom_metadata = {}
         
         if dicom_path and Path(dicom_path).exists():
-            from services.roi_service import DicomProcessor
-            processor = DicomProcessor(device=self.device)
-            dicom_result = processor.process_dicom(Path(dicom_path), try_burnedin=True)
+            if dicom_cache is not None:
+                dicom_result = dicom_cache.result(Path(dicom_path), try_burnedin=True)
+            else:
+                processor = self.services.dicom_processor(self.device)
+                dicom_result = processor.process_dicom(Path(dicom_path), try_burnedin=True)
             
             if dicom_result:
-                image_features = dicom_result.normalized_tensor
+                # tensor只需形状信息（由header推出，不生成）；ROI检测后释放像素，缓存中只保留掩码
+                image_features_serializable = dicom_result.tensor_info()
                 roi_mask = dicom_result.roi_mask
+                pixel_error = dicom_result.pixel_error
+                dicom_result.release_pixels()
                 dicom_metadata = {
                     'patient_id': dicom_result.patient_id,
                     'accession': dicom_result.accession,
@@ -68,15 +159,6 @@ class CrossModalAttentionService:
         # 计算风险指标
         metrics = self._calculate_risk_metrics(text_entities, mappings, time() - start_time)
         
-        # 处理Tensor对象，转换为可序列化的格式
-        image_features_serializable = None
-        if image_features is not None:
-            image_features_serializable = {
-                "shape": list(image_features.shape),
-                "dtype": str(image_features.dtype),
-                "device": str(image_features.device)
-            }
-        
         roi_mask_serializable = None
         if roi_mask is not None:
             roi_mask_serializable = {
@@ -89,71 +171,159 @@ class CrossModalAttentionService:
             "text_entities": text_entities,
             "image_regions": {
                 "roi_mask": roi_mask_serializable,
-                "image_features": image_features_serializable
+                "image_features": image_features_serializable,
+                "pixel_error": pixel_error
             },
             "mappings": mappings,
             "metrics": metrics,
             "cross_modal_risks": self._assess_cross_modal_risks(text_entities, dicom_metadata)
         }
     
-    def process_batch_data(self, csv_path: str, dicom_dir: str, output_path: str) -> Dict:
+    def process_batch_data(self, csv_path: str, dicom_dir: str, output_path: str,
+                           progress_callback: Optional[Callable[..., None]] = None) -> Dict:
         """
         批量处理CSV和DICOM数据，实现跨模态检测
+        行数较多时分发到进程池并行检测，结果按输入顺序流式写出（<output_path>_results.json、_matched.csv）
         :param csv_path: CSV文件路径
         :param dicom_dir: DICOM文件目录
         :param output_path: 输出文件路径
+        :param progress_callback: 进度回调 (已处理行数, 总行数, 已处理字节数)
         :return: 处理结果
         """
         try:
             # 读取CSV数据
-            df = pd.read_csv(csv_path, encoding='utf-8', encoding_errors='ignore')
+            df = load_table(csv_path)
             
-            # 处理DICOM文件
-            dicom_dir_path = Path(dicom_dir)
-            dicom_files = list(dicom_dir_path.glob("*.dcm"))
+            # 本批次的DICOM解析结果缓存：同一文件检测时只解码一次像素（header随索引保存，不再重读）
+            dicom_cache = DicomResultCache(self.services.dicom_processor(self.device))
             
-            results = []
-            matched_data = []
+            # 为DICOM目录一次建立查找索引（文件名token + header中的PatientID / AccessionNumber）
+            dicom_index = self._build_dicom_index(Path(dicom_dir))
             
-            for _, row in df.iterrows():
-                # 查找对应的DICOM文件
-                dicom_path = self._find_matching_dicom(row, dicom_files)
-                
-                if dicom_path:
-                    # 执行跨模态检测
-                    detection_result = self.detect_phi_mapping(
-                        text=str(row.get('text', '')),
-                        dicom_path=str(dicom_path)
-                    )
-                    
-                    # 记录匹配结果
-                    match_record = {
+            # 逐行查找对应的DICOM文件（索引查找），未匹配的行直接记录
+            tasks = []
+            unmatched_data = []
+            for i, (_, row) in enumerate(df.iterrows()):
+                dicom_path = self._find_matching_dicom(row, dicom_index)
+                if dicom_path is None:
+                    unmatched_data.append({
                         'csv_row_id': row.name,
-                        'dicom_path': str(dicom_path),
-                        'patient_id_match': self._check_patient_id_match(row, dicom_path),
+                        'patient_id': row.get('patient_id', ''),
+                        'accession': row.get('accession', '')
+                    })
+                else:
+                    tasks.append((i, row.name, str(row.get('text', '')), str(dicom_path), row.get('patient_id')))
+            
+            # 执行跨模态检测，按输入顺序逐条写出
+            writer = BatchResultWriter(output_path)
+            bytes_done = 0
+            try:
+                for (i, row_id, _, dicom_path, patient_id), detection_result in zip(
+                        tasks, self._run_batch_tasks(tasks, dicom_cache)):
+                    # 患者ID核对只需header（建索引时已读到），在当前进程完成
+                    match_record = {
+                        'csv_row_id': row_id,
+                        'dicom_path': dicom_path,
+                        'patient_id_match': self._check_patient_id_match({'patient_id': patient_id},
+                                                                         dicom_index.header(Path(dicom_path))),
                         'entities_detected': len(detection_result['text_entities']),
                         'cross_modal_risks': detection_result['cross_modal_risks']
                     }
-                    
-                    matched_data.append(match_record)
-                    results.append(detection_result)
+                    writer.write(match_record, detection_result)
+                    bytes_done += os.path.getsize(dicom_path)
+                    if progress_callback:
+                        progress_callback(i + 1, len(df), bytes_done)
+            finally:
+                writer.close()
+            
+            if progress_callback:
+                progress_callback(len(df), len(df), bytes_done)
             
-            # 保存结果
-            self._save_batch_results(matched_data, results, output_path)
+            if unmatched_data:
+                pd.DataFrame(unmatched_data).to_csv(f"{output_path}_unmatched.csv", index=False)
+                print(f"[WARN] {len(unmatched_data)}/{len(df)} 行未找到对应的DICOM文件，见 {output_path}_unmatched.csv")
             
             return {
-                "processed_count": len(results),
-                "matched_count": len(matched_data),
+                "processed_count": writer.count,
+                "matched_count": writer.count,
+                "unmatched_count": len(unmatched_data),
+                "dicom_count": dicom_index.file_count,
+                "dicom_cache": dict(dicom_cache.stats),
                 "output_path": output_path,
+                "results_path": writer.results_path,
+                "matched_path": writer.matched_path,
                 "status": "success"
             }
-            
+        
         except Exception as e:
             return {
                 "error": str(e),
                 "status": "failed"
             }
     
+    def _run_batch_tasks(self, tasks: List[Tuple], dicom_cache: DicomResultCache) -> Iterator[Dict]:
+        """
+        按输入顺序生成每个匹配行的检测结果
+        并行时按DICOM路径哈希把行固定分发到同一个工作进程：同一文件只在一个进程中解码，其余行命中该进程的缓存；
+        最多同时提交 进程数 × BATCH_INFLIGHT_PER_WORKER 行，按提交顺序取结果，内存占用与批次大小无关。
+        工作进程中的缓存与dicom_cache一样只在本批次内有效（并发的批次各用各的，结束后释放），
+        命中情况累加到dicom_cache.stats
+        """
+        if self.batch_workers <= 1 or len(tasks) < self.BATCH_MIN_PARALLEL_ROWS:
+            for task in tasks:
+                yield _detect_batch_row(self, dicom_cache, task)
+            return
+        
+        executors = self._get_executors()
+        batch_id = next(self._batch_ids)
+        window = self.batch_workers * self.BATCH_INFLIGHT_PER_WORKER
+        pending = deque()
+        try:
+            for task in tasks:
+                executor = executors[zlib.crc32(task[3].encode('utf-8')) % len(executors)]
+                pending.append(executor.submit(_batch_row_task, batch_id, task))
+                if len(pending) >= window:
+                    yield self._merge_worker_stats(dicom_cache, pending.popleft().result())
+            while pending:
+                yield self._merge_worker_stats(dicom_cache, pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+            # 单进程池按提交顺序执行：释放任务排在本批次所有行之后
+            for executor in executors:
+                try:
+                    executor.submit(_end_batch_task, batch_id)
+                except RuntimeError:  # 进程池已关闭
+                    pass
+    
+    @staticmethod
+    def _merge_worker_stats(dicom_cache: DicomResultCache, outcome: Tuple[Dict, Dict]) -> Dict:
+        """累加工作进程返回的缓存统计，返回检测结果"""
+        result, stats = outcome
+        for key, value in stats.items():
+            dicom_cache.stats[key] += value
+        return result
+    
+    def _get_executors(self) -> List[ProcessPoolExecutor]:
+        """每个分片一个单进程的进程池（按DICOM路径分片），工作进程使用与主进程相同的设备"""
+        with self._executor_lock:
+            if not self._executors:
+                # CUDA不能在fork出的子进程中初始化
+                mp_context = multiprocessing.get_context('spawn') if self.device != 'cpu' else None
+                self._executors = [
+                    ProcessPoolExecutor(max_workers=1, mp_context=mp_context,
+                                        initializer=_init_batch_worker, initargs=(self.device,))
+                    for _ in range(self.batch_workers)
+                ]
+            return self._executors
+    
+    def shutdown(self):
+        """关闭批量处理进程池（create_app通过atexit注册的shutdown_services调用）"""
+        with self._executor_lock:
+            executors, self._executors = self._executors, []
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
     def _match_text_dicom_entities(self, text_entities: List[Dict], dicom_metadata: Dict) -> List[Dict]:
         """匹配文本实体和DICOM元数据"""
         mappings = []
@@ -272,44 +442,25 @@ class CrossModalAttentionService:
         
         return risks
     
-    def _find_matching_dicom(self, row: pd.Series, dicom_files: List[Path]) -> Optional[Path]:
-        """根据CSV行数据查找匹配的DICOM文件"""
-        # 尝试多种匹配策略
-        patient_id = row.get('patient_id', '')
-        accession = row.get('accession', '')
-        
-        for dicom_file in dicom_files:
-            # 基于文件名匹配
-            if patient_id and patient_id in dicom_file.name:
-                return dicom_file
-            if accession and accession in dicom_file.name:
-                return dicom_file
-        
-        # 如果找不到匹配，返回第一个文件（用于测试）
-        return dicom_files[0] if dicom_files else None
+    def _build_dicom_index(self, dicom_dir: Path) -> DicomFileIndex:
+        """扫描目录下的DICOM文件，用元数据提取进程池只读header建立查找索引（header记录随索引保存供后续复用）"""
+        dicom_files = sorted(dicom_dir.glob("*.dcm"))
+        metadata_list, _ = self.services.dicom_extractor.extract(dicom_files)
+        index = DicomFileIndex(dicom_files, {Path(m['filepath']): m for m in metadata_list})
+        print(f"[INFO] DICOM索引: {index.file_count} 个文件, PatientID {len(index.by_patient_id)} 个, "
+              f"AccessionNumber {len(index.by_accession)} 个, 忽略多文件共有的文件名token {len(index.ambiguous_tokens)} 个")
+        return index
     
-    def _check_patient_id_match(self, row: pd.Series, dicom_path: Path) -> bool:
-        """检查CSV和DICOM中的患者ID是否匹配"""
-        try:
-            from services.roi_service import DicomProcessor
-            processor = DicomProcessor()
-            dicom_result = processor.process_dicom(dicom_path)
-            
-            if dicom_result and row.get('patient_id'):
-                return str(dicom_result.patient_id) == str(row['patient_id'])
-        except Exception:
-            pass
-        return False
+    def _find_matching_dicom(self, row: pd.Series, dicom_index: DicomFileIndex) -> Optional[Path]:
+        """根据CSV行的patient_id / accession查找匹配的DICOM文件（找不到返回None，不再回退到第一个文件）"""
+        return dicom_index.lookup(row.get('patient_id'), row.get('accession'))
     
-    def _save_batch_results(self, matched_data: List[Dict], results: List[Dict], output_path: str):
-        """保存批量处理结果"""
-        # 保存匹配数据
-        matched_df = pd.DataFrame(matched_data)
-        matched_df.to_csv(f"{output_path}_matched.csv", index=False)
-        
-        # 保存检测结果
-        with open(f"{output_path}_results.json", 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+    @staticmethod
+    def _check_patient_id_match(row: Dict, header: Optional[Dict]) -> bool:
+        """检查CSV和DICOM中的患者ID是否匹配（使用建索引时读到的header记录，不再读文件）"""
+        if header and row.get('patient_id'):
+            return str(header.get('patient_id') or '') == str(row['patient_id'])
+        return False
     
     def process_csv_detection(self, csv_path: str, dicom_path: Optional[str] = None) -> Dict:
         """
@@ -322,98 +473,33 @@ class CrossModalAttentionService:
         start_time = time.time()  # 开始计时
         
         try:
-            # 读取CSV/Excel文件（自动检测格式）
-            df = None
-            
-            # 先检查是否是Excel文件
-            try:
-                # 尝试读取为Excel（先尝试openpyxl，失败则用xlrd读取旧格式.xls）
-                try:
-                    df = pd.read_excel(csv_path, engine='openpyxl')
-                    print(f"成功读取Excel文件(openpyxl): {csv_path}")
-                except:
-                    df = pd.read_excel(csv_path, engine='xlrd')
-                    print(f"成功读取Excel文件(xlrd): {csv_path}")
-            except Exception as excel_error:
-                print(f"Excel读取失败，尝试CSV: {excel_error}")
-                # 如果不是Excel，尝试CSV（自动检测编码和分隔符）
-                # 常见分隔符：逗号、制表符、空格
-                separators = [',', '\t', ' ', ';', '|']
-                encodings = ['utf-8', 'gbk', 'latin1', 'gb2312', 'utf-16']
-                
-                for encoding in encodings:
-                    for sep in separators:
-                        try:
-                            df = pd.read_csv(csv_path, encoding=encoding, sep=sep, engine='python')
-                            # 检查是否成功读取（至少有2列）
-                            if df.shape[1] >= 2:
-                                print(f"成功读取CSV文件 - 编码:{encoding}, 分隔符:{repr(sep)}, 形状:{df.shape}")
-                                break
-                        except Exception:
-                            continue
-                    if df is not None and df.shape[1] >= 2:
-                        break
-                
-                # 如果上面都失败，最后尝试自动检测
-                if df is None or df.shape[1] < 2:
-                    try:
-                        df = pd.read_csv(csv_path, encoding='utf-8', sep=None, engine='python')
-                        print(f"成功读取CSV文件(自动检测): {csv_path}, 形状:{df.shape}")
-                    except:
-                        pass
+            # 读取CSV/Excel文件：按魔数与样本嗅探格式、编码和分隔符后一次解析（结果按文件缓存），
+            # 之后从列式缓存读取
+            dialect = get_table_dialect(csv_path)
+            df = load_table(csv_path)
+            print(f"成功读取{dialect.format.upper()}文件 - 编码:{dialect.encoding}, 分隔符:{dialect.sep!r}, 形状:{df.shape}")
             
             if df is None or df.shape[1] < 2:
                 raise ValueError(f"无法读取文件或文件格式不正确: {csv_path}")
             
-            # 按列名精确提取敏感信息
-            entities = []
-            entity_id = 0
-            
-            # 定义敏感信息列映射
-            sensitive_cols = {
-                'Path': 'PATH',  # 添加Path列用于跨模态匹配
-                'Name': 'NAME',
-                'Sex': 'SEX', 
-                'Age': 'AGE',
-                'Phone': 'PHONE',
-                'ID_Number': 'ID',
-                'Address': 'ADDRESS'
-            }
-            
-            for idx, row in df.iterrows():
-                for col_name, entity_type in sensitive_cols.items():
-                    if col_name in df.columns and pd.notna(row[col_name]):
-                        value = str(row[col_name]).strip()
-                        if value and value != '':
-                            # 根据实体类型和数据质量动态计算置信度
-                            confidence = self._calculate_entity_confidence(entity_type, value, col_name)
-                            
-                            entities.append({
-                                'type': entity_type,
-                                'text': value,
-                                'start': entity_id,
-                                'end': entity_id + len(value),
-                                'confidence': confidence,
-                                'row_index': idx,
-                                'column': col_name
-                            })
-                            entity_id += 1
+            # 按列名精确提取敏感信息（列式：逐列向量化校验并计算置信度）
+            entities = self._extract_column_entities(df, self.SENSITIVE_COLUMNS)
             
             print(f"CSV行数: {len(df)}")
             print(f"检测到实体数量: {len(entities)}")
             
-            # 构建文本用于DICOM匹配
-            all_text = " ".join([str(val) for _, row in df.iterrows() for val in row if pd.notna(val)])
+            # 文本总长度（等价于按行拼接所有非空值，不实际构建字符串）
+            all_text_length = self._joined_text_length(df)
             
             # 如果有DICOM，处理DICOM元数据
             dicom_metadata = {}
             roi_mask_serializable = None
             image_features_serializable = None
             roi_type = None
+            pixel_error = None
             
             if dicom_path and Path(dicom_path).exists():
-                from services.roi_service import DicomProcessor
-                processor = DicomProcessor(device=self.device)
+                processor = self.services.dicom_processor(self.device)
                 dicom_result = processor.process_dicom(Path(dicom_path), try_burnedin=True)
                 
                 if dicom_result:
@@ -435,15 +521,12 @@ class CrossModalAttentionService:
                             "has_roi": bool(dicom_result.roi_mask.any()),
                             "roi_type": dicom_result.roi_type or "unknown"
                         }
-                        roi_type = dicom_result.roi_type
+                    roi_type = dicom_result.roi_type
+                    pixel_error = dicom_result.pixel_error
                     
-                    # 处理image features
-                    if dicom_result.normalized_tensor is not None:
-                        image_features_serializable = {
-                            "shape": list(dicom_result.normalized_tensor.shape),
-                            "dtype": str(dicom_result.normalized_tensor.dtype),
-                            "device": str(dicom_result.normalized_tensor.device)
-                        }
+                    # 处理image features（只序列化形状信息，不生成tensor）
+                    image_features_serializable = dicom_result.tensor_info()
+                    dicom_result.release_pixels()
             
             # 跨模态匹配
             mappings = self._match_text_dicom_entities(entities, dicom_metadata)
@@ -460,7 +543,8 @@ class CrossModalAttentionService:
                 'image_regions': {
                     'roi_mask': roi_mask_serializable,
                     'image_features': image_features_serializable,
-                    'roi_type': roi_type
+                    'roi_type': roi_type,
+                    'pixel_error': pixel_error
                 },
                 'mappings': mappings,
                 'metrics': metrics,
@@ -493,7 +577,7 @@ class CrossModalAttentionService:
                 "file_path": csv_path,
                 "row_count": len(df),
                 "columns": list(df.columns),
-                "processed_text_length": len(all_text)
+                "processed_text_length": all_text_length
             }
             
             return result
@@ -537,6 +621,115 @@ class CrossModalAttentionService:
         tensor = torch.FloatTensor(pixel_array).unsqueeze(0).unsqueeze(0).to(self.device)
         return pixel_array, tensor
     
+    def _extract_column_entities(self, df: pd.DataFrame, sensitive_cols: Dict[str, str]) -> List[Dict]:
+        """
+        列式提取敏感实体：每列按唯一值做一次向量化校验与置信度计算，实体按行、再按列顺序排列
+        :param sensitive_cols: 列名 -> 实体类型
+        :return: 实体列表（start/end为实体序号偏移，与逐行提取结果一致）
+        """
+        row_labels = df.index.to_numpy()
+        positions, col_orders, texts, confidences, types, columns = [], [], [], [], [], []
+        for order, (col_name, entity_type) in enumerate(sensitive_cols.items()):
+            if col_name not in df.columns:
+                continue
+            codes, strings = self._factorize_cells(df[col_name])
+            values = pd.Series(strings, dtype=object).str.strip()
+            # 空值（编码-1）与去空白后为空的值不产生实体
+            keep_unique = np.append((values != '').to_numpy(), False)
+            rows = np.flatnonzero(keep_unique[codes])
+            if not len(rows):
+                continue
+            value_codes = codes[rows]
+            
+            positions.append(rows)
+            col_orders.append(np.full(len(rows), order))
+            texts.append(values.to_numpy()[value_codes])
+            confidences.append(self._column_confidence(entity_type, values)[value_codes])
+            types.append(np.full(len(rows), entity_type, dtype=object))
+            columns.append(np.full(len(rows), col_name, dtype=object))
+        
+        if not positions:
+            return []
+        
+        positions = np.concatenate(positions)
+        order = np.lexsort((np.concatenate(col_orders), positions))
+        texts = np.concatenate(texts)[order].tolist()
+        confidences = np.concatenate(confidences)[order].tolist()
+        types = np.concatenate(types)[order].tolist()
+        columns = np.concatenate(columns)[order].tolist()
+        row_indices = row_labels[positions[order]].tolist()
+        
+        return [
+            {
+                'type': entity_type,
+                'text': value,
+                'start': entity_id,
+                'end': entity_id + len(value),
+                'confidence': confidence,
+                'row_index': row_index,
+                'column': col_name
+            }
+            for entity_id, (entity_type, value, confidence, row_index, col_name)
+            in enumerate(zip(types, texts, confidences, row_indices, columns))
+        ]
+    
+    @staticmethod
+    def _factorize_cells(series: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按唯一值分解一列：返回 (每行的唯一值编码，空值为-1; 各唯一值的str()结果)
+        表格中的取值高度重复，字符串转换和校验只需对唯一值做一次
+        """
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        return codes, np.array([str(v) for v in uniques], dtype=object)
+    
+    def _joined_text_length(self, df: pd.DataFrame) -> int:
+        """按行用空格拼接所有非空单元格后的字符串长度"""
+        total_chars = 0
+        total_cells = 0
+        for col in df.columns:
+            codes, strings = self._factorize_cells(df[col])
+            counts = np.bincount(codes[codes >= 0], minlength=len(strings))
+            lengths = np.fromiter((len(v) for v in strings), dtype=np.int64, count=len(strings))
+            total_cells += int(counts.sum())
+            total_chars += int((counts * lengths).sum())
+        return total_chars + max(total_cells - 1, 0)
+    
+    def _column_confidence(self, entity_type: str, values: pd.Series) -> np.ndarray:
+        """
+        _calculate_entity_confidence 的向量化版本：对一整列值计算置信度
+        :param values: 已去除首尾空白的字符串列（通常为一列的唯一值）
+        """
+        base_confidence = self.ENTITY_BASE_CONFIDENCE.get(entity_type, 0.75)
+        boost = np.zeros(len(values))
+        
+        if entity_type == 'PATIENT_ID':
+            boost += np.where(values.str.lower().str.match(r'^patient\d{5}$'), 0.01, 0.0)
+        elif entity_type == 'PATH':
+            has_patient = values.str.lower().str.contains('patient', regex=False)
+            boost += np.where(has_patient & values.str.contains(r'\d{5}'), 0.01, 0.0)
+        elif entity_type == 'PHONE':
+            boost += np.select([values.str.match(r'^1[3-9]\d{9}$'), values.str.match(r'^\d{11}$')], [0.05, 0.02], 0.0)
+        elif entity_type == 'ID':
+            boost += np.select([values.str.match(r'^\d{17}[\dXx]$'), values.str.match(r'^\d{15}$')], [0.04, 0.03], 0.0)
+        elif entity_type == 'PATIENT_SEX':
+            boost += np.where(values.str.upper().isin(['M', 'F', 'MALE', 'FEMALE', '男', '女']), 0.07, 0.0)
+        elif entity_type == 'PATIENT_AGE':
+            # int(value) 可解析为合理年龄时加分，无法解析时减分
+            is_int = values.str.match(r'^[+-]?\d+$').to_numpy()
+            ages = pd.to_numeric(values.where(is_int), errors='coerce').to_numpy()
+            boost += np.where(is_int, np.where((ages > 0) & (ages < 120), 0.10, 0.0), -0.10)
+        
+        if entity_type == 'NAME':
+            lengths = values.str.len().to_numpy()
+            boost += np.where((lengths >= 2) & (lengths <= 50), 0.05, -0.10)
+        
+        # 最终置信度（确保在0.5-1.0范围内），取值种类很少，按唯一值取整
+        raw = np.clip(base_confidence + boost, 0.5, 1.0)
+        if not len(raw):
+            return raw
+        unique, inverse = np.unique(raw, return_inverse=True)
+        return np.array([round(float(v), 2) for v in unique])[inverse]
+    
     def _calculate_entity_confidence(self, entity_type: str, value: str, column_name: str) -> float:
         """
         根据实体类型和数据质量动态计算置信度
@@ -549,16 +742,7 @@ class CrossModalAttentionService:
         import re
         
         # 基础置信度（根据实体类型）
-        base_confidence = {
-            'PATIENT_ID': 0.99,   # 最高 - 主键
-            'PATH': 0.99,         # 最高 - 文件路径
-            'ID': 0.95,           # 很高 - 身份证号
-            'PHONE': 0.92,        # 高 - 电话号码
-            'NAME': 0.90,         # 高 - 姓名
-            'PATIENT_SEX': 0.88,  # 中高 - 性别
-            'PATIENT_AGE': 0.85,  # 中高 - 年龄
-            'ADDRESS': 0.80,      # 中 - 地址
-        }.get(entity_type, 0.75)
+        base_confidence = self.ENTITY_BASE_CONFIDENCE.get(entity_type, 0.75)
         
         # 数据质量调整
         quality_boost = 0.0
@@ -615,8 +799,7 @@ class CrossModalAttentionService:
     
     def _extract_entities(self, text: str) -> List[Dict]:
         """增强的实体识别"""
-        from services.ner_service import ClinicalNER
-        entities = ClinicalNER().detect(text)
+        entities = resolve_overlaps(self.services.clinical_ner.detect(text))
         
         # 确保关键实体识别
         required_types = ['NAME', 'ID', 'PHONE']
@@ -627,8 +810,7 @@ class CrossModalAttentionService:
     
     def _generate_roi_mask(self, pixel_array: np.ndarray) -> np.ndarray:
         """生成ROI掩码"""
-        from services.roi_service import ROISegmenter
-        return ROISegmenter().segment(pixel_array)
+        return self.services.roi_segmenter.segment(pixel_array)
     
     def _align_entities(self, entities: List[Dict], image_tensor: torch.Tensor) -> List[Dict]:
         """跨模态实体对齐"""
@@ -678,4 +860,32 @@ class CrossModalAttentionService:
             'precision': sum(y_pred) / (len(y_pred) + 1e-6),
             'recall': sum(y_pred) / (sum(y_true) + 1e-6),
             'processing_time': processing_time
-        }
\ No newline at end of file
+        }
+
+# 工作进程内复用的服务实例，以及按批次编号分开的DICOM缓存（批次结束时由_end_batch_task释放）
+_worker_service: Optional[CrossModalAttentionService] = None
+_worker_caches: Dict[int, DicomResultCache] = {}
+
+def _detect_batch_row(service: CrossModalAttentionService, dicom_cache: DicomResultCache, task: Tuple) -> Dict:
+    """对一个匹配行执行跨模态检测"""
+    _, _, text, dicom_path, _ = task
+    return service.detect_phi_mapping(text=text, dicom_path=dicom_path, dicom_cache=dicom_cache)
+
+def _init_batch_worker(device: str):
+    """工作进程初始化：按主进程的设备创建服务实例"""
+    global _worker_service
+    registry = ServiceRegistry(device=device, ner_workers=1, dicom_workers=1)
+    _worker_service = CrossModalAttentionService(device=device, registry=registry, batch_workers=1)
+
+def _batch_row_task(batch_id: int, task: Tuple) -> Tuple[Dict, Dict]:
+    """工作进程任务：用本批次的DICOM缓存检测一个匹配行，返回 (检测结果, 本行的DICOM缓存统计增量)"""
+    cache = _worker_caches.get(batch_id)
+    if cache is None:
+        cache = _worker_caches[batch_id] = DicomResultCache(_worker_service.services.dicom_processor(_worker_service.device))
+    before = dict(cache.stats)
+    result = _detect_batch_row(_worker_service, cache, task)
+    return result, {key: value - before[key] for key, value in cache.stats.items()}
+
+def _end_batch_task(batch_id: int):
+    """工作进程任务：批次结束，释放该批次的DICOM缓存"""
+    _worker_caches.pop(batch_id, None)
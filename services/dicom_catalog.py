@@ -0,0 +1,195 @@
+"""
+DICOM元数据目录服务
+上传时将header记录写入带索引的SQLite目录，批量检测只需传dicom_id即可在服务端连接
+"""
+import sqlite3, json, time, threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+import pandas as pd
+from services.join_engine import iter_lookup_matches
+
+class DicomCatalog:
+    """DICOM header目录（按 dicom_id / patient_id / SOPInstanceUID / AccessionNumber 建索引）"""
+    
+    # 单条IN查询的最大参数个数（低于SQLite默认上限）
+    LOOKUP_BATCH = 500
+    
+    def __init__(self, db_path: str):
+        """
+        初始化目录
+        :param db_path: 目录数据库路径（如 storage_repo/db/dicom_catalog.sqlite）
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = self._init_db()
+    
+    def _init_db(self) -> sqlite3.Connection:
+        """初始化SQLite数据库"""
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS dicom_catalog (
+            dicom_id TEXT,
+            seq INTEGER,
+            filename TEXT,
+            filepath TEXT,
+            patient_id TEXT,
+            sop_instance_uid TEXT,
+            accession TEXT,
+            meta TEXT,
+            created_ms INTEGER,
+            sha256 TEXT,
+            PRIMARY KEY (dicom_id, seq)
+        )""")
+        
+        # 兼容旧版本创建的表
+        cols = {row[1] for row in conn.execute("PRAGMA table_info(dicom_catalog)")}
+        if "sha256" not in cols:
+            conn.execute("ALTER TABLE dicom_catalog ADD COLUMN sha256 TEXT")
+        
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_batch_patient ON dicom_catalog(dicom_id, patient_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_patient ON dicom_catalog(patient_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_sop ON dicom_catalog(sop_instance_uid)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_accession ON dicom_catalog(accession)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_sha ON dicom_catalog(sha256)")
+        conn.commit()
+        return conn
+    
+    def add_batch(self, dicom_id: str, metadata_list: List[Dict]) -> int:
+        """
+        写入一个上传批次的元数据记录（保持上传顺序）
+        :param dicom_id: 批次ID（batch_upload_dicom返回的dicom_id）
+        :param metadata_list: batch_upload_dicom提取的元数据列表
+        :return: 写入条数
+        """
+        now = int(time.time() * 1000)
+        rows = [
+            (dicom_id, seq, m.get('filename'), m.get('filepath'), m.get('patient_id') or None,
+             m.get('sop_instance_uid') or None, m.get('accession') or None,
+             json.dumps(m, ensure_ascii=False), now, m.get('sha256') or None)
+            for seq, m in enumerate(metadata_list)
+        ]
+        with self.lock:
+            self.conn.execute("DELETE FROM dicom_catalog WHERE dicom_id=?", (dicom_id,))
+            self.conn.executemany(
+                "INSERT INTO dicom_catalog(dicom_id, seq, filename, filepath, patient_id, sop_instance_uid, "
+                "accession, meta, created_ms, sha256) VALUES(?,?,?,?,?,?,?,?,?,?)", rows
+            )
+            self.conn.commit()
+        print(f"[INFO] DICOM目录已写入 {len(rows)} 条记录 ({dicom_id})")
+        return len(rows)
+    
+    def count(self, dicom_id: str) -> int:
+        """批次中的记录数"""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM dicom_catalog WHERE dicom_id=?", (dicom_id,)).fetchone()[0]
+    
+    def patient_count(self, dicom_id: str) -> int:
+        """批次中不同patient_id的数量"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(DISTINCT patient_id) FROM dicom_catalog WHERE dicom_id=? AND patient_id IS NOT NULL",
+                (dicom_id,)
+            ).fetchone()[0]
+    
+    def iter_metadata(self, dicom_id: str) -> Iterator[Dict]:
+        """按上传顺序读取批次的元数据记录"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT meta FROM dicom_catalog WHERE dicom_id=? ORDER BY seq", (dicom_id,)
+            ).fetchall()
+        for (meta,) in rows:
+            yield json.loads(meta)
+    
+    def lookup_patients(self, dicom_id: str, patient_ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        批量查询批次中patient_id对应的元数据（同一patient_id取最后上传的记录）
+        """
+        ids = list(dict.fromkeys(patient_ids))
+        found = {}
+        for i in range(0, len(ids), self.LOOKUP_BATCH):
+            batch = ids[i:i + self.LOOKUP_BATCH]
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT patient_id, meta FROM dicom_catalog WHERE dicom_id=? "
+                    f"AND patient_id IN ({','.join('?' * len(batch))}) ORDER BY seq",
+                    (dicom_id, *batch)
+                ).fetchall()
+            for pid, meta in rows:
+                found[pid] = json.loads(meta)
+        return found
+    
+    def lookup_digests(self, digests: Iterable[str]) -> Dict[str, Dict]:
+        """
+        按SHA-256查询已上传过的文件（取最近一次上传且文件仍在磁盘上的记录）
+        :return: {sha256: 元数据记录}
+        """
+        ids = list(dict.fromkeys(digests))
+        found = {}
+        for i in range(0, len(ids), self.LOOKUP_BATCH):
+            batch = ids[i:i + self.LOOKUP_BATCH]
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT sha256, meta FROM dicom_catalog WHERE sha256 IN ({','.join('?' * len(batch))}) "
+                    f"ORDER BY created_ms, seq", batch
+                ).fetchall()
+            for sha, meta in rows:
+                record = json.loads(meta)
+                # 上传目录会被定期清理，只保留文件仍存在的记录
+                if record.get('filepath') and Path(record['filepath']).exists():
+                    found[sha] = record
+        return found
+    
+    def find(self, patient_id: Optional[str] = None, sop_instance_uid: Optional[str] = None,
+             accession: Optional[str] = None, dicom_id: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """
+        按标识查询目录记录（条件之间为AND）
+        :return: 记录列表，每条包含dicom_id与元数据
+        """
+        conditions = []
+        params = []
+        for col, value in (("patient_id", patient_id), ("sop_instance_uid", sop_instance_uid),
+                           ("accession", accession), ("dicom_id", dicom_id)):
+            if value:
+                conditions.append(f"{col}=?")
+                params.append(value)
+        if not conditions:
+            return []
+        
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT dicom_id, meta FROM dicom_catalog WHERE {' AND '.join(conditions)} "
+                f"ORDER BY created_ms DESC, seq LIMIT ?", (*params, limit)
+            ).fetchall()
+        return [{'dicom_id': did, **json.loads(meta)} for did, meta in rows]
+    
+    def batch(self, dicom_id: str) -> "DicomCatalogBatch":
+        """返回某个批次的连接视图（可替代CsvDicomJoinEngine）"""
+        return DicomCatalogBatch(self, dicom_id)
+    
+    def close(self):
+        self.conn.close()
+
+class DicomCatalogBatch:
+    """目录中单个上传批次的连接视图，接口与SqliteDicomIndex一致"""
+    
+    def __init__(self, catalog: DicomCatalog, dicom_id: str):
+        self.catalog = catalog
+        self.dicom_id = dicom_id
+    
+    def __len__(self) -> int:
+        return self.catalog.patient_count(self.dicom_id)
+    
+    @property
+    def patient_count(self) -> int:
+        return len(self)
+    
+    def lookup(self, patient_ids: Iterable[str]) -> Dict[str, Dict]:
+        return self.catalog.lookup_patients(self.dicom_id, patient_ids)
+    
+    def iter_matches(self, df: pd.DataFrame, stats: Optional[Dict] = None) -> Iterator[Dict]:
+        """按CSV行顺序生成匹配记录（元数据从目录按块查询）"""
+        yield from iter_lookup_matches(df, self.lookup, stats)
+    
+    def close(self):
+        """目录连接由DicomCatalog持有，这里无需关闭"""
@@ -0,0 +1,34 @@
+"""
+文件SHA-256摘要
+存储层CAS寻址、上传协商与分块上传校验共用；上传文件在写盘时顺带计算，避免落盘后再完整读一遍
+"""
+import hashlib
+from pathlib import Path
+from typing import BinaryIO, Iterable
+
+# 读写块大小
+BLOCK_SIZE = 1 << 20
+
+def sha256_file(path: Path) -> str:
+    """计算文件SHA-256（十六进制）"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(BLOCK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def write_chunks_sha256(chunks: Iterable[bytes], dst: Path) -> str:
+    """
+    将数据块写入文件并同时计算SHA-256
+    :return: 写入内容的摘要
+    """
+    h = hashlib.sha256()
+    with open(dst, "wb") as f:
+        for data in chunks:
+            h.update(data)
+            f.write(data)
+    return h.hexdigest()
+
+def save_stream_sha256(stream: BinaryIO, dst: Path) -> str:
+    """将流（如上传文件）写入磁盘并同时计算SHA-256"""
+    return write_chunks_sha256(iter(lambda: stream.read(BLOCK_SIZE), b""), dst)
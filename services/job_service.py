@@ -0,0 +1,311 @@
+"""
+后台任务服务
+将耗时的批量操作作为后台任务运行，任务状态持久化到SQLite
+"""
+import sqlite3, json, time, uuid, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+class JobCancelled(Exception):
+    """任务被取消（由进度回调抛出，用于中断正在执行的任务）"""
+
+class JobContext:
+    """传递给任务函数的上下文：上报进度、检查取消"""
+    
+    def __init__(self, manager: "JobManager", job_id: str):
+        self.manager = manager
+        self.job_id = job_id
+    
+    @property
+    def cancelled(self) -> bool:
+        return self.manager._is_cancel_requested(self.job_id)
+    
+    def update(self, done: int, total: Optional[int] = None, bytes_done: Optional[int] = None):
+        """
+        上报进度（可直接作为服务层的progress_callback）
+        :param done: 已处理数量
+        :param total: 总数量
+        :param bytes_done: 已处理的累计字节数（用于计算MB/s）
+        :raises JobCancelled: 任务已被请求取消
+        """
+        self.manager._update_progress(self.job_id, done, total, bytes_done)
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+class JobManager:
+    """后台任务管理器"""
+    
+    # 进度写库的最小间隔（秒），避免逐文件提交
+    PERSIST_INTERVAL = 0.5
+    # 运行中的任务超过该时间（秒）无进度视为停滞
+    STALL_SECONDS = 30
+    
+    def __init__(self, db_path: str, max_workers: int = 2):
+        """
+        初始化任务管理器
+        :param db_path: 任务数据库路径（如 storage_repo/db/jobs.sqlite）
+        :param max_workers: 同时运行的任务数
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = self._init_db()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._cancel_requested = set()
+        self._last_persist = {}
+        self._live = {}  # job_id -> 内存中的实时进度
+        self._recover_interrupted()
+    
+    def _init_db(self) -> sqlite3.Connection:
+        """初始化SQLite数据库"""
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT,
+            status TEXT,
+            progress_done INTEGER,
+            progress_total INTEGER,
+            result TEXT,
+            error TEXT,
+            created_ms INTEGER,
+            updated_ms INTEGER,
+            stage TEXT,
+            bytes_done INTEGER,
+            started_ms INTEGER
+        )""")
+        
+        # 兼容旧版本创建的表
+        cols = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for col, col_type in [("stage", "TEXT"), ("bytes_done", "INTEGER"), ("started_ms", "INTEGER")]:
+            if col not in cols:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} {col_type}")
+        
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_job_created ON jobs(created_ms)")
+        conn.commit()
+        return conn
+    
+    def _recover_interrupted(self):
+        """服务重启后，将未完成的任务标记为失败（任务闭包无法恢复）"""
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE jobs SET status=?, error=?, updated_ms=? WHERE status IN (?, ?)",
+                (JOB_FAILED, "服务重启，任务中断", int(time.time() * 1000), JOB_PENDING, JOB_RUNNING)
+            )
+            self.conn.commit()
+        if cur.rowcount:
+            print(f"[JOB] {cur.rowcount} 个未完成任务因服务重启被标记为失败")
+    
+    def _set(self, job_id: str, **fields):
+        """更新任务字段"""
+        fields["updated_ms"] = int(time.time() * 1000)
+        cols = ", ".join(f"{k}=?" for k in fields)
+        with self.lock:
+            self.conn.execute(f"UPDATE jobs SET {cols} WHERE id=?", (*fields.values(), job_id))
+            self.conn.commit()
+    
+    def submit(self, kind: str, fn: Callable[[JobContext], Dict], total: int = 0, stage: Optional[str] = None) -> str:
+        """
+        提交后台任务
+        :param kind: 任务类型（如 batch_upload_dicom）
+        :param fn: 任务函数，接收JobContext，返回可JSON序列化的结果
+        :param total: 预估总工作量
+        :param stage: 流水线阶段（upload / detect / protect / ingest）
+        :return: job_id
+        """
+        job_id = f"job_{uuid.uuid4().hex[:12]}"
+        now = int(time.time() * 1000)
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs(id, kind, status, progress_done, progress_total, result, error, created_ms, updated_ms, "
+                "stage, bytes_done, started_ms) VALUES(?,?,?,?,?,?,?,?,?,?,?,?)",
+                (job_id, kind, JOB_PENDING, 0, total, None, None, now, now, stage or kind, 0, None)
+            )
+            self.conn.commit()
+        
+        self.executor.submit(self._run, job_id, fn)
+        print(f"[JOB] 已提交任务 {job_id} ({kind})")
+        return job_id
+    
+    def _run(self, job_id: str, fn: Callable[[JobContext], Dict]):
+        """在工作线程中执行任务"""
+        if self._is_cancel_requested(job_id):
+            self._finish(job_id, JOB_CANCELLED)
+            return
+        
+        now = time.time()
+        with self.lock:
+            self._live[job_id] = {"done": 0, "total": None, "bytes_done": 0, "started": now, "last_progress": now}
+        self._set(job_id, status=JOB_RUNNING, started_ms=int(now * 1000))
+        try:
+            result = fn(JobContext(self, job_id))
+            if self._is_cancel_requested(job_id):
+                self._finish(job_id, JOB_CANCELLED)
+            else:
+                self._finish(job_id, JOB_SUCCEEDED, result=json.dumps(result, ensure_ascii=False, default=str))
+        except JobCancelled:
+            self._finish(job_id, JOB_CANCELLED)
+        except Exception as e:
+            # 服务层可能吞掉JobCancelled并转为一般异常，以取消标记为准
+            if self._is_cancel_requested(job_id):
+                self._finish(job_id, JOB_CANCELLED)
+            else:
+                print(f"[JOB] 任务 {job_id} 失败: {e}")
+                self._finish(job_id, JOB_FAILED, error=str(e))
+    
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        live = self._live.get(job_id)
+        if live:
+            # 结束时写入最终进度
+            fields = {"progress_done": live["done"], "bytes_done": live["bytes_done"]}
+            if live["total"] is not None:
+                fields["progress_total"] = live["total"]
+            self._set(job_id, **fields)
+        self._set(job_id, status=status, result=result, error=error)
+        with self.lock:
+            self._cancel_requested.discard(job_id)
+            self._last_persist.pop(job_id, None)
+            self._live.pop(job_id, None)
+        print(f"[JOB] 任务 {job_id} 结束: {status}")
+    
+    def _update_progress(self, job_id: str, done: int, total: Optional[int] = None, bytes_done: Optional[int] = None):
+        """更新进度（内存实时更新，按时间间隔节流写库）"""
+        now = time.time()
+        live = self._live.get(job_id)
+        if live is not None:
+            if done != live["done"]:
+                live["last_progress"] = now
+            live["done"] = done
+            if total is not None:
+                live["total"] = total
+            if bytes_done is not None:
+                live["bytes_done"] = bytes_done
+        
+        last = self._last_persist.get(job_id, 0.0)
+        finished = total is not None and done >= total
+        if now - last < self.PERSIST_INTERVAL and not finished:
+            return
+        self._last_persist[job_id] = now
+        fields = {"progress_done": done}
+        if total is not None:
+            fields["progress_total"] = total
+        if bytes_done is not None:
+            fields["bytes_done"] = bytes_done
+        self._set(job_id, **fields)
+    
+    def _is_cancel_requested(self, job_id: str) -> bool:
+        return job_id in self._cancel_requested
+    
+    def cancel(self, job_id: str) -> bool:
+        """
+        请求取消任务（运行中的任务在下一次上报进度时中断）
+        :return: 任务存在且尚未结束时返回True
+        """
+        job = self.get(job_id)
+        if not job or job["status"] in FINISHED_STATES:
+            return False
+        with self.lock:
+            self._cancel_requested.add(job_id)
+        return True
+    
+    def _row_to_dict(self, row) -> Dict:
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "stage": row[8],
+            "status": row[2],
+            "progress": {"done": row[3], "total": row[4]},
+            "error": row[5],
+            "created_ms": row[6],
+            "updated_ms": row[7],
+            "cancel_requested": row[0] in self._cancel_requested
+        }
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        """获取任务状态（不含结果）"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, kind, status, progress_done, progress_total, error, created_ms, updated_ms, stage "
+                "FROM jobs WHERE id=?", (job_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+    
+    def get_progress(self, job_id: str) -> Optional[Dict]:
+        """
+        获取任务进度快照：阶段、完成数、吞吐量（files/s、MB/s）、预计剩余时间、是否停滞
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT kind, status, stage, progress_done, progress_total, bytes_done, started_ms, updated_ms "
+                "FROM jobs WHERE id=?", (job_id,)
+            ).fetchone()
+            live = dict(self._live[job_id]) if job_id in self._live else None
+        if not row:
+            return None
+        
+        kind, status, stage, done, total, bytes_done, started_ms, updated_ms = row
+        now = time.time()
+        last_progress = None
+        if live:
+            done, bytes_done = live["done"], live["bytes_done"]
+            total = live["total"] if live["total"] is not None else total
+            started = live["started"]
+            last_progress = live["last_progress"]
+            end = now
+        else:
+            started = started_ms / 1000 if started_ms else None
+            end = updated_ms / 1000 if status in FINISHED_STATES else now
+        
+        elapsed = max(end - started, 1e-6) if started else 0.0
+        files_per_sec = done / elapsed if elapsed else 0.0
+        mb_per_sec = (bytes_done or 0) / (1024 * 1024) / elapsed if elapsed else 0.0
+        eta = None
+        if status == JOB_RUNNING and total and files_per_sec > 0:
+            eta = max(total - done, 0) / files_per_sec
+        
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "stage": stage,
+            "status": status,
+            "done": done,
+            "total": total,
+            "percent": round(done / total * 100, 1) if total else None,
+            "bytes_done": bytes_done or 0,
+            "elapsed_seconds": round(elapsed, 2),
+            "files_per_sec": round(files_per_sec, 2),
+            "mb_per_sec": round(mb_per_sec, 2),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "stalled": bool(status == JOB_RUNNING and last_progress and now - last_progress > self.STALL_SECONDS)
+        }
+    
+    def get_result(self, job_id: str) -> Optional[Dict]:
+        """获取已完成任务的结果"""
+        with self.lock:
+            row = self.conn.execute("SELECT result FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        return json.loads(row[0])
+    
+    def list_jobs(self, limit: int = 20) -> List[Dict]:
+        """列出最近的任务"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, kind, status, progress_done, progress_total, error, created_ms, updated_ms, stage "
+                "FROM jobs ORDER BY created_ms DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_dict(r) for r in rows]
+    
+    def shutdown(self):
+        """停止接收新任务"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
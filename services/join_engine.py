@@ -0,0 +1,311 @@
+"""
+CSV ↔ DICOM 列式连接引擎
+用向量化的 patient_id 提取 + 一次哈希连接代替逐行匹配
+"""
+import re
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# CSV Path列中的patient编号（如 train/patient00826/study1/view1.jpg）
+PATIENT_PATH_PATTERN = re.compile(r'patient(\d+)', re.IGNORECASE)
+# DICOM文件名中的token（如 CT_patient00826_001 -> CT, patient00826, 001），以及其中的字母段/数字段（patient, 00826）
+FILENAME_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9]+')
+FILENAME_PART_PATTERN = re.compile(r'[A-Za-z]+|\d+')
+
+@dataclass
+class JoinResult:
+    matched: pd.DataFrame      # row_index, row_pos, patient_id, _dicom_pos
+    unmatched: pd.DataFrame    # row_index, row_pos, patient_id
+    
+    @property
+    def total(self) -> int:
+        return len(self.matched) + len(self.unmatched)
+
+class CsvDicomJoinEngine:
+    """按patient_id连接CSV行与DICOM元数据"""
+    
+    def __init__(self, dicom_metadata_list: List[Dict]):
+        """
+        构建DICOM元数据表（每个patient_id保留最后一条记录）
+        :param dicom_metadata_list: batch_upload_dicom返回的metadata_list
+        """
+        self.dicom_metadata_list = dicom_metadata_list
+        pids = [m.get('patient_id') or None for m in dicom_metadata_list]
+        frame = pd.DataFrame({'patient_id': pids, '_dicom_pos': np.arange(len(pids))})
+        self.dicom_df = frame.dropna(subset=['patient_id']).drop_duplicates('patient_id', keep='last')
+    
+    @property
+    def patient_count(self) -> int:
+        return len(self.dicom_df)
+    
+    @staticmethod
+    def extract_patient_ids(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        从Path列向量化提取patient_id，返回 (row_index, row_pos, patient_id)，仅包含匹配的行
+        row_index为行标签（写入匹配记录），row_pos为行位置（按位置取行，索引重复或非默认时也不会错位）
+        """
+        if 'Path' not in df.columns:
+            return pd.DataFrame({'row_index': pd.Series(dtype=object), 'row_pos': pd.Series(dtype=np.int64),
+                                 'patient_id': pd.Series(dtype=object)})
+        numbers = df['Path'].astype(str).str.extract(PATIENT_PATH_PATTERN, expand=False)
+        found = numbers.notna().to_numpy()
+        numbers = numbers[found]
+        return pd.DataFrame({'row_index': numbers.index, 'row_pos': np.flatnonzero(found),
+                             'patient_id': 'patient' + numbers.values})
+    
+    def _merge(self, df: pd.DataFrame) -> pd.DataFrame:
+        """左连接DICOM表（DICOM键唯一，结果行数与顺序同CSV提取结果）"""
+        left = self.extract_patient_ids(df)
+        return left.merge(self.dicom_df, on='patient_id', how='left', sort=False)
+    
+    def join(self, df: pd.DataFrame) -> JoinResult:
+        """一次哈希连接，返回匹配与未匹配的行（均保持CSV行顺序）"""
+        merged = self._merge(df)
+        hit = merged['_dicom_pos'].notna()
+        matched = merged[hit].astype({'_dicom_pos': np.int64})
+        unmatched = merged.loc[~hit, ['row_index', 'row_pos', 'patient_id']]
+        return JoinResult(matched=matched, unmatched=unmatched)
+    
+    def iter_matches(self, df: pd.DataFrame, stats: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        按CSV行顺序生成匹配记录（与 /api/batch_detect 的results元素格式一致）
+        :param stats: 可选累计统计，更新 total_patients / matched
+        """
+        merged = self._merge(df)
+        hit = merged['_dicom_pos'].notna().to_numpy()
+        if stats is not None:
+            stats['total_patients'] += len(merged)
+            stats['matched'] += int(hit.sum())
+        
+        metas = [self.dicom_metadata_list[int(pos)] if is_hit else None
+                 for pos, is_hit in zip(merged['_dicom_pos'].tolist(), hit)]
+        yield from iter_match_records(df, merged['row_index'].tolist(), merged['row_pos'].tolist(),
+                                      merged['patient_id'].tolist(), metas)
+
+class DicomFileIndex:
+    """
+    DICOM文件查找索引：按文件名token与header中的PatientID / AccessionNumber一次建立，每行O(1)查找
+    匹配优先级：header PatientID > header AccessionNumber > 文件名token（patient_id、accession）
+    文件名token只索引含数字且只对应一个文件的token（"CT"、"patient"或多个文件共有的序号"001"不参与匹配）
+    """
+    
+    def __init__(self, dicom_files: Iterable[Path], headers: Optional[Dict[Path, Dict]] = None):
+        """
+        :param dicom_files: DICOM文件路径（按文件名排序后建立索引，header中同一ID保留第一个文件）
+        :param headers: {文件路径: header记录}（如DicomMetadataExtractor提取的metadata，含patient_id / accession），
+                        为None时只按文件名建立索引
+        """
+        self.headers = headers or {}
+        self.by_patient_id: Dict[str, Path] = {}
+        self.by_accession: Dict[str, Path] = {}
+        self.by_token: Dict[str, Path] = {}
+        self.ambiguous_tokens = set()
+        self.file_count = 0
+        for path in sorted(dicom_files, key=lambda p: p.name):
+            self.file_count += 1
+            for token in self._filename_tokens(path.stem):
+                if token in self.ambiguous_tokens:
+                    continue
+                if token in self.by_token:
+                    # 多个文件共有的token无法确定对应哪个文件，视为未匹配
+                    del self.by_token[token]
+                    self.ambiguous_tokens.add(token)
+                else:
+                    self.by_token[token] = path
+            header = self.headers.get(path)
+            if header is not None:
+                if header.get('patient_id'):
+                    self.by_patient_id.setdefault(str(header['patient_id']).strip(), path)
+                if header.get('accession'):
+                    self.by_accession.setdefault(str(header['accession']).strip(), path)
+    
+    @staticmethod
+    def _filename_tokens(stem: str) -> set:
+        """文件名中可用于匹配的token：整个文件名、各token及其字母段/数字段中含数字的部分"""
+        tokens = {stem, *FILENAME_TOKEN_PATTERN.findall(stem), *FILENAME_PART_PATTERN.findall(stem)}
+        return {t for t in tokens if any(c.isdigit() for c in t)}
+    
+    def header(self, path: Path) -> Optional[Dict]:
+        """建索引时读到的header记录（读取失败或只按文件名建索引时为None）"""
+        return self.headers.get(path)
+    
+    @staticmethod
+    def _key(value) -> str:
+        """CSV单元格 -> 查找键（空值、NaN为空串）"""
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return ''
+        return str(value).strip()
+    
+    def lookup(self, patient_id=None, accession=None) -> Optional[Path]:
+        """按patient_id / accession查找DICOM文件，找不到返回None"""
+        patient_id = self._key(patient_id)
+        accession = self._key(accession)
+        for key, table in ((patient_id, self.by_patient_id), (accession, self.by_accession),
+                           (patient_id, self.by_token), (accession, self.by_token)):
+            if key and key in table:
+                return table[key]
+        return None
+
+class SqliteDicomIndex:
+    """磁盘上的DICOM元数据索引（patient_id -> 元数据），用于超大队列的分块连接"""
+    
+    # 单条IN查询的最大参数个数（低于SQLite默认上限）
+    LOOKUP_BATCH = 500
+    
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS dicom_meta (
+            patient_id TEXT PRIMARY KEY,
+            meta TEXT
+        )""")
+        self.conn.commit()
+    
+    def add(self, metadata_list: Iterable[Dict]):
+        """写入元数据（同一patient_id保留最后一条）"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO dicom_meta(patient_id, meta) VALUES(?, ?)",
+            ((m['patient_id'], json.dumps(m, ensure_ascii=False)) for m in metadata_list if m.get('patient_id'))
+        )
+        self.conn.commit()
+    
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM dicom_meta").fetchone()[0]
+    
+    def lookup(self, patient_ids: Iterable[str]) -> Dict[str, Dict]:
+        """批量查询patient_id对应的元数据"""
+        ids = list(dict.fromkeys(patient_ids))
+        found = {}
+        for i in range(0, len(ids), self.LOOKUP_BATCH):
+            batch = ids[i:i + self.LOOKUP_BATCH]
+            cur = self.conn.execute(
+                f"SELECT patient_id, meta FROM dicom_meta WHERE patient_id IN ({','.join('?' * len(batch))})", batch
+            )
+            for pid, meta in cur:
+                found[pid] = json.loads(meta)
+        return found
+    
+    def iter_matches(self, df: pd.DataFrame, stats: Optional[Dict] = None) -> Iterator[Dict]:
+        """与CsvDicomJoinEngine.iter_matches相同，但元数据从磁盘索引按块查询"""
+        yield from iter_lookup_matches(df, self.lookup, stats)
+    
+    def close(self):
+        self.conn.close()
+
+class MatchResultStore:
+    """匹配结果落盘（SQLite），支持分页读取"""
+    
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS results (
+            seq INTEGER PRIMARY KEY,
+            matched INTEGER,
+            record TEXT
+        )""")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            data TEXT
+        )""")
+        self.conn.commit()
+    
+    def append(self, records: Iterable[Dict]) -> int:
+        """追加一批匹配记录，返回写入条数"""
+        cur = self.conn.executemany(
+            "INSERT INTO results(matched, record) VALUES(?, ?)",
+            ((int(r['matched']), json.dumps(r, ensure_ascii=False, default=str)) for r in records)
+        )
+        self.conn.commit()
+        return cur.rowcount
+    
+    def set_summary(self, summary: Dict):
+        self.conn.execute("INSERT OR REPLACE INTO summary(id, data) VALUES(1, ?)", (json.dumps(summary, ensure_ascii=False),))
+        self.conn.commit()
+    
+    def get_summary(self) -> Optional[Dict]:
+        row = self.conn.execute("SELECT data FROM summary WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def page(self, offset: int = 0, limit: int = 1000, matched: Optional[bool] = None) -> List[Dict]:
+        """按写入顺序分页读取（可只取匹配/未匹配记录）"""
+        if matched is None:
+            cur = self.conn.execute("SELECT record FROM results ORDER BY seq LIMIT ? OFFSET ?", (limit, offset))
+        else:
+            cur = self.conn.execute(
+                "SELECT record FROM results WHERE matched = ? ORDER BY seq LIMIT ? OFFSET ?", (int(matched), limit, offset)
+            )
+        return [json.loads(row[0]) for row in cur]
+    
+    def count(self, matched: Optional[bool] = None) -> int:
+        if matched is None:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM results WHERE matched = ?", (int(matched),)).fetchone()[0]
+    
+    def close(self):
+        self.conn.close()
+
+def _json_safe_records(df: pd.DataFrame) -> List[Dict]:
+    """将行转换为字典，NaN/Inf替换为None"""
+    valid = df.notna()
+    numeric = df.select_dtypes(include='number')
+    if not numeric.empty:
+        valid[numeric.columns] &= np.isfinite(numeric.to_numpy(dtype=float))
+    return df.astype(object).where(valid, None).to_dict('records')
+
+def iter_lookup_matches(df: pd.DataFrame, lookup: Callable[[List[str]], Dict[str, Dict]],
+                        stats: Optional[Dict] = None) -> Iterator[Dict]:
+    """
+    提取patient_id后通过lookup批量查询元数据，按CSV行顺序生成匹配记录
+    :param lookup: patient_id列表 -> {patient_id: 元数据}
+    """
+    left = CsvDicomJoinEngine.extract_patient_ids(df)
+    patient_ids = left['patient_id'].tolist()
+    found = lookup(patient_ids)
+    metas = [found.get(pid) for pid in patient_ids]
+    if stats is not None:
+        stats['total_patients'] += len(metas)
+        stats['matched'] += sum(1 for m in metas if m is not None)
+    yield from iter_match_records(df, left['row_index'].tolist(), left['row_pos'].tolist(), patient_ids, metas)
+
+def iter_match_records(df: pd.DataFrame, row_indices: List, row_positions: List[int], patient_ids: List[str],
+                       metas: List[Optional[Dict]]) -> Iterator[Dict]:
+    """
+    按顺序生成匹配记录（与 /api/batch_detect 的results元素格式一致）
+    :param row_indices: 行标签（写入记录的row_index）
+    :param row_positions: 与row_indices对齐的行位置（csv_data按位置取行）
+    :param metas: 与row_indices对齐的DICOM元数据，未匹配为None
+    """
+    # 只为匹配的行构建csv_data字典
+    hit_positions = [p for p, m in zip(row_positions, metas) if m is not None]
+    csv_records = iter(_json_safe_records(df.iloc[hit_positions]))
+    
+    for row_index, patient_id, dicom_meta in zip(row_indices, patient_ids, metas):
+        if dicom_meta is not None:
+            yield {
+                'patient_id': patient_id,
+                'row_index': row_index,
+                'dicom_file': dicom_meta.get('filename'),
+                'matched': True,
+                'csv_data': next(csv_records),
+                'dicom_metadata': dicom_meta,
+                'match_type': 'patient_id_exact_match',
+                'confidence': 1.0,
+                'risk_level': 'critical'
+            }
+        else:
+            yield {
+                'patient_id': patient_id,
+                'row_index': row_index,
+                'dicom_file': 'None',
+                'matched': False
+            }
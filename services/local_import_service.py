@@ -0,0 +1,133 @@
+"""
+本地目录登记服务
+服务端已有的DICOM目录（与服务同一存储卷）直接登记为批次：原地索引或硬链接到上传目录，不复制文件内容
+"""
+import os
+import sys
+import json
+import uuid
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+class LocalImportError(Exception):
+    """目录不在白名单内或不可用"""
+
+class LocalDicomImporter:
+    """白名单目录内的DICOM登记器"""
+
+    def __init__(self, allowed_roots: Optional[Iterable[str]] = None):
+        """
+        :param allowed_roots: 允许登记的服务端根目录（为空时禁用登记）
+        """
+        self.allowed_roots = [Path(r).resolve() for r in (allowed_roots or [])]
+
+    def resolve(self, path: str) -> Path:
+        """
+        解析并校验目录（符号链接解析后必须位于某个白名单根目录之内）
+        :raises LocalImportError: 未配置白名单、目录越界或不存在
+        """
+        if not self.allowed_roots:
+            raise LocalImportError("未配置允许登记的目录（DICOM_ALLOWED_ROOTS）")
+        target = Path(path).resolve()
+        if not any(target == root or root in target.parents for root in self.allowed_roots):
+            raise LocalImportError(f"目录不在允许登记的范围内: {path}")
+        if not target.is_dir():
+            raise LocalImportError(f"目录不存在: {path}")
+        return target
+
+    @staticmethod
+    def scan(directory: Path, recursive: bool = True) -> List[Path]:
+        """列出目录中的.dcm文件（按路径排序，保证结果顺序稳定）"""
+        pattern = "**/*.dcm" if recursive else "*.dcm"
+        return sorted(p for p in directory.glob(pattern) if p.is_file())
+
+    @staticmethod
+    def link_into(files: List[Path], source_dir: Path, dest_dir: Path) -> List[Path]:
+        """
+        将文件硬链接到目标目录（跨文件系统时改用符号链接），不复制数据
+        子目录中的文件按相对路径展平命名（a/b/IM1.dcm → a_b_IM1.dcm）
+        """
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        linked = []
+        for src in files:
+            dst = dest_dir / "_".join(src.relative_to(source_dir).parts)
+            if not dst.exists():
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    os.symlink(src, dst)
+            linked.append(dst)
+        return linked
+
+def register_directory(path: str, allowed_roots: Iterable[str], upload_dir: str = "./uploads",
+                       storage_repo: str = "./storage_repo", mode: str = "link", recursive: bool = True,
+                       try_burnedin: bool = False, workers: Optional[int] = None) -> Dict:
+    """
+    不经HTTP服务直接登记服务端DICOM目录：提取header并写入与服务共用的DICOM目录库
+    （与 /api/batch_register_dicom 相同，返回的dicom_id可直接用于批量检测）
+    :param path: 待登记目录
+    :param allowed_roots: 允许登记的根目录
+    :param upload_dir: 服务的上传目录（mode=link时批次目录建在其中）
+    :param storage_repo: 服务的存储仓库（DICOM目录库位于 storage_repo/db/dicom_catalog.sqlite）
+    """
+    from services.roi_service import DicomMetadataExtractor
+    from services.dicom_catalog import DicomCatalog
+
+    if mode not in ("link", "inplace"):
+        raise LocalImportError(f"无效的登记模式: {mode}")
+    importer = LocalDicomImporter(allowed_roots)
+    source_dir = importer.resolve(path)
+    files = importer.scan(source_dir, recursive=recursive)
+    if not files:
+        raise LocalImportError(f"目录中没有DICOM文件: {path}")
+
+    dicom_id = f"batch_{uuid.uuid4().hex[:8]}"
+    if mode == "inplace":
+        dicom_dir, saved_paths = source_dir, files
+    else:
+        dicom_dir = Path(upload_dir) / dicom_id
+        saved_paths = importer.link_into(files, source_dir, dicom_dir)
+    print(f"[INFO] 登记本地DICOM目录 {source_dir}（{mode}）: {len(files)} 个文件 -> {dicom_id}")
+
+    extractor = DicomMetadataExtractor(max_workers=workers)
+    try:
+        metadata_list, failures = extractor.extract(saved_paths, try_burnedin=try_burnedin)
+    finally:
+        extractor.shutdown()
+    DicomCatalog(db_path=str(Path(storage_repo) / "db" / "dicom_catalog.sqlite")).add_batch(dicom_id, metadata_list)
+    return {
+        "dicom_id": dicom_id,
+        "dicom_dir": str(dicom_dir),
+        "total_files": len(saved_paths),
+        "processed": len(metadata_list),
+        "failed": failures,
+        "status": "success"
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口：python -m services.local_import_service <允许的根目录> <DICOM目录>"""
+    parser = argparse.ArgumentParser(description="登记服务端已有的DICOM目录（无需启动服务）")
+    parser.add_argument("root", help="允许登记的根目录（对应服务的 --allow-dicom-root）")
+    parser.add_argument("path", help="待登记的DICOM目录（须位于root之内）")
+    parser.add_argument("--mode", choices=("link", "inplace"), default="link",
+                        help="link：硬链接到上传目录下的新批次；inplace：原地索引")
+    parser.add_argument("--no-recursive", action="store_true", help="不扫描子目录")
+    parser.add_argument("--try-burnedin", action="store_true", help="解码像素并检测烧录文本（校验像素数据）")
+    parser.add_argument("--upload-folder", default="./uploads", help="服务的文件上传目录")
+    parser.add_argument("--storage-repo", default="./storage_repo", help="服务的存储仓库目录")
+    parser.add_argument("--workers", type=int, default=None, help="元数据提取进程数（默认CPU核数）")
+    args = parser.parse_args(argv)
+    try:
+        result = register_directory(
+            args.path, [args.root], upload_dir=args.upload_folder, storage_repo=args.storage_repo,
+            mode=args.mode, recursive=not args.no_recursive, try_burnedin=args.try_burnedin, workers=args.workers
+        )
+    except LocalImportError as e:
+        print(f"[ERROR] {e}")
+        return 1
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+中文姓名识别
+用姓氏前缀树（单姓 + 复姓）定位候选，结合名字长度先验与上下文边界判定，代替 [一-龥]{2,4} 正则
+词典在进程内只加载一次
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+# 常见单姓（按人口排序的前约400个）
+SINGLE_SURNAMES = (
+    "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈"
+    "姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+    "常温康施文牛樊葛邢安齐易乔伍庞颜倪庄聂章鲁岳翟殷詹申欧耿关兰焦俞左柳甘祝包宁尚符舒阮柯纪梅童凌毕单季"
+    "裴霍涂成苗谷盛曲翁冉骆蓝路游辛靳管柴蒙鲍华喻祁蒲房滕屈饶解牟艾尤阳时穆农司卓古吉缪简车项连芦麦褚娄窦"
+    "戚岑景党宫费卜冷晏席卫米柏宗瞿桂全佟应臧闵苟邬边卞姬师和仇栾隋商刁沙荣巫寇桑郎甄丛仲虞敖巩明佘池查麻"
+    "苑迟邝官封谈匡鞠惠荆乐冀郁胥南班储原栗燕楚鄢劳谌奚皮粟冼蔺楼盘满闻位厉伊仝区郜海阚花权强帅屠豆朴盖练"
+    "廉禹井祖漆巴丰支卿国狄平计索宣晋相初门云容敬来扈晁芮都普阙浦戈伏鹿薄邸雍辜羊乌母裘亓修邰赫杭况那宿鲜"
+    "印逯隆茹诸战慕危玉银亢嵇公哈湛宾戎勾茅利於呼居揭干但尉冶斯元束檀衣信展阴昝智幸奉植衡富尧闭由"
+)
+
+# 常见复姓
+COMPOUND_SURNAMES = (
+    "欧阳", "司马", "诸葛", "上官", "东方", "皇甫", "尉迟", "公孙", "慕容", "令狐", "长孙", "宇文", "司徒", "夏侯",
+    "轩辕", "端木", "独孤", "南宫", "西门", "呼延", "申屠", "太史", "闻人", "澹台", "公冶", "赫连", "钟离", "宗政",
+    "濮阳", "淳于", "单于", "万俟", "百里", "东郭", "拓跋", "司空", "第五", "左丘", "谷梁", "段干"
+)
+
+# 名字长度先验：P(名字字数 | 姓氏类型)
+GIVEN_NAME_LENGTH_PRIOR = {
+    1: {2: 0.68, 1: 0.32},  # 单姓
+    2: {1: 0.45, 2: 0.55},  # 复姓
+}
+
+# 几乎不会出现在名字中的字（虚词、医疗文书高频字），用于排除候选
+GIVEN_NAME_STOP_CHARS = set(
+    "的了是在和与及或为因以行查院科室部病症状例次天年月岁号省市区县路街医治疗检测诊断患者术后前见未无有可予"
+    "每其该此本各个等不也都就又被把将从向对给到由于并而但若如即则时分日性呼吸肺心肝肾胃痛热咳血压脉率音"
+    "住诉自今现系之签"
+)
+
+# 姓名前常见的提示词
+LEFT_TRIGGERS = (
+    "患者", "病人", "姓名", "患儿", "家属", "医生", "医师", "主任", "护士", "联系人", "就诊人", "受检者", "报告人",
+    "审核人", "记录人", "签名", "签字", "之子", "之女", "之妻", "之夫", "丈夫", "妻子", "父亲", "母亲", "儿子", "女儿",
+    "委托人", "监护人", "负责人", "经治", "主治", "住院医", "会诊"
+)
+
+# 姓名后常见的提示词（名字在此结束）
+RIGHT_TRIGGERS = (
+    "先生", "女士", "小姐", "医生", "医师", "主任", "教授", "护士", "同志", "老师", "患者", "本人", "家属",
+    "男", "女", "住", "因", "于", "在", "来", "诉", "自", "今", "现", "系", "之", "和", "与", "及", "等", "签"
+)
+
+class ChineseNameDetector:
+    """基于姓氏前缀树的中文姓名识别（候选定位 -> 名字长度先验 -> 上下文边界判定）"""
+    
+    # 判为姓名的最低分（左右两侧都须有上下文证据；仅有边界时右侧须为标点或提示词，满分约0.7）
+    MIN_SCORE = 0.45
+    # 左侧提示词的最大长度
+    MAX_TRIGGER_LEN = max(len(t) for t in LEFT_TRIGGERS)
+    
+    def __init__(self, single_surnames: Iterable[str] = SINGLE_SURNAMES,
+                 compound_surnames: Iterable[str] = COMPOUND_SURNAMES):
+        """
+        构建姓氏前缀树
+        :param single_surnames: 单姓（可迭代的单字）
+        :param compound_surnames: 复姓
+        """
+        # 前缀树：字 -> 子节点，子节点中 "$" 键表示到此为一个完整姓氏
+        self.trie: Dict[str, Dict] = {}
+        for surname in list(dict.fromkeys(single_surnames)) + list(compound_surnames):
+            node = self.trie
+            for ch in surname:
+                node = node.setdefault(ch, {})
+            node["$"] = True
+        # 候选起点由C实现的正则一次定位：姓氏首字，且左侧为非汉字或提示词（文中多数姓氏用字在词中间，直接跳过）
+        # 提示词直接匹配（比逐个后顾断言快得多）且排在前面，避免提示词本身的姓氏用字（如"母亲"）抢先成为候选
+        triggers = "|".join(re.escape(t) for t in sorted(LEFT_TRIGGERS, key=len, reverse=True))
+        self.candidates = re.compile(f"(?:{triggers}|(?<![一-龥]))([{re.escape(''.join(self.trie))}])")
+        self.left_triggers = frozenset(LEFT_TRIGGERS)
+        self.right_triggers = RIGHT_TRIGGERS
+    
+    @staticmethod
+    def _is_han(ch: str) -> bool:
+        return "一" <= ch <= "龥"
+    
+    def _surnames_at(self, text: str, i: int) -> List[int]:
+        """text[i:] 开头的所有姓氏长度（复姓在前）"""
+        lengths = []
+        node = self.trie
+        j = i
+        while j < len(text) and text[j] in node:
+            node = node[text[j]]
+            j += 1
+            if "$" in node:
+                lengths.append(j - i)
+        return lengths[::-1]
+    
+    def _left_context(self, text: str, i: int, after_trigger: bool) -> float:
+        """左侧证据：提示词 > 非汉字边界（标点、数字、文本开头）"""
+        if after_trigger:
+            return 0.3
+        # "姓名：张三" 之类，提示词与姓名之间隔着一个标点
+        for n in range(2, self.MAX_TRIGGER_LEN + 1):
+            if i > n and text[i - 1 - n:i - 1] in self.left_triggers:
+                return 0.3
+        return 0.2
+    
+    def _right_context(self, text: str, end: int) -> float:
+        """右侧证据：标点 / 空白 / 文本结尾 / 提示词；紧跟数字或字母较弱（如 "白细胞59"）"""
+        if end >= len(text):
+            return 0.2
+        ch = text[end]
+        if not self._is_han(ch):
+            return 0.1 if ch.isalnum() else 0.2
+        return 0.2 if text.startswith(self.right_triggers, end) else 0.0
+    
+    def _best_candidate(self, text: str, i: int, after_trigger: bool) -> Tuple[int, float]:
+        """
+        返回以i为起点的最佳姓名 (结束位置, 得分)，无候选时结束位置为-1
+        :param after_trigger: 左侧紧邻提示词（否则左侧为非汉字边界，由候选正则保证）
+        """
+        best_end, best_score = -1, 0.0
+        left = None
+        for surname_len in self._surnames_at(text, i):
+            prior = GIVEN_NAME_LENGTH_PRIOR[min(surname_len, 2)]
+            for given_len, p in prior.items():
+                start = i + surname_len
+                end = start + given_len
+                given = text[start:end]
+                if len(given) < given_len or not all(self._is_han(c) and c not in GIVEN_NAME_STOP_CHARS for c in given):
+                    continue
+                right = self._right_context(text, end)
+                if not right:
+                    continue
+                if left is None:
+                    left = self._left_context(text, i, after_trigger)
+                score = left + right + 0.2 * p
+                if score > best_score:
+                    best_end, best_score = end, score
+        return best_end, best_score
+    
+    def find(self, text: str) -> List[Tuple[int, int, float]]:
+        """
+        识别文本中的姓名
+        :return: [(start, end, 置信度)]，按位置排序且互不重叠
+        """
+        names = []
+        pos = 0
+        for match in self.candidates.finditer(text):
+            i = match.start(1)
+            if i < pos:
+                continue
+            end, score = self._best_candidate(text, i, match.start() < i)
+            if end > 0 and score >= self.MIN_SCORE:
+                names.append((i, end, round(min(0.99, 0.3 + score), 2)))
+                pos = end
+        return names
+
+@lru_cache(maxsize=1)
+def get_name_detector() -> ChineseNameDetector:
+    """进程内共享的姓名识别器（前缀树只构建一次）"""
+    return ChineseNameDetector()
@@ -1,21 +1,179 @@
+import os
 import re
 import csv
 import pandas as pd
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
+from services.table_reader import load_table
+from services.span_resolver import SpanIndex, resolve_overlaps
+from services.name_detector import get_name_detector
+
+class PatternScanner:
+    """
+    多模式单遍扫描引擎：所有模式编译为一个带命名分组的交替式，一次finditer得到带类型的匹配
+    同一起始位置按优先级取第一个能匹配的模式（正则的leftmost-first语义），结果互不重叠且按位置排序
+    交替式只在同一起点比较优先级：起点靠前的低优先级匹配可能覆盖其后高优先级实体的起点（如宽泛的地址吞掉电话），
+    因此每个匹配还要探测内部有没有更高优先级模式的起点；出现这种冲突的片段改为逐模式取候选，
+    按 resolve_overlaps 的规则（高优先级先选，与已选实体重叠的丢弃）消解
+    """
+    
+    # 与英文字母/数字相邻时不匹配（避免在长数字或编号中间截取片段）
+    TOKEN_BOUNDARY = r"(?<![A-Za-z0-9])(?:{})(?![A-Za-z0-9])"
+    # 探测匹配内部时每次检查的位置数
+    PROBE_SPAN = 32
+    
+    def __init__(self, patterns: Dict[str, str], priority: Iterable[str] = (),
+                 token_bounded: Iterable[str] = (), skip: Optional[str] = None):
+        """
+        :param patterns: 实体类型 -> 正则（可包含分组，整个匹配作为实体文本）
+        :param priority: 优先级从高到低的实体类型，未列出的类型按patterns中的顺序排在后面
+        :param token_bounded: 需要完整token匹配的类型（如纯数字、编号类模式）
+        :param skip: 优先级最低、匹配后不报告的模式，用于整段跳过起点处没有任何实体的文本
+                     （如汉字串：起点匹配不到地址/机构时，串内后续位置也匹配不到，无需逐字重试），
+                     要求对每个模式单独成立（探测与逐模式扫描同样用它跳过）
+        """
+        priority = [t for t in priority if t in patterns]
+        self.order = priority + [t for t in patterns if t not in priority]
+        token_bounded = set(token_bounded)
+        skip_part = [f"(?P<skip>{skip})"] if skip else []
+        self.group_types = {}
+        # 各类型：更高优先级模式组成的探测正则（匹配内部逐位置探测）；单个模式的正则（冲突时逐模式取候选）
+        # 匹配全为英文字母/数字时，token边界模式不可能从其内部开始，只需探测其余更高优先级模式（higher[(类型, True)]）
+        self.higher = {}
+        self.single = []
+        parts = []
+        free_parts = []
+        for i, entity_type in enumerate(self.order):
+            pattern = patterns[entity_type]
+            if entity_type in token_bounded:
+                pattern = self.TOKEN_BOUNDARY.format(pattern)
+            if parts:
+                self.higher[(entity_type, False)] = "|".join(parts)
+            if free_parts:
+                self.higher[(entity_type, True)] = "|".join(free_parts)
+            self.group_types[f"t{i}"] = entity_type
+            parts.append(f"(?P<t{i}>{pattern})")
+            if entity_type not in token_bounded:
+                free_parts.append(f"(?:{pattern})")
+            self.single.append((entity_type, re.compile("|".join([f"(?P<t{i}>{pattern})"] + skip_part))))
+        self.regex = re.compile("|".join(parts + skip_part))
+        self._probes: Dict[Tuple[Tuple[str, bool], int], re.Pattern] = {}
+    
+    def scan(self, text: str, pos: int = 0, endpos: Optional[int] = None) -> List[Tuple[str, int, int, str]]:
+        """
+        按位置顺序返回 (实体类型, start, end, 文本) 列表
+        :param pos: 扫描起点（边界判断仍可看到pos之前的字符）
+        :param endpos: 扫描终点（默认文本末尾）
+        """
+        endpos = len(text) if endpos is None else endpos
+        group_types = self.group_types
+        higher = self.higher
+        probes = self._probes
+        probe_span = self.PROBE_SPAN
+        matches = []
+        for match in self.regex.finditer(text, pos, endpos):
+            # 各模式的内部分组都嵌套在命名分组内，最后闭合的就是命名分组
+            entity_type = group_types.get(match.lastgroup)
+            if entity_type is None:
+                continue
+            start, end = match.span()
+            value = match.group()
+            # 匹配内部有更高优先级模式的起点时，该片段改为逐模式取候选后按优先级消解
+            span = end - start - 2
+            if span >= 0:
+                key = (entity_type, value.isascii() and value.isalnum())
+                if key in higher:
+                    if span < probe_span:
+                        probe = probes.get((key, span)) or self._probe(key, span)
+                        conflict = probe.match(text, start + 1, endpos) is not None
+                    else:
+                        conflict = self._has_higher(key, text, start, end, endpos)
+                    if conflict:
+                        return self._scan_resolved(text, pos, endpos)
+            matches.append((entity_type, start, end, value))
+        return matches
+    
+    def _has_higher(self, key: Tuple[str, bool], text: str, start: int, end: int, endpos: int) -> bool:
+        """(start, end) 内是否有更高优先级模式的起点（每段最多PROBE_SPAN个位置，一次match完成）"""
+        for q in range(start + 1, end, self.PROBE_SPAN):
+            if self._probe(key, min(self.PROBE_SPAN, end - q) - 1).match(text, q, endpos):
+                return True
+        return False
+    
+    def _probe(self, key: Tuple[str, bool], span: int) -> re.Pattern:
+        """从当前位置起前span+1个位置中任一位置开始匹配更高优先级模式的正则（按需编译并缓存）"""
+        probe = self._probes.get((key, span))
+        if probe is None:
+            probe = self._probes.setdefault((key, span), re.compile(f"(?s:.{{0,{span}}}?)(?:{self.higher[key]})"))
+        return probe
+    
+    def _scan_resolved(self, text: str, pos: int, endpos: int) -> List[Tuple[str, int, int, str]]:
+        """逐模式取候选，按优先级贪心选取互不重叠的实体（与resolve_overlaps规则相同），按位置排序"""
+        index = SpanIndex()
+        found = []
+        for entity_type, regex in self.single:
+            for match in regex.finditer(text, pos, endpos):
+                start, end = match.span()
+                if match.lastgroup != "skip" and not index.overlaps(start, end):
+                    index.add(start, end)
+                    found.append((start, entity_type, end, match.group()))
+        found.sort()
+        return [(entity_type, start, end, value) for start, entity_type, end, value in found]
+
+def _han_run_except(chars: str) -> str:
+    """匹配汉字串的正则，串中不含chars中的字（按码位切分字符区间，避免逐字前瞻）"""
+    ranges = []
+    low = 0x4e00
+    for code in sorted(ord(c) for c in set(chars)):
+        if low < code:
+            ranges.append(f"\\u{low:04x}-\\u{code - 1:04x}")
+        low = code + 1
+    ranges.append(f"\\u{low:04x}-\\u9fa5")
+    return f"[{''.join(ranges)}]+"
 
 class NERService:
-    def __init__(self):
-        """初始化正则表达式规则（匹配中文医疗文本中的敏感实体）"""
+    # 单遍扫描时的模式优先级：格式明确的类型在前，NAME / PATIENT_ID 等宽泛模式在后
+    # （检查号与患者ID在文本中无法区分，不单设ACCESSION类型，统一报告为PATIENT_ID）
+    PATTERN_PRIORITY = ["ID", "PHONE", "DATE", "INSTITUTION", "ADDRESS", "SEX", "NAME", "AGE", "PATIENT_ID"]
+    ENGLISH_PATTERN_PRIORITY = ["ID_NUMBER", "PHONE", "NAME", "ADDRESS"]
+    # 纯数字/编号类模式只匹配完整token（AGE只匹配独立的1-3位数字）
+    TOKEN_BOUNDED_TYPES = ["ID", "PHONE", "AGE", "PATIENT_ID", "ID_NUMBER"]
+    # 各实体类型的基础置信度
+    BASE_CONFIDENCE = {
+        "NAME": 0.95,
+        "ID": 0.99,
+        "PHONE": 0.97,
+        "AGE": 0.90,
+        "DATE": 0.93,
+        "ADDRESS": 0.85,
+        "PATIENT_ID": 0.98,
+        "INSTITUTION": 0.88,
+    }
+    
+    # 批量检测：每个进程池任务的最大行数；少于MIN_PARALLEL_ROWS行时在当前进程处理
+    BATCH_CHUNK_ROWS = 2000
+    MIN_PARALLEL_ROWS = 5000
+    # 长文本：超过LONG_TEXT_CHARS字符时按窗口切分并行扫描，相邻窗口两侧各多扫描WINDOW_OVERLAP字符作为上下文
+    LONG_TEXT_CHARS = 1_000_000
+    WINDOW_CHARS = 256_000
+    WINDOW_OVERLAP = 4096
+    
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        初始化正则表达式规则（匹配中文医疗文本中的敏感实体）
+        :param max_workers: 批量检测的进程池大小（默认CPU核数，<=1时串行处理）
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 中文姓名不在此列，由姓氏前缀树识别（见name_detector）
         self.patterns = {
-            "NAME": r"([\u4e00-\u9fa5]{2,4})",  # 中文姓名
             "ID": r"(\d{17}[\dXx]|\d{15}|\d{9})",  # 身份证号（支持9位）
             "PHONE": r"(1[3-9]\d{9})",  # 手机号
             "AGE": r"(\d{1,3})",  # 年龄（纯数字）
             "DATE": r"(\d{4}[年\-]\d{1,2}[月\-]\d{1,2}日?)",  # 日期
             "ADDRESS": r"([\u4e00-\u9fa5]+(省|市|区|县|街道|路|号))",  # 地址
-            "PATIENT_ID": r"([A-Za-z0-9]+)",  # 患者ID
-            "ACCESSION": r"([A-Za-z0-9]+)",  # 检查号
+            "PATIENT_ID": r"([A-Za-z0-9]+)",  # 患者ID / 检查号
             "INSTITUTION": r"([\u4e00-\u9fa5]+(医院|中心|诊所))",  # 机构名称
             "SEX": r"(Male|Female|男|女)",  # 性别
         }
@@ -25,8 +183,16 @@ class NERService:
             "NAME": r"[A-Z][a-z]+ [A-Z][a-z]+",  # 英文姓名
             "PHONE": r"\d{11}",  # 11位电话号码
             "ID_NUMBER": r"\d{17}[\dXx]",  # 18位身份证号
-            "ADDRESS": r".+?(路|街|座|县|市|区|省)",  # 地址
+            "ADDRESS": r"[^\s\d,，.。;；:：]+?(路|街|座|县|市|区|省)",  # 地址（不跨越空白、数字和标点）
         }
+        
+        # 中文姓名由姓氏前缀树识别（进程内共享），其余类型由单遍扫描引擎识别
+        # 汉字串整段跳过，但不跳过SEX的单字（"患者为女性"中的"女"在串中间，须逐字匹配）
+        self.name_detector = get_name_detector()
+        self.scanner = PatternScanner(self.patterns, self.PATTERN_PRIORITY, self.TOKEN_BOUNDED_TYPES,
+                                      skip=_han_run_except("男女"))
+        self.english_scanner = PatternScanner(self.english_patterns, self.ENGLISH_PATTERN_PRIORITY,
+                                              self.TOKEN_BOUNDED_TYPES)
 
     def detect_from_text(self, text: str, use_english: bool = False) -> List[Dict]:
         """
@@ -35,39 +201,121 @@ class NERService:
         :param use_english: 是否使用英文模式
         :return: [{"type": "NAME", "text": "张三", "start": 2, "end": 4, "confidence": 0.95}, ...]
         """
-        entities = []
-        patterns = self.english_patterns if use_english else self.patterns
-        
-        for entity_type, pattern in patterns.items():
-            for match in re.finditer(pattern, text):
-                if use_english:
-                    # 英文模式直接匹配整个文本
-                    start, end = match.start(), match.end()
-                    text_content = match.group()
-                else:
-                    # 中文模式使用第一个分组
-                    start, end = match.start(1), match.end(1)
-                    text_content = match.group(1)
-                
-                entities.append({
-                    "type": entity_type,
-                    "text": text_content,
-                    "start": start,
-                    "end": end,
-                    "confidence": self._calc_confidence(entity_type, text_content)
-                })
+        if len(text) >= self.LONG_TEXT_CHARS and self.max_workers > 1:
+            return self.detect_long_text(text, use_english)
+        return self._detect_entities(text, use_english)
+    
+    def _detect_entities(self, text: str, use_english: bool = False) -> List[Dict]:
+        """在当前线程内扫描整段文本（detect_from_text的单线程实现）"""
+        if use_english:
+            matches = (
+                (entity_type, start, end, value, self._calc_confidence(entity_type, value))
+                for entity_type, start, end, value in self.english_scanner.scan(text)
+            )
+        else:
+            matches = self._scan(text)
+        return [
+            {
+                "type": entity_type,
+                "text": text_content,
+                "start": start,
+                "end": end,
+                "confidence": confidence
+            }
+            for entity_type, start, end, text_content, confidence in matches
+        ]
+    
+    def detect_long_text(self, text: str, use_english: bool = False,
+                         window_chars: Optional[int] = None) -> List[Dict]:
+        """
+        长文本模式：切分为带重叠的窗口并行扫描，再按窗口归属合并
+        每个窗口只保留起点落在自身核心区间内的实体，重叠部分只提供上下文，因此边界处不会重复
+        :param text: 输入文本（如数MB的出院小结、病理报告）
+        :param use_english: 是否使用英文模式
+        :param window_chars: 窗口核心区间长度（默认WINDOW_CHARS）
+        :return: 与detect_from_text相同格式的实体列表（按位置排序）
+        """
+        window_chars = window_chars or self.WINDOW_CHARS
+        overlap = self.WINDOW_OVERLAP
+        tasks = []
+        for core_start in range(0, len(text), window_chars):
+            core_end = min(core_start + window_chars, len(text))
+            offset = max(0, core_start - overlap)
+            tasks.append((text[offset:core_end + overlap], offset, core_start, core_end, use_english))
         
-        return entities
+        if self.max_workers <= 1 or len(tasks) < 2:
+            outcomes = (_scan_window(self, *task) for task in tasks)
+        else:
+            outcomes = self._get_executor().map(_ner_window_task, tasks)
+        return [entity for window_entities in outcomes for entity in window_entities]
+    
+    def _scan(self, text: str) -> Iterator[Tuple[str, int, int, str, float]]:
+        """
+        中文模式扫描：先识别姓名，再对姓名之间的片段做单遍模式扫描（地址等宽泛模式不会吞掉姓名）
+        按位置顺序生成 (实体类型, start, end, 文本, 置信度)，结果互不重叠
+        """
+        # 置信度只取决于类型和长度，同一文本内缓存复用
+        confidences = {}
+        pos = 0
+        for start, end, confidence in self.name_detector.find(text) + [(len(text), len(text), None)]:
+            for entity_type, s, e, value in self.scanner.scan(text, pos, start):
+                key = (entity_type, e - s)
+                if key not in confidences:
+                    confidences[key] = self._calc_confidence(entity_type, value)
+                yield entity_type, s, e, value, confidences[key]
+            if confidence is not None:
+                yield "NAME", start, end, text[start:end], confidence
+            pos = end
 
     def detect_from_dataframe(self, df: pd.DataFrame, text_column: str = "text") -> pd.DataFrame:
         """
-        从DataFrame中批量检测敏感实体
+        从DataFrame中批量检测敏感实体（行数较多时分块并行）
         :param df: 输入DataFrame（必须包含文本列）
         :param text_column: 文本列的列名（默认"text"）
         :return: 新增了"entities"列的DataFrame（每行存储该文本的实体列表）
         """
-        df["entities"] = df[text_column].apply(self.detect_from_text)
+        entities, _ = self.detect_batch(df, [text_column], anonymize=False)
+        df["entities"] = entities
         return df
+    
+    def detect_batch(self, df: pd.DataFrame, columns: List[str],
+                     anonymize: bool = True) -> Tuple[List[List[Dict]], Dict[str, List[str]]]:
+        """
+        批量检测（并匿名化）多列文本：按行切块分发到进程池，结果按输入顺序拼接
+        :param df: 输入DataFrame
+        :param columns: 需要处理的列名（单元格统一转为字符串）
+        :param anonymize: 是否同时生成匿名化文本
+        :return: (每行各列实体合并后的列表, {列名: 匿名化文本列表})，anonymize=False时后者为空
+        """
+        texts = {col: list(map(str, df[col].tolist())) for col in columns}
+        total = len(df)
+        if self.max_workers <= 1 or total < self.MIN_PARALLEL_ROWS:
+            return _detect_chunk(self, texts, total, anonymize)
+        
+        chunk_rows = max(1, min(self.BATCH_CHUNK_ROWS, -(-total // (self.max_workers * 4))))
+        tasks = (
+            ({col: values[start:start + chunk_rows] for col, values in texts.items()},
+             min(chunk_rows, total - start), anonymize)
+            for start in range(0, total, chunk_rows)
+        )
+        entities = []
+        anonymized = {col: [] for col in columns} if anonymize else {}
+        for chunk_entities, chunk_anonymized in self._get_executor().map(_ner_chunk_task, tasks):
+            entities.extend(chunk_entities)
+            for col, values in chunk_anonymized.items():
+                anonymized[col].extend(values)
+        return entities, anonymized
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+    
+    def shutdown(self):
+        """关闭批量检测进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
 
     def anonymize_text(self, text: str, entities: List[Dict]) -> str:
         """
@@ -76,25 +324,21 @@ class NERService:
         :param entities: detect_from_text()返回的实体列表
         :return: 匿名化后的文本（如 "患者[NAME]，电话[PHONE]"）
         """
-        # 按起始位置逆序处理，避免影响后续位置
-        for entity in sorted(entities, key=lambda x: -x["start"]):
-            text = text[:entity["start"]] + f"[{entity['type']}]" + text[entity["end"]:]
-        return text
+        # 重叠的实体只替换最佳的一个
+        entities = resolve_overlaps(entities, self.PATTERN_PRIORITY)
+        # 按起始位置顺序收集片段，最后一次拼接（逐次拼接整段文本是平方复杂度）
+        parts = []
+        pos = 0
+        for entity in sorted(entities, key=lambda x: x["start"]):
+            parts.append(text[pos:entity["start"]])
+            parts.append(f"[{entity['type']}]")
+            pos = entity["end"]
+        parts.append(text[pos:])
+        return "".join(parts)
 
     def _calc_confidence(self, entity_type: str, text: str) -> float:
         """计算实体识别置信度（可自定义规则）"""
-        base_conf = {
-            "NAME": 0.95,
-            "ID": 0.99,
-            "PHONE": 0.97,
-            "AGE": 0.90,
-            "DATE": 0.93,
-            "ADDRESS": 0.85,
-            "PATIENT_ID": 0.98,
-            "ACCESSION": 0.96,
-            "INSTITUTION": 0.88,
-        }
-        return base_conf.get(entity_type, 0.8) * min(1.0, 0.9 + 0.1 * len(text) / 10)  # 长度越长置信度越高
+        return self.BASE_CONFIDENCE.get(entity_type, 0.8) * min(1.0, 0.9 + 0.1 * len(text) / 10)  # 长度越长置信度越高
     
     def process_csv(self, input_path: str, output_path: str, columns: Optional[List[str]] = None) -> bool:
         """
@@ -106,13 +350,13 @@ class NERService:
         """
         try:
             # 读取CSV文件
-            df = pd.read_csv(input_path, encoding='utf-8', encoding_errors='ignore')
+            df = load_table(input_path)
             
             # 如果没有指定列，自动检测文本列
             if columns is None:
                 text_columns = []
                 for col in df.columns:
-                    if df[col].dtype == 'object':  # 文本列
+                    if df[col].dtype == 'object' or pd.api.types.is_string_dtype(df[col]):  # 文本列
                         # 检查是否包含中文或英文文本
                         sample_text = str(df[col].iloc[0]) if len(df) > 0 else ""
                         if any('\u4e00' <= char <= '\u9fff' for char in sample_text) or \
@@ -122,30 +366,15 @@ class NERService:
             
             print(f"处理列: {columns}")
             
-            # 为每行添加实体检测结果
-            df['detected_entities'] = ""
+            # 批量检测并匿名化，结果列一次性写回
+            columns = [col for col in columns if col in df.columns]
+            entities, anonymized = self.detect_batch(df, columns)
+            # 按列标签整体写回（列名可能不是字符串，不能作为assign的关键字参数）
+            if anonymized:
+                df[list(anonymized)] = pd.DataFrame(anonymized, index=df.index)
+            df['detected_entities'] = [str(row_entities) for row_entities in entities]
             df['anonymized_text'] = ""
             
-            for idx, row in df.iterrows():
-                all_entities = []
-                anonymized_row = row.copy()
-                
-                for col in columns:
-                    if col in df.columns:
-                        text = str(row[col])
-                        entities = self.detect_from_text(text)
-                        all_entities.extend(entities)
-                        
-                        # 匿名化文本
-                        anonymized_text = self.anonymize_text(text, entities)
-                        anonymized_row[col] = anonymized_text
-                
-                # 保存结果
-                df.at[idx, 'detected_entities'] = str(all_entities)
-                for col in columns:
-                    if col in df.columns:
-                        df.at[idx, col] = anonymized_row[col]
-            
             # 保存处理后的CSV
             df.to_csv(output_path, index=False, encoding='utf-8')
             print(f"处理完成！已保存到 {output_path}")
@@ -156,18 +385,66 @@ class NERService:
             return False
     
     def detect_pii(self, text: str) -> Dict[str, List[str]]:
-        """检测文本中的 PII（个人身份信息）"""
-        detected_pii = {}
-        for pii_type, pattern in self.patterns.items():
-            matches = re.findall(pattern, text)
-            if matches:
-                detected_pii[pii_type] = matches
-        return detected_pii
+        """检测文本中的 PII（个人身份信息），与detect_from_text共用单遍扫描引擎"""
+        found = {}
+        for pii_type, _, _, value, _ in self._scan(text):
+            found.setdefault(pii_type, []).append(value)
+        return {pii_type: found[pii_type] for pii_type in ["NAME", *self.patterns] if pii_type in found}
+
+# 工作进程内复用的NER实例
+_worker_ner: Optional[NERService] = None
+
+def _detect_chunk(ner: NERService, texts: Dict[str, List[str]], rows: int,
+                  anonymize: bool) -> Tuple[List[List[Dict]], Dict[str, List[str]]]:
+    """检测一块行：返回 (每行各列实体合并后的列表, {列名: 匿名化文本列表})"""
+    entities = [[] for _ in range(rows)]
+    anonymized = {}
+    for col, values in texts.items():
+        col_anonymized = []
+        for i, text in enumerate(values):
+            found = ner.detect_from_text(text)
+            entities[i].extend(found)
+            if anonymize:
+                col_anonymized.append(ner.anonymize_text(text, found))
+        if anonymize:
+            anonymized[col] = col_anonymized
+    return entities, anonymized
+
+def _scan_window(ner: NERService, text: str, offset: int, core_start: int, core_end: int,
+                 use_english: bool) -> List[Dict]:
+    """扫描一个窗口（text为原文[offset:...]），只保留起点在 [core_start, core_end) 内的实体并换算回原文偏移"""
+    entities = []
+    for entity in ner._detect_entities(text, use_english):
+        start = entity["start"] + offset
+        if core_start <= start < core_end:
+            entity["start"] = start
+            entity["end"] += offset
+            entities.append(entity)
+    return entities
+
+def _get_worker_ner() -> NERService:
+    """工作进程内的NER实例（首次调用时创建，串行处理）"""
+    global _worker_ner
+    if _worker_ner is None:
+        _worker_ner = NERService(max_workers=1)
+    return _worker_ner
+
+def _ner_chunk_task(task: Tuple[Dict[str, List[str]], int, bool]) -> Tuple[List[List[Dict]], Dict[str, List[str]]]:
+    """工作进程任务：检测（并匿名化）一块行"""
+    texts, rows, anonymize = task
+    return _detect_chunk(_get_worker_ner(), texts, rows, anonymize)
+
+def _ner_window_task(task: Tuple[str, int, int, int, bool]) -> List[Dict]:
+    """工作进程任务：扫描长文本的一个窗口"""
+    return _scan_window(_get_worker_ner(), *task)
 
 class ClinicalNER:
     """临床NER服务，专门用于医疗文本"""
-    def __init__(self):
-        self.ner_service = NERService()
+    def __init__(self, ner_service: Optional[NERService] = None):
+        """
+        :param ner_service: 共享的NERService实例（默认新建）
+        """
+        self.ner_service = ner_service or NERService()
     
     def detect(self, text: str) -> List[Dict]:
         """检测临床文本中的敏感实体"""
@@ -8,6 +8,7 @@ from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from dataclasses import dataclass
 from datetime import datetime
+from services.span_resolver import resolve_overlaps
 
 @dataclass
 class PrivacyDetectionResult:
@@ -48,7 +49,8 @@ class PrivacyProtectionInterface:
         # 创建检测结果对象
         privacy_result = PrivacyDetectionResult(
             session_id=session_id,
-            text_entities=detection_result.get('text_entities', []),
+            # 重叠 / 重复的实体只保留每个区域的最佳实体，避免重复保护
+            text_entities=resolve_overlaps(detection_result.get('text_entities', [])),
             dicom_metadata=detection_result.get('dicom_metadata', {}),
             cross_modal_risks=detection_result.get('cross_modal_risks', []),
             risk_score=self._calculate_risk_score(detection_result),
@@ -4,7 +4,7 @@
 """
 import hashlib, base64, re, json, time, uuid
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Optional, Tuple, List, Callable
 import numpy as np
 import pandas as pd
 import pydicom
@@ -225,12 +225,14 @@ class ProtectionService:
             "cipher_by_col": cipher_by_col
         }
     
-    def protect_batch(self, detection_result: Dict, output_dir: Path, batch_id: str = None) -> Dict:
+    def protect_batch(self, detection_result: Dict, output_dir: Path, batch_id: str = None,
+                      progress_callback: Optional[Callable[..., None]] = None) -> Dict:
         """
         批量保护检测结果
         :param detection_result: 从 /api/batch_detect 返回的结果
         :param output_dir: 输出目录
         :param batch_id: 批次ID
+        :param progress_callback: 进度回调 (已处理数, 总数, 已处理字节数)
         :return: 保护结果摘要
         """
         if batch_id is None:
@@ -243,8 +245,11 @@ class ProtectionService:
         
         results = detection_result.get('results', [])
         manifests = []
+        bytes_done = 0
         
-        for item in results:
+        for i, item in enumerate(results):
+            if progress_callback:
+                progress_callback(i, len(results), bytes_done)
             if not item.get('matched'):
                 continue
             
@@ -260,6 +265,7 @@ class ProtectionService:
                 # 使用patient_id作为输出文件名，确保DICOM和JSON文件名匹配
                 dicom_out = out_dicom / f"{patient_id}.dcm"
                 m_dcm = self.protect_dicom(dcm_path, dicom_out, assoc=batch_id)
+                bytes_done += dcm_path.stat().st_size
             else:
                 m_dcm = {"error": "DICOM not found"}
             
@@ -287,6 +293,9 @@ class ProtectionService:
                 "text": {"path": str(out_text_path)}
             })
         
+        if progress_callback:
+            progress_callback(len(results), len(results), bytes_done)
+        
         # 生成审计清单
         audit = {
             "assoc": batch_id,
@@ -1,10 +1,15 @@
+import os
+import queue
+import threading
 import pydicom
 import numpy as np
 import torch
 import cv2
-from typing import Optional, Tuple, Dict, List
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Dict, List, Callable, Iterable
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pydicom.errors import InvalidDicomError
 from PIL import Image
 
@@ -26,12 +31,12 @@ PHI_TAGS = [
 
 @dataclass
 class DicomProcessingResult:
+    """
+    DICOM处理结果：header字段在解析时填好（不解码像素）
+    像素、归一化tensor与ROI在首次访问时从源文件解码并缓存，只读header或形状的调用方不会触发解码
+    """
     dicom_path: str
-    pixel_array: np.ndarray
-    normalized_tensor: torch.Tensor
     metadata: Dict[str, str]
-    roi_mask: Optional[np.ndarray] = None
-    roi_boxes: Optional[List[Tuple[int,int,int,int]]] = None
     patient_id: Optional[str] = None
     patient_name: Optional[str] = None
     accession: Optional[str] = None
@@ -40,32 +45,122 @@ class DicomProcessingResult:
     patient_sex: Optional[str] = None
     patient_age: Optional[str] = None
     burned_in_annotation: Optional[str] = None
-    roi_type: str = "header_only"
     image_size: Optional[Tuple[int,int]] = None
+    pixel_shape: Optional[Tuple[int, ...]] = None  # 解码后像素数组的形状（由header的行列数、帧数、采样数推出）
+    try_burnedin: bool = False
+    processor: Optional["DicomProcessor"] = field(default=None, repr=False, compare=False)
+    pixel_error: Optional[str] = field(default=None, init=False, compare=False)  # 烧录检测时像素解码失败的原因
+    _pixel_array: Optional[np.ndarray] = field(default=None, init=False, repr=False, compare=False)
+    _normalized_tensor: Optional[torch.Tensor] = field(default=None, init=False, repr=False, compare=False)
+    _roi: Optional[Tuple[Optional[np.ndarray], List[Tuple[int,int,int,int]]]] = field(
+        default=None, init=False, repr=False, compare=False)
+    
+    @property
+    def pixel_array(self) -> np.ndarray:
+        """归一化到0-1的float32像素（首次访问时解码）"""
+        if self._pixel_array is None:
+            self._pixel_array = self.processor.load_pixel_array(Path(self.dicom_path))
+        return self._pixel_array
+    
+    @property
+    def normalized_tensor(self) -> torch.Tensor:
+        """[1, 1, ...] 形状的归一化tensor（首次访问时生成）"""
+        if self._normalized_tensor is None:
+            self._normalized_tensor = self.processor._normalize_to_tensor(self.pixel_array)
+        return self._normalized_tensor
+    
+    def _detect_roi(self) -> Tuple[Optional[np.ndarray], List[Tuple[int,int,int,int]]]:
+        if self._roi is None:
+            if not self.try_burnedin:
+                self._roi = (None, [])
+            else:
+                try:
+                    pixel_array = self.pixel_array
+                except Exception as e:
+                    print(f"ROI detection failed: {e}")
+                    self.pixel_error = str(e) or type(e).__name__
+                    pixel_array = None
+                self._roi = self.processor._detect_roi_regions(pixel_array, True) if pixel_array is not None else (None, [])
+        return self._roi
+    
+    @property
+    def roi_mask(self) -> Optional[np.ndarray]:
+        """烧录文本区域掩码（未做烧录检测时为None）"""
+        return self._detect_roi()[0]
+    
+    @property
+    def roi_boxes(self) -> List[Tuple[int,int,int,int]]:
+        return self._detect_roi()[1]
+    
+    @property
+    def roi_type(self) -> str:
+        """burned_in / header_only；像素无法解码时为pixel_error（原因见pixel_error）"""
+        if self.roi_boxes:
+            return "burned_in"
+        return "pixel_error" if self.pixel_error else "header_only"
+    
+    def tensor_info(self) -> Dict:
+        """归一化tensor的形状/类型/设备（已生成时取实际tensor，否则由header推出，不触发解码）"""
+        if self._normalized_tensor is not None:
+            tensor = self._normalized_tensor
+            return {"shape": list(tensor.shape), "dtype": str(tensor.dtype), "device": str(tensor.device)}
+        return {
+            "shape": [1, 1, *self.pixel_shape],
+            "dtype": str(torch.float32),
+            "device": str(torch.device(self.processor.device))
+        }
+    
+    def release_pixels(self):
+        """释放已解码的像素与tensor（ROI结果保留，需要时重新从源文件解码）"""
+        self._pixel_array = None
+        self._normalized_tensor = None
+
+@dataclass
+class DicomHeaderRecord:
+    """仅包含header信息的轻量记录（不解码像素）"""
+    dicom_path: str
+    metadata: Dict[str, str]
+    patient_id: Optional[str] = None
+    patient_name: Optional[str] = None
+    accession: Optional[str] = None
+    study_date: Optional[str] = None
+    institution: Optional[str] = None
+    patient_sex: Optional[str] = None
+    patient_age: Optional[str] = None
+    sop_instance_uid: Optional[str] = None
 
 class DicomProcessor:
     def __init__(self, device: str = 'cpu'):
         self.device = device
+        # CLAHE对象内部有工作缓冲区，不能被多个线程同时使用：用完放回池中复用
+        self._clahe_pool = queue.SimpleQueue()
+        # 形态学结构元素缓存（按核尺寸）
+        self._kernels: Dict[Tuple[int, int], np.ndarray] = {}
+    
+    def _acquire_clahe(self):
+        try:
+            return self._clahe_pool.get_nowait()
+        except queue.Empty:
+            return cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    
+    def _structuring_element(self, kx: int, ky: int) -> np.ndarray:
+        kernel = self._kernels.get((kx, ky))
+        if kernel is None:
+            kernel = self._kernels.setdefault((kx, ky), cv2.getStructuringElement(cv2.MORPH_RECT, (kx, ky)))
+        return kernel
         
     def process_dicom(self, dicom_path: Path, try_burnedin: bool = False) -> Optional[DicomProcessingResult]:
-        """处理单个DICOM文件，提取像素数据和元数据"""
+        """处理单个DICOM文件：只读header，像素与ROI在结果中按需解码（见DicomProcessingResult）"""
         try:
-            ds = pydicom.dcmread(str(dicom_path), force=True)
-            pixel_array = self._get_pixel_array(ds)
+            ds = pydicom.dcmread(str(dicom_path), stop_before_pixels=True, force=True)
             
             # 提取header信息
             header = self._extract_header_info(ds)
-            
-            # 检测ROI区域
-            roi_mask, roi_boxes = self._detect_roi_regions(pixel_array, try_burnedin)
+            pixel_shape = self._pixel_shape(ds)
             
             return DicomProcessingResult(
                 dicom_path=str(dicom_path),
-                pixel_array=pixel_array,
-                normalized_tensor=self._normalize_to_tensor(pixel_array),
                 metadata=header,
-                roi_mask=roi_mask,
-                roi_boxes=roi_boxes,
                 patient_id=header.get("PatientID"),
                 patient_name=header.get("PatientName"),
                 accession=header.get("AccessionNumber"),
@@ -74,13 +169,58 @@ class DicomProcessor:
                 patient_sex=header.get("PatientSex"),
                 patient_age=header.get("PatientAge"),
                 burned_in_annotation=header.get("BurnedInAnnotation"),
-                roi_type="burned_in" if roi_boxes else "header_only",
-                image_size=pixel_array.shape[:2] if len(pixel_array.shape) >= 2 else None
+                image_size=pixel_shape[:2] if len(pixel_shape) >= 2 else None,
+                pixel_shape=pixel_shape,
+                try_burnedin=try_burnedin,
+                processor=self
             )
         except Exception as e:
             print(f"Error processing {dicom_path}: {str(e)}")
             return None
     
+    def load_pixel_array(self, dicom_path: Path) -> np.ndarray:
+        """从源文件解码并标准化像素数据"""
+        ds = pydicom.dcmread(str(dicom_path), force=True)
+        return self._get_pixel_array(ds)
+    
+    @staticmethod
+    def _pixel_shape(ds: pydicom.Dataset) -> Tuple[int, ...]:
+        """由header推出pixel_array的形状（多帧时帧数在前，多通道时通道在后），没有图像时抛出异常"""
+        if "Rows" not in ds or "Columns" not in ds:
+            raise InvalidDicomError("缺少像素数据（Rows/Columns）")
+        frames = int(ds.get("NumberOfFrames", 1) or 1)
+        samples = int(ds.get("SamplesPerPixel", 1) or 1)
+        shape = (int(ds.Rows), int(ds.Columns))
+        if frames > 1:
+            shape = (frames,) + shape
+        if samples > 1:
+            shape = shape + (samples,)
+        return shape
+    
+    def process_dicom_header(self, dicom_path: Path) -> Optional[DicomHeaderRecord]:
+        """仅提取DICOM header信息（stop_before_pixels，不解码像素数据）"""
+        try:
+            ds = pydicom.dcmread(str(dicom_path), stop_before_pixels=True, force=True)
+            header = self._extract_header_info(ds)
+            if all(v is None for v in header.values()):
+                raise InvalidDicomError("未找到任何DICOM标识信息")
+            
+            return DicomHeaderRecord(
+                dicom_path=str(dicom_path),
+                metadata=header,
+                patient_id=header.get("PatientID"),
+                patient_name=header.get("PatientName"),
+                accession=header.get("AccessionNumber"),
+                study_date=header.get("StudyDate"),
+                institution=header.get("InstitutionName"),
+                patient_sex=header.get("PatientSex"),
+                patient_age=header.get("PatientAge"),
+                sop_instance_uid=header.get("SOPInstanceUID")
+            )
+        except Exception as e:
+            print(f"Error reading header {dicom_path}: {str(e)}")
+            return None
+    
     def _get_pixel_array(self, ds: pydicom.Dataset) -> np.ndarray:
         """提取并标准化像素数据"""
         array = ds.pixel_array.astype(np.float32)
@@ -146,8 +286,11 @@ class DicomProcessor:
         h, w = gray_u8.shape
         
         # 使用CLAHE增强对比度
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        eq = clahe.apply(gray_u8)
+        clahe = self._acquire_clahe()
+        try:
+            eq = clahe.apply(gray_u8)
+        finally:
+            self._clahe_pool.put(clahe)
         
         # Otsu阈值化
         _, otsu = cv2.threshold(eq, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
@@ -156,7 +299,7 @@ class DicomProcessor:
         # 形态学操作
         kx = max(3, w // 300)
         ky = max(1, h // 400)
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kx, ky))
+        kernel = self._structuring_element(kx, ky)
         mor = cv2.morphologyEx(bin_img, cv2.MORPH_CLOSE, kernel, iterations=1)
         mor = cv2.medianBlur(mor, 3)
         
@@ -200,10 +343,255 @@ class DicomProcessor:
         
         return keep[:20]  # 最多保留20个区域
 
+class DicomResultCache:
+    """
+    单批次内的DICOM解析结果缓存（LRU，按 路径 + 修改时间 + 大小 失效）
+    header记录与含像素的完整结果分开存放：只需要header的调用方不会触发像素解码，
+    完整结果解析后同时填充header缓存
+    """
+    
+    def __init__(self, processor: DicomProcessor, max_results: int = 32, max_headers: int = 65536):
+        """
+        :param processor: 解析用的DicomProcessor
+        :param max_results: 最多缓存的完整结果数（像素与tensor按需解码后随结果缓存）
+        :param max_headers: 最多缓存的header记录数
+        """
+        self.processor = processor
+        self.max_results = max_results
+        self.max_headers = max_headers
+        self._results = OrderedDict()
+        self._headers = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'header_hits': 0, 'header_reads': 0, 'result_hits': 0, 'result_reads': 0}
+    
+    @staticmethod
+    def _key(dicom_path: Path) -> Tuple[str, Tuple[int, int]]:
+        st = os.stat(dicom_path)
+        return str(dicom_path), (st.st_mtime_ns, st.st_size)
+    
+    def _get(self, entries: OrderedDict, key: str, stamp: Tuple[int, int]):
+        entry = entries.get(key)
+        if entry and entry[0] == stamp:
+            entries.move_to_end(key)
+            return entry
+        return None
+    
+    def _put(self, entries: OrderedDict, limit: int, key: str, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+    
+    def header(self, dicom_path: Path) -> Optional[DicomHeaderRecord]:
+        """header记录（命中缓存，或只读header，不解码像素）"""
+        key, stamp = self._key(dicom_path)
+        with self._lock:
+            entry = self._get(self._headers, key, stamp)
+            if entry:
+                self.stats['header_hits'] += 1
+                return entry[1]
+        
+        record = self.processor.process_dicom_header(Path(dicom_path))
+        with self._lock:
+            self.stats['header_reads'] += 1
+            self._put(self._headers, self.max_headers, key, (stamp, record))
+        return record
+    
+    def result(self, dicom_path: Path, try_burnedin: bool = False) -> Optional[DicomProcessingResult]:
+        """完整结果（含像素）；已缓存的烧录检测结果也满足不要求烧录检测的调用"""
+        key, stamp = self._key(dicom_path)
+        with self._lock:
+            entry = self._get(self._results, key, stamp)
+            if entry and (entry[2] or not try_burnedin):
+                self.stats['result_hits'] += 1
+                return entry[1]
+        
+        result = self.processor.process_dicom(Path(dicom_path), try_burnedin=try_burnedin)
+        with self._lock:
+            self.stats['result_reads'] += 1
+            self._put(self._results, self.max_results, key, (stamp, result, try_burnedin))
+            if result is not None:
+                self._put(self._headers, self.max_headers, key, (stamp, self._header_from_result(result)))
+        return result
+    
+    @staticmethod
+    def _header_from_result(result: DicomProcessingResult) -> DicomHeaderRecord:
+        return DicomHeaderRecord(
+            dicom_path=result.dicom_path,
+            metadata=result.metadata,
+            patient_id=result.patient_id,
+            patient_name=result.patient_name,
+            accession=result.accession,
+            study_date=result.study_date,
+            institution=result.institution,
+            patient_sex=result.patient_sex,
+            patient_age=result.patient_age,
+            sop_instance_uid=result.metadata.get("SOPInstanceUID")
+        )
+
+# 工作进程内复用的处理器实例
+_worker_processor: Optional[DicomProcessor] = None
+
+def _extract_metadata_task(task: Tuple[str, bool, Optional[str]]) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    工作进程任务：提取单个DICOM文件的元数据记录，返回 (记录, 错误信息)
+    :param task: (文件路径, 是否检测烧录文本, 写盘时已算出的SHA-256或None)
+    """
+    global _worker_processor
+    file_path, try_burnedin, sha256 = task
+    if _worker_processor is None:
+        _worker_processor = DicomProcessor(device='cpu')
+    
+    try:
+        if try_burnedin:
+            result = _worker_processor.process_dicom(Path(file_path), try_burnedin=True)
+        else:
+            result = _worker_processor.process_dicom_header(Path(file_path))
+        if not result:
+            return None, "无法解析DICOM文件"
+        record_roi = {}
+        if try_burnedin:
+            # 烧录检测需要解码像素：像素无法解码的文件计入失败，而不是当作没有烧录文本
+            roi_type = result.roi_type
+            result.release_pixels()
+            if result.pixel_error:
+                return None, f"像素解码失败: {result.pixel_error}"
+            record_roi = {'roi_type': roi_type, 'roi_boxes': [list(box) for box in result.roi_boxes]}
+        stat = os.stat(file_path)
+        return {
+            'filename': Path(file_path).name,
+            'filepath': str(file_path).replace('\\', '/'),  # 跨平台路径兼容
+            'patient_id': result.patient_id or '',
+            'patient_sex': result.patient_sex or '',
+            'patient_age': result.patient_age or '',
+            'study_date': result.study_date or '',
+            'accession': result.accession or '',
+            'institution': result.institution or '',
+            'sop_instance_uid': result.metadata.get("SOPInstanceUID") or '',
+            'sha256': sha256 or '',
+            # 提取时的文件大小与修改时间：按摘要复用该文件前据此确认内容未被替换
+            'file_size': stat.st_size,
+            'file_mtime_ns': stat.st_mtime_ns,
+            **record_roi
+        }, None
+    except Exception as e:
+        return None, str(e)
+
+class DicomMetadataExtractor:
+    """基于进程池的批量DICOM元数据提取器（保持输入顺序）"""
+    
+    # 边接收边提取时每个工作进程最多排队的文件数（生成方快于解析时不会无限提交）
+    INFLIGHT_PER_WORKER = 8
+    
+    def __init__(self, max_workers: Optional[int] = None, min_parallel_files: int = 32):
+        """
+        :param max_workers: 进程池大小（默认CPU核数，<=1时串行处理）
+        :param min_parallel_files: 少于该文件数时直接在当前进程处理
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_parallel_files = min_parallel_files
+        self._executor: Optional[ProcessPoolExecutor] = None
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+    
+    def extract(self, file_paths: List[Path], try_burnedin: bool = False,
+                progress_callback: Optional[Callable[..., None]] = None,
+                digests: Optional[Dict[Path, str]] = None) -> Tuple[List[Dict], List[Dict]]:
+        """
+        批量提取元数据
+        :param file_paths: DICOM文件路径列表
+        :param try_burnedin: 是否执行烧录文本检测（需要解码像素）
+        :param progress_callback: 进度回调 (已处理数, 总数, 已处理字节数)
+        :param digests: 写盘时已算出的SHA-256 {路径: 摘要}，不在其中的文件记录sha256为空（不会为此重读文件）
+        :return: (按输入顺序排列的metadata_list, 失败文件列表)
+        """
+        digests = digests or {}
+        tasks = [(str(p), try_burnedin, digests.get(Path(p))) for p in file_paths]
+        if self.max_workers <= 1 or len(tasks) < self.min_parallel_files:
+            outcomes = map(_extract_metadata_task, tasks)
+        else:
+            chunksize = max(1, len(tasks) // (self.max_workers * 4))
+            outcomes = self._get_executor().map(_extract_metadata_task, tasks, chunksize=chunksize)
+        return self._collect(tasks, outcomes, len(tasks), progress_callback)
+    
+    def extract_iter(self, file_paths: Iterable[Path], try_burnedin: bool = False,
+                     progress_callback: Optional[Callable[..., None]] = None,
+                     digests: Optional[Dict[Path, str]] = None) -> Tuple[List[Dict], List[Dict]]:
+        """
+        边接收边提取：每得到一个文件立即提交到进程池（用于归档流式解包等总数未知的场景）
+        最多同时提交 进程数 × INFLIGHT_PER_WORKER 个文件，按提交顺序取结果，排满时暂停读取生成方
+        :param file_paths: 逐个产生DICOM文件路径的可迭代对象
+        :param digests: 同extract；可由生成方在产生路径前写入（如归档解包时边写盘边计算）
+        :return: (按输入顺序排列的metadata_list, 失败文件列表)
+        """
+        digests = {} if digests is None else digests
+        executor = self._get_executor() if self.max_workers > 1 else None
+        window = self.max_workers * self.INFLIGHT_PER_WORKER
+        tasks = []
+        
+        def outcomes():
+            pending = deque()
+            try:
+                for p in file_paths:
+                    task = (str(p), try_burnedin, digests.get(Path(p)))
+                    tasks.append(task)
+                    if executor is None:
+                        yield _extract_metadata_task(task)
+                        continue
+                    pending.append(executor.submit(_extract_metadata_task, task))
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+        
+        return self._collect(tasks, outcomes(), None, progress_callback)
+    
+    def _collect(self, tasks: List[Tuple[str, bool, Optional[str]]], outcomes, total: Optional[int],
+                 progress_callback: Optional[Callable[..., None]] = None) -> Tuple[List[Dict], List[Dict]]:
+        """
+        按输入顺序汇总提取结果并上报进度
+        :param tasks: 与outcomes一一对应的任务（可随outcomes的生成逐步追加）
+        :param total: 文件总数，None表示未知
+        """
+        metadata_list = []
+        failures = []
+        bytes_done = 0
+        for i, (record, error) in enumerate(outcomes):
+            if record:
+                metadata_list.append(record)
+            else:
+                failures.append({'filename': Path(tasks[i][0]).name, 'error': error})
+                print(f"[WARN] 处理 {Path(tasks[i][0]).name} 失败: {error}")
+            if (i + 1) % 100 == 0:
+                print(f"[INFO] 已处理 {i + 1}/{total if total is not None else '?'} 个DICOM文件")
+            if progress_callback:
+                try:
+                    bytes_done += os.path.getsize(tasks[i][0])
+                except OSError:
+                    pass
+                progress_callback(i + 1, total, bytes_done)
+        
+        return metadata_list, failures
+    
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
 class ROISegmenter:
     """ROI分割服务"""
-    def __init__(self):
-        self.processor = DicomProcessor()
+    def __init__(self, processor: Optional[DicomProcessor] = None):
+        """
+        :param processor: 共享的DicomProcessor实例（默认新建）
+        """
+        self.processor = processor or DicomProcessor()
     
     def segment(self, pixel_array: np.ndarray) -> np.ndarray:
         """分割ROI区域"""
@@ -0,0 +1,57 @@
+"""
+服务注册表
+create_app中创建一次，持有长生命周期的服务实例（预编译正则、姓名词典、CLAHE对象与结构元素缓存），
+各代码路径共享同一组实例，启动时预热，首个请求不再承担构建开销
+"""
+import time
+import threading
+import numpy as np
+from typing import Dict, Optional
+from services.ner_service import NERService, ClinicalNER
+from services.roi_service import DicomProcessor, ROISegmenter, DicomMetadataExtractor
+
+class ServiceRegistry:
+    """进程内共享的服务实例"""
+    
+    # 预热用样例文本（覆盖姓名识别与各类模式）
+    WARMUP_TEXT = "患者张三，男，45岁，身份证号110101199001011234，电话13800138000，住北京市朝阳区建国路88号，2023-05-12就诊于北京协和医院。"
+    
+    def __init__(self, device: str = 'cpu', ner_workers: Optional[int] = None,
+                 dicom_workers: Optional[int] = None):
+        """
+        :param device: DICOM处理默认设备
+        :param ner_workers: 批量/长文本NER的进程池大小（默认CPU核数）
+        :param dicom_workers: DICOM元数据（header）提取的进程池大小（默认CPU核数）
+        """
+        self.device = device
+        self.ner = NERService(max_workers=ner_workers)
+        self.dicom_extractor = DicomMetadataExtractor(max_workers=dicom_workers)
+        self.clinical_ner = ClinicalNER(self.ner)
+        self._processors: Dict[str, DicomProcessor] = {}
+        self._lock = threading.Lock()
+        self.roi_segmenter = ROISegmenter(self.dicom_processor())
+    
+    def dicom_processor(self, device: Optional[str] = None) -> DicomProcessor:
+        """按设备共享的DicomProcessor（默认注册表设备）"""
+        device = device or self.device
+        processor = self._processors.get(device)
+        if processor is None:
+            with self._lock:
+                processor = self._processors.setdefault(device, DicomProcessor(device=device))
+        return processor
+    
+    def warm_up(self):
+        """预热：跑一遍NER与烧录文本检测，提前完成正则、CLAHE、结构元素与tensor的初始化"""
+        start_time = time.time()
+        self.ner.detect_from_text(self.WARMUP_TEXT)
+        processor = self.dicom_processor()
+        image = np.zeros((512, 512), dtype=np.float32)
+        image[200:230, 100:400] = 1.0
+        processor._detect_roi_regions(image, try_burnedin=True)
+        processor._normalize_to_tensor(image[:8, :8])
+        print(f"[INFO] 服务预热完成 ({(time.time() - start_time) * 1000:.0f}ms)")
+    
+    def shutdown(self):
+        """关闭NER与DICOM元数据提取进程池"""
+        self.ner.shutdown()
+        self.dicom_extractor.shutdown()
@@ -2,10 +2,11 @@
 存储与审计服务
 实现内容寻址存储(CAS)、SQLite索引、审计清单管理
 """
-import sqlite3, json, time, hashlib, shutil, zipfile
+import sqlite3, json, time, shutil, zipfile
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable
 import pydicom
+from services.file_digest import sha256_file
 
 class StorageAuditService:
     """存储与审计服务"""
@@ -61,11 +62,7 @@ class StorageAuditService:
     
     def _sha256_file(self, p: Path) -> str:
         """计算文件SHA256"""
-        h = hashlib.sha256()
-        with p.open("rb") as f:
-            for chunk in iter(lambda: f.read(1 << 20), b""):
-                h.update(chunk)
-        return h.hexdigest()
+        return sha256_file(p)
     
     def _cas_path(self, digest: str) -> Path:
         """获取CAS路径"""
@@ -80,12 +77,27 @@ class StorageAuditService:
             shutil.copy2(src, dst)
         return digest
     
-    def ingest_batch(self, protected_dicom: Path, protected_text: Path, batch_id: str) -> Dict:
+    def cas_lookup(self, digests: List[str]) -> Dict[str, Path]:
+        """
+        查询CAS中已有的对象（CAS存放保护后的输出文件，按原始文件摘要查询通常不会命中）
+        :param digests: SHA256列表（64位十六进制）
+        :return: {digest: CAS路径}
+        """
+        found = {}
+        for digest in digests:
+            p = self._cas_path(digest)
+            if p.exists():
+                found[digest] = p
+        return found
+    
+    def ingest_batch(self, protected_dicom: Path, protected_text: Path, batch_id: str,
+                     progress_callback: Optional[Callable[..., None]] = None) -> Dict:
         """
         批量入库
         :param protected_dicom: 保护后的DICOM目录
         :param protected_text: 保护后的文本目录
         :param batch_id: 批次ID
+        :param progress_callback: 进度回调 (已处理数, 总数, 已处理字节数)
         :return: 入库结果
         """
         # 保存审计材料
@@ -128,6 +140,7 @@ class StorageAuditService:
         stems = sorted(set(dicoms.keys()) & set(texts.keys()))
         
         ingested = 0
+        bytes_done = 0
         for stem in stems:
             dcm = dicoms[stem]
             txt = texts[stem]
@@ -152,6 +165,9 @@ class StorageAuditService:
                 VALUES(?,?,?,?,?,?,?,?,?)
             """, (sop, patient_id, d_sha, t_sha, 0, batch_id, int(time.time() * 1000), d_cas, t_cas))
             ingested += 1
+            bytes_done += dcm.stat().st_size + txt.stat().st_size
+            if progress_callback:
+                progress_callback(ingested, len(stems), bytes_done)
         
         self.conn.commit()
         
@@ -0,0 +1,411 @@
+"""
+表格格式嗅探与读取
+按文件头魔数识别xlsx / xls，CSV只读取开头一小段样本确定编码与分隔符，再用C解析器一次读入
+嗅探结果按上传文件缓存，detect / batch_detect / process_csv 等接口重复读取同一上传时直接复用
+首次读取后在源文件旁生成Arrow IPC列式缓存（.arrow-cache），之后按内存映射+列投影读取，不再解析CSV
+列式缓存只为缓存根目录（服务的上传目录，见configure_sidecar_roots）内的源文件生成
+"""
+import csv, codecs, os, threading, uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+    print("Warning: pyarrow not available, columnar upload cache disabled")
+
+# 嗅探样本大小
+SAMPLE_SIZE = 64 * 1024
+
+XLSX_MAGIC = b"PK\x03\x04"
+XLS_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# 字节序标记 -> 编码（utf-8-sig会去掉BOM，避免首列名带﻿）
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+# 无BOM时依次尝试的编码（latin1可解码任意字节，作为兜底）
+CANDIDATE_ENCODINGS = ('utf-8', 'gbk', 'latin1')
+# 候选分隔符（按优先级）
+CANDIDATE_SEPARATORS = (',', '\t', ';', '|', ' ')
+
+# 列式缓存文件后缀（追加在源文件名之后：a.csv -> a.csv.arrow-cache，a.csv与a.xlsx互不影响）
+SIDECAR_SUFFIX = '.arrow-cache'
+# 写入缓存schema元数据的标记：没有该标记的同名文件不是本模块生成的，不读取也不覆盖
+SIDECAR_MARKER = (b'table_reader_sidecar', b'1')
+
+# 允许生成列式缓存的根目录（默认为空，即不生成）
+_sidecar_roots: List[Path] = []
+
+@dataclass
+class TableDialect:
+    """表格文件格式：csv / xlsx / xls，CSV附带编码与分隔符"""
+    format: str
+    encoding: Optional[str] = None
+    sep: Optional[str] = None
+    # 编码是否已按全文确认（嗅探只看样本）
+    verified: bool = False
+    
+    @property
+    def is_excel(self) -> bool:
+        return self.format in ('xlsx', 'xls')
+    
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+def _detect_encoding(sample: bytes) -> str:
+    """根据BOM或样本解码结果确定编码（样本末尾被截断的多字节字符不算错误）"""
+    for bom, encoding in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in CANDIDATE_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin1'
+
+def _detect_separator(text: str) -> str:
+    """
+    确定分隔符：表头至少2列、且样本中绝大多数行的列数与表头一致的第一个候选
+    :param text: 解码后的样本（最后一行可能不完整，已去掉）
+    """
+    lines = text.splitlines()[:200]
+    for sep in CANDIDATE_SEPARATORS:
+        rows = [r for r in csv.reader(lines, delimiter=sep) if r]
+        if not rows or len(rows[0]) < 2:
+            continue
+        consistent = sum(1 for r in rows if len(r) == len(rows[0]))
+        if consistent >= 0.9 * len(rows):
+            return sep
+    try:
+        return csv.Sniffer().sniff(text[:SAMPLE_SIZE // 4], delimiters=''.join(CANDIDATE_SEPARATORS)).delimiter
+    except csv.Error:
+        return ','
+
+def sniff_table(path: str) -> TableDialect:
+    """
+    嗅探表格文件格式（只读取开头SAMPLE_SIZE字节）
+    :param path: CSV / Excel文件路径
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+        truncated = bool(f.read(1))
+    
+    if sample.startswith(XLSX_MAGIC):
+        return TableDialect('xlsx')
+    if sample.startswith(XLS_MAGIC):
+        return TableDialect('xls')
+    
+    encoding = _detect_encoding(sample)
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=not truncated)
+    if truncated and '\n' in text:
+        text = text[:text.rfind('\n')]
+    return TableDialect('csv', encoding, _detect_separator(text))
+
+class _DialectCache:
+    """按上传文件缓存嗅探结果（文件大小或修改时间变化时失效）"""
+    
+    MAX_ENTRIES = 1024
+    
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, path: str) -> TableDialect:
+        p = Path(path)
+        st = p.stat()
+        key = str(p.resolve())
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                return entry[1]
+        
+        dialect = sniff_table(path)
+        with self._lock:
+            self._entries[key] = (stamp, dialect)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.MAX_ENTRIES:
+                self._entries.popitem(last=False)
+        return dialect
+    
+    def update(self, path: str, dialect: TableDialect):
+        """记录按全文确认（或修正）后的编码"""
+        p = Path(path)
+        st = p.stat()
+        with self._lock:
+            self._entries[str(p.resolve())] = ((st.st_size, st.st_mtime_ns), dialect)
+
+_dialect_cache = _DialectCache()
+
+def get_table_dialect(path: str) -> TableDialect:
+    """获取文件格式（同一上传文件只嗅探一次）"""
+    return _dialect_cache.get(path)
+
+def _fallback_encodings(dialect: TableDialect) -> Iterator[str]:
+    """样本之后出现无法解码的字节时，依次尝试的其他编码"""
+    yield dialect.encoding
+    for encoding in CANDIDATE_ENCODINGS:
+        if encoding != dialect.encoding:
+            yield encoding
+
+def read_table(path: str, dialect: Optional[TableDialect] = None, **kwargs) -> pd.DataFrame:
+    """
+    按嗅探结果一次读入CSV / Excel
+    :param dialect: 已知的文件格式（默认从缓存获取）
+    :param kwargs: 透传给read_csv / read_excel（如usecols、dtype）
+    """
+    dialect = dialect or get_table_dialect(path)
+    if dialect.format == 'xlsx':
+        return pd.read_excel(path, engine='openpyxl', **kwargs)
+    if dialect.format == 'xls':
+        return pd.read_excel(path, engine='xlrd', **kwargs)
+    
+    for encoding in _fallback_encodings(dialect):
+        try:
+            df = pd.read_csv(path, encoding=encoding, sep=dialect.sep, engine='c', **kwargs)
+        except UnicodeDecodeError:
+            print(f"[WARN] {encoding}解码失败，尝试下一种编码...")
+            continue
+        if not dialect.verified or encoding != dialect.encoding:
+            # 整个文件已成功解码，后续分块读取无需再校验
+            _dialect_cache.update(path, TableDialect('csv', encoding, dialect.sep, verified=True))
+        return df
+    raise ValueError(f"无法解码文件: {path}")
+
+def iter_source_chunks(path: str, chunksize: int = 50000,
+                       dialect: Optional[TableDialect] = None, **kwargs) -> Iterator[pd.DataFrame]:
+    """
+    分块解析源文件（CSV用C解析器分块；Excel不支持分块读取，整体读入后切分）
+    """
+    dialect = dialect or get_table_dialect(path)
+    if dialect.is_excel:
+        df = read_table(path, dialect, **kwargs)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+        return
+    
+    # 分块模式下解码错误可能出现在已产出若干块之后，此时无法回退，先确保全文可解码
+    encoding = dialect.encoding
+    if not dialect.verified and encoding != 'latin1':
+        encoding = _verify_encoding(path, dialect)
+    yield from pd.read_csv(path, encoding=encoding, sep=dialect.sep, engine='c', chunksize=chunksize, **kwargs)
+
+def _verify_encoding(path: str, dialect: TableDialect) -> str:
+    """逐块增量解码确认全文编码（内存占用与文件大小无关），结果写回缓存"""
+    for encoding in _fallback_encodings(dialect):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            print(f"[WARN] {encoding.upper()}解码失败，尝试下一种编码...")
+            continue
+        _dialect_cache.update(path, TableDialect('csv', encoding, dialect.sep, verified=True))
+        return encoding
+    return 'latin1'
+
+def configure_sidecar_roots(roots: Iterable[str]):
+    """
+    设置允许生成列式缓存的根目录（create_app中设为上传目录）
+    接口可能收到任意服务端路径，只有位于这些目录内的源文件才会在旁边写缓存
+    """
+    _sidecar_roots[:] = [Path(r).resolve() for r in roots]
+
+def sidecar_path(path: str) -> Optional[Path]:
+    """
+    源文件对应的列式缓存路径（如 uploads/csv_ab12cd34.csv -> uploads/csv_ab12cd34.csv.arrow-cache）
+    源文件不在缓存根目录内时返回None
+    """
+    source = Path(path).resolve()
+    if not any(root in source.parents for root in _sidecar_roots):
+        return None
+    return source.with_name(source.name + SIDECAR_SUFFIX)
+
+def _source_stamp(path: str) -> Dict[bytes, bytes]:
+    st = Path(path).stat()
+    return {b'source_size': str(st.st_size).encode(), b'source_mtime_ns': str(st.st_mtime_ns).encode(),
+            SIDECAR_MARKER[0]: SIDECAR_MARKER[1]}
+
+def _is_own_sidecar(sidecar: Path) -> bool:
+    """已存在的文件是否为本模块生成的缓存（带标记的Arrow IPC文件）"""
+    try:
+        with pa.memory_map(str(sidecar), 'r') as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowException):
+        return False
+    return metadata.get(SIDECAR_MARKER[0]) == SIDECAR_MARKER[1]
+
+@contextmanager
+def _open_sidecar(path: str) -> Iterator[Optional["pa.Table"]]:
+    """
+    以内存映射方式打开有效的列式缓存（源文件变化后缓存失效），列数据在转换前不会读入内存
+    退出时关闭内存映射（已转换出的数据不受影响）；没有有效缓存时得到None
+    """
+    sidecar = sidecar_path(path) if HAS_ARROW else None
+    if sidecar is None or not sidecar.exists():
+        yield None
+        return
+    source = None
+    table = None
+    try:
+        source = pa.memory_map(str(sidecar), 'r')
+        table = pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowException) as e:
+        print(f"[WARN] 列式缓存损坏，重新解析源文件: {sidecar.name}: {e}")
+    try:
+        if table is not None:
+            metadata = table.schema.metadata or {}
+            if any(metadata.get(k) != v for k, v in _source_stamp(path).items()):
+                table = None
+        yield table
+    finally:
+        if source is not None:
+            source.close()
+
+class _SidecarWriter:
+    """逐块写入列式缓存（先写临时文件，全部写完才替换为正式缓存）；无法转换的数据会放弃缓存"""
+    
+    def __init__(self, path: str, sidecar: Path):
+        self.source = path
+        self.sidecar = sidecar
+        self.tmp = self.sidecar.with_name(f".{self.sidecar.name}.{uuid.uuid4().hex[:8]}.tmp")
+        self.stamp = _source_stamp(path)
+        self.sink = None
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+        self.failed = False
+    
+    def write(self, df: pd.DataFrame):
+        if self.failed:
+            return
+        try:
+            if self.writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self.schema = table.schema.with_metadata({**(table.schema.metadata or {}), **self.stamp})
+                self.sink = pa.OSFile(str(self.tmp), 'wb')
+                self.writer = pa.ipc.new_file(self.sink, self.schema)
+            else:
+                # 后续块按首块的列类型写入（类型不兼容时放弃缓存）
+                table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self.writer.write_table(table.replace_schema_metadata(self.schema.metadata), max_chunksize=65536)
+            self.rows += len(df)
+        except Exception as e:
+            # 缓存只是加速手段，任何失败都不影响本次读取
+            print(f"[WARN] 列式缓存生成失败，后续仍直接解析源文件: {e}")
+            self.abort()
+    
+    def commit(self):
+        if self.failed or self.writer is None:
+            self.abort()
+            return
+        try:
+            self.writer.close()
+            self.sink.close()
+            if self.sidecar.exists() and not _is_own_sidecar(self.sidecar):
+                print(f"[WARN] {self.sidecar.name} 已存在且不是列式缓存，不覆盖")
+                self.abort()
+                return
+            os.replace(self.tmp, self.sidecar)
+            print(f"[INFO] 已生成列式缓存: {self.sidecar.name} ({self.rows} 行)")
+        except (OSError, pa.ArrowException) as e:
+            print(f"[WARN] 列式缓存生成失败: {e}")
+            self.abort()
+    
+    def abort(self):
+        self.failed = True
+        for handle in (self.writer, self.sink):
+            try:
+                if handle is not None:
+                    handle.close()
+            except (OSError, pa.ArrowException):
+                pass
+        self.writer = self.sink = None
+        self.tmp.unlink(missing_ok=True)
+
+def _new_sidecar_writer(path: str) -> Optional[_SidecarWriter]:
+    """源文件允许生成缓存时返回写入器"""
+    sidecar = sidecar_path(path) if HAS_ARROW else None
+    return _SidecarWriter(path, sidecar) if sidecar is not None else None
+
+def _write_sidecar(path: str, df: pd.DataFrame):
+    """将解析结果写为不压缩的Arrow IPC文件（可直接内存映射）"""
+    writer = _new_sidecar_writer(path)
+    if writer is not None:
+        writer.write(df)
+        writer.commit()
+
+def _to_pandas(table: "pa.Table", start: int = 0) -> pd.DataFrame:
+    """转换为DataFrame，与直接解析一致：RangeIndex从start开始，文本列的空值为NaN（而非None）"""
+    df = table.to_pandas()
+    df.index = pd.RangeIndex(start, start + len(df))
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+def _project(table: "pa.Table", columns: Optional[List[str]]) -> "pa.Table":
+    if columns is None:
+        return table
+    return table.select([c for c in columns if c in table.column_names])
+
+def load_table(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    读取上传的表格：优先从列式缓存读取，没有时解析源文件并生成缓存（每个上传只解析一次）
+    :param columns: 只读取这些列（缺失的列忽略），默认全部
+    """
+    with _open_sidecar(path) as table:
+        if table is not None:
+            return _to_pandas(_project(table, columns))
+    
+    df = read_table(path)
+    _write_sidecar(path, df)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+def iter_table_chunks(path: str, chunksize: int = 50000,
+                      columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    分块读取上传的表格：有列式缓存时按块切片转换（零拷贝切片，内存占用与块大小相关），否则流式解析源文件并生成缓存
+    :param columns: 只读取这些列（缺失的列忽略），默认全部
+    """
+    with _open_sidecar(path) as table:
+        if table is not None:
+            table = _project(table, columns)
+            for start in range(0, table.num_rows, chunksize):
+                yield _to_pandas(table.slice(start, chunksize), start)
+            return
+    
+    # 首次分块读取时顺带逐块写入列式缓存（读完全部块才生效）
+    writer = _new_sidecar_writer(path)
+    completed = False
+    try:
+        for chunk in iter_source_chunks(path, chunksize):
+            if writer is not None:
+                writer.write(chunk)
+            if columns is not None:
+                chunk = chunk[[c for c in columns if c in chunk.columns]]
+            yield chunk
+        completed = True
+    finally:
+        if writer is not None:
+            if completed:
+                writer.commit()
+            else:
+                writer.abort()
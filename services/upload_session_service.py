@@ -0,0 +1,242 @@
+"""
+可续传分块上传服务
+上传会话登记文件列表，各分块按偏移量直接流式写入磁盘，全部完成后提交为一个批次
+"""
+import json, time, uuid, shutil, threading, re
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+from services.file_digest import sha256_file
+
+class UploadSessionError(Exception):
+    """上传会话错误（会话不存在、文件不完整、校验失败等）"""
+
+class UploadOffsetMismatch(UploadSessionError):
+    """分块偏移量与服务端已接收的字节数不一致，客户端应从expected_offset续传"""
+    
+    def __init__(self, expected_offset: int):
+        super().__init__(f"偏移量不一致，服务端已接收 {expected_offset} 字节")
+        self.expected_offset = expected_offset
+
+class UploadSessionManager:
+    """分块上传会话管理器（会话状态保存在磁盘，服务重启后可继续上传）"""
+    
+    # 建议的分块大小（字节），单个请求远小于MAX_CONTENT_LENGTH
+    CHUNK_SIZE = 8 * 1024 * 1024
+    # 写盘缓冲大小
+    BUFFER_SIZE = 1 << 20
+    
+    def __init__(self, upload_dir: str):
+        """
+        初始化会话管理器
+        :param upload_dir: 上传目录，会话文件位于 upload_dir/upload_sessions/<upload_id>/
+        """
+        self.root = Path(upload_dir) / "upload_sessions"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        # 各会话正在写入的分块数与已开始提交/放弃的会话：提交等写入结束，提交开始后拒绝新的写入
+        self._writers: Dict[str, int] = {}
+        self._closing = set()
+        self._state = threading.Condition()
+    
+    def _lock(self, key) -> threading.Lock:
+        """会话级（upload_id）或文件级（upload_id, 序号）锁，不同文件的分块可并行上传"""
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+    
+    def _release_locks(self, upload_id: str):
+        with self._locks_guard:
+            for key in [k for k in self._locks if k == upload_id or (isinstance(k, tuple) and k[0] == upload_id)]:
+                del self._locks[key]
+    
+    def _begin_write(self, upload_id: str):
+        with self._state:
+            if upload_id in self._closing:
+                raise UploadSessionError(f"上传会话正在提交或已关闭: {upload_id}")
+            self._writers[upload_id] = self._writers.get(upload_id, 0) + 1
+    
+    def _end_write(self, upload_id: str):
+        with self._state:
+            self._writers[upload_id] -= 1
+            if not self._writers[upload_id]:
+                del self._writers[upload_id]
+                self._state.notify_all()
+    
+    def _begin_close(self, upload_id: str):
+        """标记会话开始提交/放弃：之后的分块写入被拒绝，并等待正在写入的分块结束"""
+        with self._state:
+            if upload_id in self._closing:
+                raise UploadSessionError(f"上传会话正在提交或已关闭: {upload_id}")
+            self._closing.add(upload_id)
+            self._state.wait_for(lambda: not self._writers.get(upload_id))
+    
+    def _end_close(self, upload_id: str):
+        with self._state:
+            self._closing.discard(upload_id)
+    
+    def _session_dir(self, upload_id: str) -> Path:
+        if not re.fullmatch(r"upload_[0-9a-f]{12}", upload_id or ""):
+            raise UploadSessionError(f"无效的上传会话: {upload_id}")
+        return self.root / upload_id
+    
+    def _part_path(self, upload_id: str, index: int) -> Path:
+        return self._session_dir(upload_id) / f"{index:06d}.part"
+    
+    def _load(self, upload_id: str) -> Dict:
+        manifest = self._session_dir(upload_id) / "session.json"
+        if not manifest.exists():
+            raise UploadSessionError(f"上传会话不存在: {upload_id}")
+        return json.loads(manifest.read_text(encoding='utf-8'))
+    
+    def create(self, files: List[Dict]) -> Dict:
+        """
+        创建上传会话
+        :param files: [{"filename": "a.dcm", "size": 字节数, "sha256": 可选}]
+        :return: 会话状态
+        """
+        if not files:
+            raise UploadSessionError("文件列表为空")
+        entries = []
+        for i, f in enumerate(files):
+            filename = Path(str(f.get("filename") or "")).name
+            size = int(f.get("size", -1))
+            if not filename or size < 0:
+                raise UploadSessionError(f"第 {i} 个文件缺少filename或size")
+            entries.append({"filename": filename, "size": size, "sha256": (f.get("sha256") or "").lower() or None})
+        if len({e["filename"] for e in entries}) != len(entries):
+            raise UploadSessionError("文件名重复")
+        
+        upload_id = f"upload_{uuid.uuid4().hex[:12]}"
+        session_dir = self._session_dir(upload_id)
+        session_dir.mkdir(parents=True)
+        for i in range(len(entries)):
+            self._part_path(upload_id, i).touch()
+        (session_dir / "session.json").write_text(
+            json.dumps({"upload_id": upload_id, "created_ms": int(time.time() * 1000), "files": entries},
+                       ensure_ascii=False), encoding='utf-8'
+        )
+        print(f"[INFO] 创建上传会话 {upload_id}: {len(entries)} 个文件，共 {sum(e['size'] for e in entries) / 1024 / 1024:.2f} MB")
+        return self.status(upload_id)
+    
+    def status(self, upload_id: str) -> Dict:
+        """会话状态：每个文件已接收的字节数（即下一个分块的偏移量）"""
+        session = self._load(upload_id)
+        files = []
+        for i, entry in enumerate(session["files"]):
+            part = self._part_path(upload_id, i)
+            received = part.stat().st_size if part.exists() else 0
+            files.append({
+                "file_index": i,
+                "filename": entry["filename"],
+                "size": entry["size"],
+                "received": received,
+                "complete": received == entry["size"]
+            })
+        return {
+            "upload_id": upload_id,
+            "chunk_size": self.CHUNK_SIZE,
+            "files": files,
+            "received_bytes": sum(f["received"] for f in files),
+            "total_bytes": sum(f["size"] for f in files),
+            "complete": all(f["complete"] for f in files)
+        }
+    
+    def write_chunk(self, upload_id: str, index: int, offset: int, stream: BinaryIO,
+                    length: Optional[int] = None) -> int:
+        """
+        将分块从请求流直接写入磁盘（按缓冲区读取，内存占用与分块大小无关）
+        :param index: 文件序号
+        :param offset: 分块在文件中的起始偏移量，必须等于已接收的字节数
+        :param length: 分块长度（Content-Length），未知时读到流结束
+        :return: 写入后该文件已接收的字节数
+        :raises UploadOffsetMismatch: 偏移量不一致
+        :raises UploadSessionError: 会话已开始提交
+        """
+        self._begin_write(upload_id)
+        try:
+            return self._write_chunk(upload_id, index, offset, stream, length)
+        finally:
+            self._end_write(upload_id)
+    
+    def _write_chunk(self, upload_id: str, index: int, offset: int, stream: BinaryIO,
+                     length: Optional[int]) -> int:
+        session = self._load(upload_id)
+        if not 0 <= index < len(session["files"]):
+            raise UploadSessionError(f"文件序号越界: {index}")
+        size = session["files"][index]["size"]
+        part = self._part_path(upload_id, index)
+        
+        with self._lock((upload_id, index)):
+            received = part.stat().st_size
+            if offset != received:
+                raise UploadOffsetMismatch(received)
+            remaining = size - received
+            if length is not None and length > remaining:
+                raise UploadSessionError(f"分块超出文件大小（剩余 {remaining} 字节）")
+            
+            # 连接中断时已写入的部分保留，客户端查询状态后从新的偏移量续传
+            with part.open("ab") as f:
+                to_read = remaining if length is None else length
+                while to_read > 0:
+                    buf = stream.read(min(self.BUFFER_SIZE, to_read))
+                    if not buf:
+                        break
+                    f.write(buf)
+                    to_read -= len(buf)
+                if length is None and stream.read(1):
+                    f.truncate(size)
+                    raise UploadSessionError("分块超出文件大小")
+            return part.stat().st_size
+    
+    def commit(self, upload_id: str, dest_dir: Path, digests: Optional[Dict[Path, str]] = None) -> List[Path]:
+        """
+        提交会话：校验所有文件完整（及SHA-256），移动到目标目录并删除会话
+        :param digests: 传入时写入已校验文件的 {目标路径: SHA-256}（只含创建会话时登记了sha256的文件）
+        :return: 目标目录中的文件路径（按登记顺序）
+        """
+        self._session_dir(upload_id)  # 先校验会话ID
+        self._begin_close(upload_id)
+        try:
+            paths = self._commit(upload_id, dest_dir, digests)
+        finally:
+            self._end_close(upload_id)
+        print(f"[INFO] 上传会话 {upload_id} 已提交: {len(paths)} 个文件")
+        return paths
+    
+    def _commit(self, upload_id: str, dest_dir: Path, digests: Optional[Dict[Path, str]]) -> List[Path]:
+        with self._lock(upload_id):
+            session = self._load(upload_id)
+            state = self.status(upload_id)
+            incomplete = [f["filename"] for f in state["files"] if not f["complete"]]
+            if incomplete:
+                raise UploadSessionError(f"{len(incomplete)} 个文件未上传完成: {', '.join(incomplete[:5])}")
+            
+            for i, entry in enumerate(session["files"]):
+                if entry["sha256"] and sha256_file(self._part_path(upload_id, i)) != entry["sha256"]:
+                    raise UploadSessionError(f"文件校验失败: {entry['filename']}")
+            
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            paths = []
+            for i, entry in enumerate(session["files"]):
+                dst = dest_dir / entry["filename"]
+                shutil.move(str(self._part_path(upload_id, i)), str(dst))
+                paths.append(dst)
+                if digests is not None and entry["sha256"]:
+                    digests[dst] = entry["sha256"]
+            shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+        self._release_locks(upload_id)
+        return paths
+    
+    def abort(self, upload_id: str) -> bool:
+        """放弃会话并删除已接收的数据"""
+        session_dir = self._session_dir(upload_id)
+        if not session_dir.exists():
+            return False
+        self._begin_close(upload_id)
+        try:
+            with self._lock(upload_id):
+                shutil.rmtree(session_dir, ignore_errors=True)
+            self._release_locks(upload_id)
+        finally:
+            self._end_close(upload_id)
+        return True
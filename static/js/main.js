@@ -66,6 +66,69 @@ function displayROIRegions(regions) {
     });
 }
 
+// 批处理阶段名称
+const JOB_STAGE_LABELS = {
+    upload: '上传',
+    detect: '检测',
+    protect: '保护',
+    ingest: '入库'
+};
+
+// 格式化任务进度（阶段、数量、吞吐量、预计剩余时间）
+function formatJobProgress(progress) {
+    const stage = JOB_STAGE_LABELS[progress.stage] || progress.stage;
+    const parts = [`${stage} ${progress.done}/${progress.total ?? '?'}`];
+    if (progress.percent !== null && progress.percent !== undefined) {
+        parts[0] += ` (${progress.percent}%)`;
+    }
+    parts.push(`${progress.files_per_sec} 文件/s`);
+    parts.push(`${progress.mb_per_sec} MB/s`);
+    if (progress.eta_seconds !== null && progress.eta_seconds !== undefined) {
+        parts.push(`剩余约 ${Math.ceil(progress.eta_seconds)}s`);
+    }
+    if (progress.stalled) {
+        parts.push('⚠️ 阶段停滞');
+    }
+    return parts.join(' · ');
+}
+
+// 以后台任务方式调用批处理接口，通过SSE接收实时进度，完成后返回任务结果
+async function runJobWithProgress(url, fetchOptions, onProgress) {
+    const response = await fetch(url, fetchOptions);
+    const accepted = await response.json();
+    
+    // 服务端未以任务方式执行时，直接返回同步结果
+    if (response.status !== 202 || !accepted.job_id) {
+        if (!response.ok) {
+            throw new Error(accepted.error || `请求失败: ${response.status}`);
+        }
+        return accepted;
+    }
+    
+    await new Promise((resolve, reject) => {
+        const source = new EventSource(`/api/jobs/${accepted.job_id}/events`);
+        source.addEventListener('progress', event => {
+            if (onProgress) onProgress(JSON.parse(event.data));
+        });
+        source.addEventListener('done', event => {
+            source.close();
+            const job = JSON.parse(event.data);
+            if (job.status === 'succeeded') {
+                resolve();
+            } else {
+                reject(new Error(job.error || `任务${job.status}`));
+            }
+        });
+        source.onerror = () => {
+            source.close();
+            reject(new Error('进度连接中断'));
+        };
+    });
+    
+    const resultResponse = await fetch(accepted.result_url);
+    return resultResponse.json();
+}
+
 // 处理文件上传
 document.getElementById('uploadForm')?.addEventListener('submit', async function(e) {
     e.preventDefault();
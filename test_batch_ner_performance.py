@@ -0,0 +1,134 @@
+"""
+批量NER微基准（process_csv的检测 + 匿名化）
+测试目标：分块批量检测比 iterrows + row.copy + df.at 逐格写回快2倍以上，且输出完全一致
+（多核机器上分块由进程池并行处理，加速比随核数增加）
+"""
+import time
+import json
+import sys
+import random
+import pandas as pd
+from pathlib import Path
+from services.ner_service import NERService
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚"
+FINDINGS = [
+    "患者{name}，{sex}，{age}岁，因咳嗽{days}天就诊。",
+    "住{city}市{district}区{road}路{no}号，联系电话{phone}。",
+    "双肺纹理增多，未见明显实变影，心影不大。",
+    "{date}于{city}市第一人民医院复查，检查号CT{accession}。",
+    "Patient {en_name}, {en_sex}, follow-up in 2 weeks.",
+]
+
+def build_table(rows: int, seed: int = 11) -> pd.DataFrame:
+    """生成模拟报告表（两列自由文本 + 一列数值）"""
+    rng = random.Random(seed)
+    
+    def sentence():
+        return rng.choice(FINDINGS).format(
+            name=rng.choice(SURNAMES) + "".join(rng.choice(GIVEN) for _ in range(rng.randint(1, 2))),
+            sex=rng.choice("男女"), age=rng.randint(18, 90), days=rng.randint(1, 14),
+            city=rng.choice(["北京", "上海", "成都"]), district=rng.choice(["朝阳", "海淀", "武侯"]),
+            road=rng.choice(["建国", "中山", "人民"]), no=rng.randint(1, 300),
+            phone=f"1{rng.choice('3456789')}{rng.randint(100000000, 999999999)}",
+            date=f"{rng.randint(2015, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            accession=rng.randint(10 ** 9, 10 ** 10), en_name=rng.choice(["John Smith", "Mary Jones"]),
+            en_sex=rng.choice(["Male", "Female"])
+        )
+    
+    return pd.DataFrame({
+        "report": ["".join(sentence() for _ in range(3)) for _ in range(rows)],
+        "impression": [sentence() for _ in range(rows)],
+        "score": [rng.randint(0, 100) for _ in range(rows)],
+    })
+
+def legacy_process(ner: NERService, df: pd.DataFrame, columns):
+    """旧实现：iterrows + row.copy + df.at 逐格写回"""
+    df = df.copy()
+    df['detected_entities'] = ""
+    df['anonymized_text'] = ""
+    for idx, row in df.iterrows():
+        all_entities = []
+        anonymized_row = row.copy()
+        for col in columns:
+            text = str(row[col])
+            entities = ner.detect_from_text(text)
+            all_entities.extend(entities)
+            anonymized_row[col] = ner.anonymize_text(text, entities)
+        df.at[idx, 'detected_entities'] = str(all_entities)
+        for col in columns:
+            df.at[idx, col] = anonymized_row[col]
+    return df
+
+def batch_process(ner: NERService, df: pd.DataFrame, columns):
+    """新实现：分块批量检测，结果列一次性写回（与process_csv一致）"""
+    entities, anonymized = ner.detect_batch(df, columns)
+    df = df.copy()
+    df[list(anonymized)] = pd.DataFrame(anonymized, index=df.index)
+    df['detected_entities'] = [str(row_entities) for row_entities in entities]
+    df['anonymized_text'] = ""
+    return df
+
+def run_batch_ner_benchmark(rows: int = 5_000, max_workers=None, output_dir: Path = Path(".")):
+    """测试批量NER速度，结果写入output_dir/batch_ner_result.json"""
+    print("=" * 60)
+    print("  批量NER微基准")
+    print("=" * 60)
+    
+    df = build_table(rows)
+    columns = ["report", "impression"]
+    ner = NERService(max_workers=max_workers)
+    print(f"行数: {rows}, 处理列: {columns}, 进程数: {ner.max_workers}")
+    
+    start_time = time.time()
+    batch_df = batch_process(ner, df, columns)
+    batch_time = time.time() - start_time
+    ner.shutdown()
+    print(f"批量检测: {batch_time:.3f}秒 ({rows / batch_time:.0f} 行/秒)")
+    
+    start_time = time.time()
+    legacy_df = legacy_process(ner, df, columns)
+    legacy_time = time.time() - start_time
+    speedup = legacy_time / max(batch_time, 1e-6)
+    print(f"旧实现(iterrows): {legacy_time:.3f}秒，加速比 {speedup:.1f}x")
+    
+    identical = batch_df.equals(legacy_df)
+    print(f"输出一致: {identical}")
+    
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": rows,
+        "workers": ner.max_workers,
+        "batch_seconds": round(batch_time, 3),
+        "legacy_seconds": round(legacy_time, 3),
+        "speedup": round(speedup, 2),
+        "identical": identical,
+        "target_speedup": 2.0
+    }
+    result["pass"] = identical and speedup >= result["target_speedup"]
+    print(f"结果: {'[PASS]' if result['pass'] else '[FAIL]'} 目标加速比 {result['target_speedup']}x")
+    
+    with open(Path(output_dir) / "batch_ner_result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    return result
+
+def test_batch_ner_speed(tmp_path, monkeypatch):
+    """pytest入口：结果写入临时目录"""
+    result = run_batch_ner_benchmark(output_dir=tmp_path)
+    assert result["pass"]
+    
+    # 列名不是字符串（如Excel中的数字表头）时process_csv同样能写回匿名化结果
+    ner = NERService(max_workers=1)
+    df = build_table(20).rename(columns={"report": 2023, "impression": 2024})
+    monkeypatch.setattr("services.ner_service.load_table", lambda path: df.copy())
+    assert ner.process_csv("reports.xlsx", str(tmp_path / "reports_out.csv"), columns=[2023, 2024])
+    out = pd.read_csv(tmp_path / "reports_out.csv")
+    assert out["2023"].tolist() == [ner.anonymize_text(t, ner.detect_from_text(t)) for t in df[2023]]
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    result = run_batch_ner_benchmark(rows, workers)
+    exit(0 if result["pass"] else 1)
@@ -0,0 +1,128 @@
+"""
+DICOM按需解码微基准
+测试目标：只读header/形状的调用方（process_csv_detection、/api/detect的序列化）比旧的立即解码快10倍以上，
+且每个在途结果占用的内存下降一个数量级（旧实现每个文件常驻 float32像素 + float32 tensor + ROI掩码）
+"""
+import time
+import json
+import sys
+import tempfile
+import numpy as np
+import pydicom
+from pathlib import Path
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from services.roi_service import DicomProcessor
+
+def write_dicom(path: Path, size: int, seed: int):
+    """生成一个带烧录文字区域的模拟DICOM（uint16单帧）"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 1024, (size, size), dtype=np.uint16)
+    pixels[20:60, 40:400] = 4000  # 模拟烧录文字条带
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = pydicom.uid.SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.PatientID = f"patient{seed:05d}"
+    ds.PatientName = "Test^Patient"
+    ds.AccessionNumber = f"ACC{seed:06d}"
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = size, size
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.PixelData = pixels.tobytes()
+    ds.save_as(str(path), enforce_file_format=True)
+
+def eager_process(processor: DicomProcessor, path: Path):
+    """旧实现：解析时立即解码像素、生成tensor并做烧录检测"""
+    pixel_array = processor.load_pixel_array(path)
+    tensor = processor._normalize_to_tensor(pixel_array)
+    roi_mask, _ = processor._detect_roi_regions(pixel_array, try_burnedin=True)
+    return pixel_array, tensor, roi_mask
+
+def run_dicom_lazy_benchmark(files: int = 20, size: int = 1024, output_dir: Path = Path(".")):
+    """测试按需解码的速度与内存，结果写入output_dir/dicom_lazy_result.json"""
+    print("=" * 60)
+    print("  DICOM按需解码微基准")
+    print("=" * 60)
+    
+    processor = DicomProcessor(device='cpu')
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(tmp) / f"patient{i:05d}.dcm" for i in range(files)]
+        for i, path in enumerate(paths):
+            write_dicom(path, size, i)
+        print(f"文件数: {files}, 尺寸: {size}x{size}")
+        
+        start_time = time.time()
+        eager = [eager_process(processor, path) for path in paths]
+        eager_time = time.time() - start_time
+        eager_bytes = sum(px.nbytes + tensor.numel() * tensor.element_size() + mask.nbytes for px, tensor, mask in eager)
+        
+        start_time = time.time()
+        lazy = [processor.process_dicom(path, try_burnedin=True) for path in paths]
+        infos = [result.tensor_info() for result in lazy]
+        header_time = time.time() - start_time
+        header_bytes = sum(0 if r._pixel_array is None else r._pixel_array.nbytes for r in lazy)
+        
+        # 需要ROI的调用方（detect_phi_mapping）：检测后释放像素，只保留掩码
+        start_time = time.time()
+        masks = []
+        for result in lazy:
+            masks.append(result.roi_mask)
+            result.release_pixels()
+        roi_time = time.time() - start_time
+        roi_bytes = sum(mask.nbytes for mask in masks)
+        
+        consistent = all(
+            info["shape"] == list(tensor.shape) and np.array_equal(mask, old_mask)
+            for info, mask, (_, tensor, old_mask) in zip(infos, masks, eager)
+        )
+    
+    speedup = eager_time / max(header_time, 1e-6)
+    print(f"立即解码: {eager_time:.3f}秒, 常驻 {eager_bytes / files / 2 ** 20:.1f} MB/文件")
+    print(f"只读header: {header_time:.3f}秒 (加速比 {speedup:.0f}x), 常驻 {header_bytes / files / 2 ** 20:.1f} MB/文件")
+    print(f"按需ROI检测: {roi_time:.3f}秒, 释放像素后常驻 {roi_bytes / files / 2 ** 20:.1f} MB/文件, 结果一致: {consistent}")
+    
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "files": files,
+        "size": size,
+        "eager_seconds": round(eager_time, 3),
+        "header_seconds": round(header_time, 3),
+        "roi_seconds": round(roi_time, 3),
+        "eager_mb_per_file": round(eager_bytes / files / 2 ** 20, 2),
+        "roi_mb_per_file": round(roi_bytes / files / 2 ** 20, 2),
+        "speedup": round(speedup, 1),
+        "consistent": consistent,
+        "target_speedup": 10.0
+    }
+    result["pass"] = consistent and speedup >= result["target_speedup"] and header_bytes == 0
+    print(f"结果: {'[PASS]' if result['pass'] else '[FAIL]'} 目标加速比 {result['target_speedup']}x")
+    
+    with open(Path(output_dir) / "dicom_lazy_result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    return result
+
+def test_dicom_lazy(tmp_path):
+    """pytest入口：结果写入临时目录"""
+    result = run_dicom_lazy_benchmark(output_dir=tmp_path)
+    assert result["pass"]
+    
+    # 只读header/形状不解码像素；像素数据被截断时，烧录检测记录解码失败而不是当作没有烧录文本
+    processor = DicomProcessor(device='cpu')
+    path = tmp_path / "truncated.dcm"
+    write_dicom(path, 256, 1)
+    path.write_bytes(path.read_bytes()[:-4096])
+    truncated = processor.process_dicom(path, try_burnedin=True)
+    assert truncated.tensor_info()["shape"] == [1, 1, 256, 256] and truncated._pixel_array is None
+    assert truncated.roi_type == "pixel_error" and truncated.pixel_error
+
+if __name__ == "__main__":
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    result = run_dicom_lazy_benchmark(files, size)
+    exit(0 if result["pass"] else 1)
@@ -0,0 +1,119 @@
+"""
+DICOM查找索引微基准（process_batch_data的CSV行 -> DICOM文件匹配）
+测试目标：5万行 × 2万个DICOM文件，读header（元数据提取进程池） + 建索引 + 全部查找
+的吞吐量不低于每个提取进程每秒1000个文件（即 文件数 / (1000 × 进程数) + 1 秒内完成），
+且匹配结果正确：header PatientID与文件名token都能命中，"CT"、"patient"及多个文件共有的序号"001"不会命中任何文件
+（对照：旧实现建索引时逐个文件串行读header）
+"""
+import time
+import json
+import sys
+import random
+import tempfile
+import pydicom
+from pathlib import Path
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from services.join_engine import DicomFileIndex
+from services.roi_service import DicomProcessor, DicomMetadataExtractor
+
+def write_dicom(path: Path, patient_id: str, accession: str):
+    """生成一个只含header的模拟DICOM（建索引只读header，不需要像素）"""
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = pydicom.uid.SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.PatientID = patient_id
+    ds.PatientName = "Test^Patient"
+    ds.AccessionNumber = accession
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.save_as(str(path), enforce_file_format=True)
+
+def run_dicom_lookup_benchmark(rows: int = 50_000, files: int = 20_000, output_dir: Path = Path(".")):
+    """测试DICOM查找索引速度（含header读取），结果写入output_dir/dicom_lookup_result.json"""
+    print("=" * 60)
+    print("  DICOM查找索引微基准")
+    print("=" * 60)
+    
+    rng = random.Random(3)
+    extractor = DicomMetadataExtractor()
+    with tempfile.TemporaryDirectory() as tmp:
+        # 文件名形如 CT_patient000123_001.dcm：所有文件共有 "CT"、"patient"、"001"
+        dicom_files = [Path(tmp) / f"CT_patient{i:06d}_001.dcm" for i in range(files)]
+        for i, path in enumerate(dicom_files):
+            write_dicom(path, f"PID{i:07d}", f"ACC{i:07d}")
+        # 一半按header中的PatientID、一半按文件名中的患者编号查找，约10%的行没有对应的DICOM
+        queries = []
+        for _ in range(rows):
+            i = rng.randrange(int(files * 1.1))
+            queries.append((i, f"PID{i:07d}" if rng.random() < 0.5 else f"patient{i:06d}"))
+        print(f"CSV行数: {rows}, DICOM文件数: {files}, 提取进程数: {extractor.max_workers}")
+        
+        start_time = time.time()
+        metadata_list, failures = extractor.extract(dicom_files)
+        header_time = time.time() - start_time
+        index = DicomFileIndex(dicom_files, {Path(m['filepath']): m for m in metadata_list})
+        found = [index.lookup(pid) for _, pid in queries]
+        index_time = time.time() - start_time
+        unmatched = sum(1 for path in found if path is None)
+        print(f"读header + 建索引 + 查找: {index_time:.3f}秒 (其中读header {header_time:.3f}秒, 未匹配 {unmatched} 行)")
+        
+        correct = all((path is None) if i >= files else path == dicom_files[i] for (i, _), path in zip(queries, found))
+        ambiguous_ignored = all(index.lookup(token) is None and index.lookup(None, token) is None
+                                for token in ("CT", "patient", "001"))
+        print(f"匹配正确: {correct}, 共有token不匹配: {ambiguous_ignored} (忽略 {len(index.ambiguous_tokens)} 个)")
+        
+        processor = DicomProcessor(device='cpu')
+        start_time = time.time()
+        for path in dicom_files:
+            processor.process_dicom_header(path)
+        serial_header_time = time.time() - start_time
+        print(f"旧实现(逐个文件串行读header): {serial_header_time:.3f}秒")
+    extractor.shutdown()
+    
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": rows,
+        "files": files,
+        "workers": extractor.max_workers,
+        "header_seconds": round(header_time, 3),
+        "index_seconds": round(index_time, 3),
+        "serial_header_seconds": round(serial_header_time, 3),
+        "unmatched_rows": unmatched,
+        "failed_files": len(failures),
+        "correct": correct,
+        "ambiguous_ignored": ambiguous_ignored,
+        "target_seconds": round(files / (1000 * extractor.max_workers) + 1, 1)
+    }
+    result["pass"] = correct and ambiguous_ignored and not failures and index_time <= result["target_seconds"]
+    print(f"结果: {'[PASS]' if result['pass'] else '[FAIL]'} 目标 {result['target_seconds']}秒")
+    
+    with open(Path(output_dir) / "dicom_lookup_result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    return result
+
+def test_dicom_lookup_speed(tmp_path):
+    """pytest入口：结果写入临时目录"""
+    result = run_dicom_lookup_benchmark(output_dir=tmp_path)
+    assert result["pass"]
+    
+    # header中的PatientID优先于文件名token；提取进程池读出的header与逐个串行读取一致
+    first, second = tmp_path / "CT_patient000001_001.dcm", tmp_path / "CT_patient000002_001.dcm"
+    write_dicom(first, "patient000002", "ACC0000001")
+    write_dicom(second, "PID0000002", "ACC0000002")
+    extractor = DicomMetadataExtractor()
+    metadata_list, failures = extractor.extract([first, second])
+    extractor.shutdown()
+    index = DicomFileIndex([first, second], {Path(m['filepath']): m for m in metadata_list})
+    assert not failures and "001" in index.ambiguous_tokens and index.lookup("CT") is None and index.lookup("001") is None
+    assert index.lookup("patient000002") == first and index.lookup("patient000001") == first
+    assert index.lookup("PID0000002") == second and index.lookup(None, "ACC0000002") == second
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    result = run_dicom_lookup_benchmark(rows, files)
+    exit(0 if result["pass"] else 1)
@@ -13,9 +13,10 @@ from pathlib import Path
 
 BASE_URL = "http://localhost:5000"
 
-def test_full_pipeline(csv_file, dicom_dir):
+def test_full_pipeline(csv_file, dicom_dir, register=False):
     """
     测试完整的批量处理流程
+    register=True 时DICOM目录直接在服务端登记（需启动服务时 --allow-dicom-root 包含该目录），不经HTTP上传
     步骤1: 上传CSV + DICOM → 检测匹配
     步骤2: 加密保护
     步骤3: 存储入库
@@ -55,14 +56,23 @@ def test_full_pipeline(csv_file, dicom_dir):
         
         # ========== 步骤2: 批量上传DICOM ==========
         print("-" * 80)
-        print(f"[步骤 2/5] 批量上传{total_dicom}个DICOM文件...")
+        print(f"[步骤 2/5] 批量{'登记' if register else '上传'}{total_dicom}个DICOM文件...")
         step2_start = time.time()
         
         # 分批上传（避免一次传太多）
         batch_size = 500
         all_metadata = []
+        dicom_id = None
         
-        for i in range(0, total_dicom, batch_size):
+        if register:
+            payload = {"path": str(Path(dicom_dir).resolve()), "include_metadata": False}
+            response = requests.post(f"{BASE_URL}/api/batch_register_dicom", json=payload)
+            response.raise_for_status()
+            register_data = response.json()
+            dicom_id = register_data['dicom_id']
+            registered = register_data['processed']
+        
+        for i in range(0, total_dicom if not register else 0, batch_size):
             batch = dicom_files[i:i+batch_size]
             print(f"  上传批次 {i//batch_size + 1}/{(total_dicom + batch_size - 1)//batch_size}...")
             
@@ -77,7 +87,10 @@ def test_full_pipeline(csv_file, dicom_dir):
                     file_tuple[1].close()
         
         step2_time = time.time() - step2_start
-        print(f"  [OK] DICOM上传完成: {len(all_metadata)}个文件")
+        if register:
+            print(f"  [OK] DICOM登记完成: {registered}个文件 ({dicom_id})")
+        else:
+            print(f"  [OK] DICOM上传完成: {len(all_metadata)}个文件")
         print(f"  耗时: {step2_time:.3f}秒\n")
         
         # ========== 步骤3: 批量检测匹配 ==========
@@ -85,7 +98,7 @@ def test_full_pipeline(csv_file, dicom_dir):
         print("[步骤 3/5] 执行批量跨模态检测...")
         step3_start = time.time()
         
-        payload = {
+        payload = {"csv_path": csv_path, "dicom_id": dicom_id} if register else {
             "csv_path": csv_path,
             "dicom_metadata_list": all_metadata
         }
@@ -241,16 +254,19 @@ def test_full_pipeline(csv_file, dicom_dir):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("\n用法: python test_full_pipeline.py <csv文件> <dicom目录>")
+    register = '--register' in sys.argv[1:]
+    argv = [a for a in sys.argv[1:] if a != '--register']
+    if len(argv) != 2:
+        print("\n用法: python test_full_pipeline.py <csv文件> <dicom目录> [--register]")
         print("\n示例:")
         print('  python test_full_pipeline.py data.csv dicom_folder')
         print('  python test_full_pipeline.py ./data/train.csv ./data/dicom/')
+        print('  python test_full_pipeline.py ./data/train.csv /data/pacs/export --register')
+        print("\n--register: DICOM目录在服务端原位登记（启动服务时需 --allow-dicom-root 包含该目录）")
         print("\n注意: 请确保Flask服务正在运行 (python app.py)")
         sys.exit(1)
     
-    csv_file = sys.argv[1]
-    dicom_dir = sys.argv[2]
+    csv_file, dicom_dir = argv
     
     # 验证文件存在
     if not Path(csv_file).exists():
@@ -270,5 +286,5 @@ if __name__ == '__main__':
         sys.exit(1)
     
     # 运行测试
-    test_full_pipeline(csv_file, dicom_dir)
+    test_full_pipeline(csv_file, dicom_dir, register=register)
 
@@ -0,0 +1,105 @@
+"""
+批量检测连接引擎微基准
+测试目标：20万行CSV与DICOM元数据的patient_id匹配约1秒完成
+"""
+import re
+import time
+import json
+import sys
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from services.join_engine import CsvDicomJoinEngine
+
+def build_cohort(rows: int, patients: int):
+    """生成模拟CSV（含无patient的行和缺失值）与DICOM元数据列表"""
+    idx = np.arange(rows)
+    df = pd.DataFrame({
+        'Path': [f"CheXpert-v1.0-small/train/patient{i % patients:05d}/study1/view1_frontal.jpg" if i % 10 else "unknown"
+                 for i in idx],
+        'Sex': np.where(idx % 2 == 0, 'Male', 'Female'),
+        'Age': np.where(idx % 13 == 0, np.nan, 20 + idx % 60),
+        'Frontal/Lateral': 'Frontal'
+    })
+    # 一半的patient有DICOM
+    metadata_list = [
+        {'filename': f"patient{i:05d}.dcm", 'patient_id': f"patient{i:05d}", 'patient_sex': 'M', 'patient_age': '045Y'}
+        for i in range(0, patients, 2)
+    ]
+    return df, metadata_list
+
+def legacy_match(df: pd.DataFrame, metadata_list):
+    """旧实现：iterrows + 逐行正则 + 字典查找"""
+    dicom_index = {m['patient_id']: m for m in metadata_list if m.get('patient_id')}
+    matched = 0
+    total = 0
+    for idx, row in df.iterrows():
+        match = re.search(r'patient(\d+)', str(row.get('Path', '')), re.IGNORECASE)
+        if match:
+            total += 1
+            row_data = row.to_dict()  # 旧实现为每行构建字典
+            if dicom_index.get('patient' + match.group(1)):
+                matched += 1
+    return total, matched
+
+def run_join_benchmark(rows: int = 200_000, patients: int = 50_000, compare_legacy: bool = False,
+                       output_dir: Path = Path(".")):
+    """测试连接引擎速度，结果写入output_dir/join_performance_result.json"""
+    print("=" * 60)
+    print("  CSV ↔ DICOM 连接引擎微基准")
+    print("=" * 60)
+    
+    df, metadata_list = build_cohort(rows, patients)
+    print(f"CSV行数: {rows}, DICOM元数据数: {len(metadata_list)}")
+    
+    start_time = time.time()
+    engine = CsvDicomJoinEngine(metadata_list)
+    stats = {'total_patients': 0, 'matched': 0}
+    records = sum(1 for _ in engine.iter_matches(df, stats))
+    engine_time = time.time() - start_time
+    
+    print(f"连接引擎: {engine_time:.3f}秒 (patient行={stats['total_patients']}, 匹配={stats['matched']}, 记录={records})")
+    
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": rows,
+        "dicom_metadata": len(metadata_list),
+        "engine_seconds": round(engine_time, 3),
+        "matched": stats['matched'],
+        "target_seconds": 1.0,
+        "pass": engine_time < 1.5  # 目标约1秒，允许50%的机器差异
+    }
+    
+    if compare_legacy:
+        start_time = time.time()
+        total, matched = legacy_match(df, metadata_list)
+        legacy_time = time.time() - start_time
+        assert (total, matched) == (stats['total_patients'], stats['matched'])
+        print(f"旧实现(iterrows): {legacy_time:.3f}秒，加速比 {legacy_time / max(engine_time, 1e-6):.1f}x")
+        result["legacy_seconds"] = round(legacy_time, 3)
+    
+    print(f"结果: {'[PASS]' if result['pass'] else '[FAIL]'} 目标约 {result['target_seconds']}秒")
+    
+    with open(Path(output_dir) / "join_performance_result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    assert stats['total_patients'] == rows - len(range(0, rows, 10))
+    return result
+
+def test_join_engine_speed(tmp_path):
+    """pytest入口：结果写入临时目录"""
+    result = run_join_benchmark(output_dir=tmp_path)
+    assert result["pass"]
+    
+    # 索引重复或非默认时，csv_data仍是该记录自己的行（按位置取行）
+    df, metadata_list = build_cohort(1000, 100)
+    df.index = df.index // 2 + 7
+    records = list(CsvDicomJoinEngine(metadata_list).iter_matches(df))
+    hits = [r for r in records if r['matched']]
+    assert len(hits) == sum(1 for i in range(1000) if i % 10 and i % 100 % 2 == 0)
+    assert all(r['patient_id'] in r['csv_data']['Path'] and r['row_index'] in df.index for r in hits)
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    result = run_join_benchmark(rows=rows, compare_legacy=True)
+    exit(0 if result["pass"] else 1)
@@ -0,0 +1,91 @@
+"""
+长文本NER微基准（窗口并行扫描 + 单次拼接匿名化）
+测试目标：窗口切分的结果与整段单遍扫描完全一致（无边界重复/遗漏），匿名化比逐次字符串拼接快10倍以上
+（多核机器上窗口由进程池并行扫描，扫描时间随核数下降）
+"""
+import time
+import json
+import sys
+import random
+from pathlib import Path
+from services.ner_service import NERService
+from services.span_resolver import resolve_overlaps
+from test_ner_performance import build_report
+
+def legacy_anonymize(ner: NERService, text: str, entities):
+    """旧实现：按起点逆序逐个替换（每次替换都复制整段文本）"""
+    for entity in sorted(resolve_overlaps(entities, ner.PATTERN_PRIORITY), key=lambda x: -x["start"]):
+        text = text[:entity["start"]] + f"[{entity['type']}]" + text[entity["end"]:]
+    return text
+
+def run_long_text_benchmark(total_chars: int = 4_000_000, anonymize_chars: int = 300_000, max_workers=None,
+                            output_dir: Path = Path(".")):
+    """测试长文本模式的一致性与速度，结果写入output_dir/long_text_ner_result.json"""
+    print("=" * 60)
+    print("  长文本NER微基准")
+    print("=" * 60)
+    
+    text = build_report(random.Random(5), total_chars)
+    ner = NERService(max_workers=max_workers)
+    print(f"文本长度: {len(text)}, 窗口: {ner.WINDOW_CHARS}字符 (重叠 {ner.WINDOW_OVERLAP}), 进程数: {ner.max_workers}")
+    
+    start_time = time.time()
+    windowed = ner.detect_long_text(text)
+    windowed_time = time.time() - start_time
+    ner.shutdown()
+    
+    start_time = time.time()
+    single = ner._detect_entities(text)
+    single_time = time.time() - start_time
+    identical = windowed == single
+    print(f"窗口扫描: {windowed_time:.3f}秒, 整段扫描: {single_time:.3f}秒, 实体数={len(windowed)}, 结果一致: {identical}")
+    
+    sample = text[:anonymize_chars]
+    entities = ner._detect_entities(sample)
+    start_time = time.time()
+    joined = ner.anonymize_text(sample, entities)
+    join_time = time.time() - start_time
+    start_time = time.time()
+    legacy = legacy_anonymize(ner, sample, entities)
+    legacy_time = time.time() - start_time
+    anonymize_speedup = legacy_time / max(join_time, 1e-6)
+    print(f"匿名化({len(sample)}字符, {len(entities)}个实体): 单次拼接 {join_time:.3f}秒, "
+          f"逐次拼接 {legacy_time:.3f}秒，加速比 {anonymize_speedup:.1f}x, 输出一致: {joined == legacy}")
+    
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "chars": len(text),
+        "workers": ner.max_workers,
+        "windowed_seconds": round(windowed_time, 3),
+        "single_pass_seconds": round(single_time, 3),
+        "entities": len(windowed),
+        "identical": identical,
+        "anonymize_join_seconds": round(join_time, 3),
+        "anonymize_legacy_seconds": round(legacy_time, 3),
+        "anonymize_speedup": round(anonymize_speedup, 2),
+        "target_anonymize_speedup": 10.0
+    }
+    result["pass"] = identical and joined == legacy and anonymize_speedup >= result["target_anonymize_speedup"]
+    print(f"结果: {'[PASS]' if result['pass'] else '[FAIL]'} 窗口结果一致, 匿名化目标加速比 {result['target_anonymize_speedup']}x")
+    
+    with open(Path(output_dir) / "long_text_ner_result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    return result
+
+def test_long_text_ner(tmp_path):
+    """pytest入口：结果写入临时目录"""
+    result = run_long_text_benchmark(output_dir=tmp_path)
+    assert result["pass"]
+    
+    # 跨窗口边界的实体只报告一次且完整（小窗口下每个手机号都可能落在边界上）
+    ner = NERService(max_workers=1)
+    text = "".join(f"患者联系电话1380013{i:04d}，" for i in range(200))
+    phones = [e["text"] for e in ner.detect_long_text(text, window_chars=97) if e["type"] == "PHONE"]
+    assert phones == [f"1380013{i:04d}" for i in range(200)]
+
+if __name__ == "__main__":
+    chars = int(sys.argv[1]) if len(sys.argv) > 1 else 4_000_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    result = run_long_text_benchmark(chars, max_workers=workers)
+    exit(0 if result["pass"] else 1)
@@ -0,0 +1,191 @@
+"""
+中文姓名识别微基准（吞吐量 + 准确率）
+测试目标：姓氏前缀树识别器的精确率 >= 0.9、召回率 >= 0.9，吞吐量 >= 1M字符/秒
+（模拟语料由识别器自己的姓氏与提示词构成，另用独立标注的留出样本检验精确率，负例含姓氏开头的常用词、地名与机构名）
+（对照的 [一-龥]{2,4} 正则纯C实现更快，但精确率极低，下游要为大量误报实体付出代价）
+"""
+import re
+import time
+import json
+import sys
+import random
+from pathlib import Path
+from services.name_detector import get_name_detector, COMPOUND_SURNAMES
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰红梅建国志文"
+NAME_REGEX = re.compile(r"[一-龥]{2,4}")
+
+# 含姓名的句子（{name}处为真实姓名）
+NAME_SENTENCES = [
+    "患者{name}，{sex}，{age}岁，因反复咳嗽伴发热{days}天入院。",
+    "姓名：{name}  性别：{sex}  年龄：{age}岁",
+    "家属{name}（配偶）已签署知情同意书。",
+    "主治医师：{name}，审核人：{name2}。",
+    "患者{name}住院期间病情平稳，今日出院。",
+]
+# 不含姓名、但大量出现姓氏用字的句子
+PLAIN_SENTENCES = [
+    "双肺呼吸音粗，可闻及少量湿啰音，心律齐，各瓣膜听诊区未闻及病理性杂音。",
+    "予头孢曲松钠2g静脉滴注，每日1次，高热时予物理降温。",
+    "住北京市朝阳区建国路{age}号，2023-05-12于北京协和医院行胸部CT检查。",
+    "诊断：社区获得性肺炎。常规检查未见明显异常，建议定期复查。",
+    "实验室检查：白细胞{age}×10^9/L，中性粒细胞百分比{age}%，C反应蛋白{age}mg/L。",
+    "林可霉素过敏史，否认高血压、糖尿病病史，无吸烟饮酒史。",
+]
+
+# 独立标注的留出样本（不由上面的模板与识别器的姓氏表/提示词生成），【】内为真实姓名
+# 负例：姓氏用字开头的常用词、地名、机构名
+HELD_OUT_SAMPLE = [
+    "既往史：高血压10年，规律服药，血压控制可。",
+    "皮肤黏膜无黄染，巩膜无黄疸，浅表淋巴结未触及肿大。",
+    "月经周期规律，量中等，无痛经。",
+    "肌张力正常，病理征阴性。",
+    "2021年曾于周口市中心医院行阑尾切除术。",
+    "现住黄山市屯溪区，来自张家口市。",
+    "转诊自杨浦区市东医院，陈家桥社区卫生服务中心随访。",
+    "林可霉素、青霉素过敏。",
+    "马来西亚归国人员，无疫区接触史。",
+    "常规心电图：窦性心律。",
+    "何时起病不详，高热3天。",
+    "华山医院会诊意见：建议穿刺活检。",
+    "金黄色葡萄球菌培养阳性。",
+    "曾在王府井附近跌倒，右腕部疼痛。",
+    "安静状态下心率78次/分。",
+    "江苏省人民医院检查结果已调阅。",
+    "于今日10:00在全麻下行手术。",
+    "朱砂样皮疹，压之褪色。",
+    "方案：阿莫西林0.5g口服，每日3次。",
+    "李斯特菌感染待排。",
+    "姓名：【王建国】  性别：男  年龄：56岁",
+    "患者【李秀兰】，女，67岁，因胸闷2天入院。",
+    "家属【张伟】（儿子）签字同意。",
+    "主治医师：【欧阳明】，审核人：【陈静】。",
+    "【刘洋】先生于昨日出院。",
+    "经治医师【赵磊】，会诊医师【孙红梅】。",
+    "联系人：【周杰】，电话13800138000。",
+    "患儿【黄子轩】，男，5岁。",
+    "报告人：【马丽】  记录人：【高强】",
+    "【郑志文】女士诉头痛3天。",
+]
+
+def parse_labelled(sentence: str):
+    """去掉【】标注，返回 (文本, 真实姓名区间集合)"""
+    text = ""
+    spans = set()
+    for piece in re.split(r"(【[^】]+】)", sentence):
+        if piece.startswith("【"):
+            spans.add((len(text), len(text) + len(piece) - 2))
+            text += piece[1:-1]
+        else:
+            text += piece
+    return text, spans
+
+def held_out_score(detector):
+    """在留出样本上计算 (精确率, 召回率)"""
+    found = set()
+    truth = set()
+    for n, sentence in enumerate(HELD_OUT_SAMPLE):
+        text, spans = parse_labelled(sentence)
+        found |= {(n, s, e) for s, e, _ in detector.find(text)}
+        truth |= {(n, s, e) for s, e in spans}
+    return score(found, truth)
+
+def random_name(rng: random.Random) -> str:
+    surname = rng.choice(COMPOUND_SURNAMES) if rng.random() < 0.05 else rng.choice(SURNAMES)
+    return surname + "".join(rng.choice(GIVEN) for _ in range(rng.choice((1, 2, 2))))
+
+def build_corpus(rng: random.Random, target_chars: int):
+    """生成模拟报告，返回 (文本, 真实姓名区间集合)"""
+    parts = []
+    spans = set()
+    length = 0
+    while length < target_chars:
+        template = rng.choice(NAME_SENTENCES) if rng.random() < 0.3 else rng.choice(PLAIN_SENTENCES)
+        values = {"sex": rng.choice("男女"), "age": rng.randint(18, 90), "days": rng.randint(1, 14)}
+        # 按姓名占位符切分模板，逐段填充并记录姓名的位置
+        sentence = ""
+        for piece in re.split(r"(\{name2?\})", template):
+            if piece in ("{name}", "{name2}"):
+                name = random_name(rng)
+                spans.add((length + len(sentence), length + len(sentence) + len(name)))
+                sentence += name
+            else:
+                sentence += piece.format(**values)
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts), spans
+
+def score(found, truth):
+    tp = len(found & truth)
+    precision = tp / len(found) if found else 0.0
+    recall = tp / len(truth) if truth else 0.0
+    return precision, recall
+
+def run_name_detector_benchmark(total_chars: int = 2_000_000, output_dir: Path = Path(".")):
+    """测试姓名识别的吞吐量与准确率，结果写入output_dir/name_detector_result.json"""
+    print("=" * 60)
+    print("  中文姓名识别微基准")
+    print("=" * 60)
+    
+    text, truth = build_corpus(random.Random(7), total_chars)
+    print(f"文本长度: {len(text)}, 真实姓名数: {len(truth)}")
+    
+    start_time = time.time()
+    detector = get_name_detector()
+    load_time = time.time() - start_time
+    
+    start_time = time.time()
+    found = {(s, e) for s, e, _ in detector.find(text)}
+    detector_time = time.time() - start_time
+    precision, recall = score(found, truth)
+    print(f"前缀树识别: {detector_time:.3f}秒 ({len(text) / detector_time / 1e6:.2f} M字符/秒), "
+          f"识别数={len(found)}, 精确率={precision:.3f}, 召回率={recall:.3f} (词典加载 {load_time * 1000:.1f}ms)")
+    
+    start_time = time.time()
+    regex_found = {m.span() for m in NAME_REGEX.finditer(text)}
+    regex_time = time.time() - start_time
+    regex_precision, regex_recall = score(regex_found, truth)
+    print(f"正则 [一-龥]{{2,4}}: {regex_time:.3f}秒, 识别数={len(regex_found)}, "
+          f"精确率={regex_precision:.3f}, 召回率={regex_recall:.3f}")
+    
+    held_out_precision, held_out_recall = held_out_score(detector)
+    print(f"留出样本({len(HELD_OUT_SAMPLE)}句): 精确率={held_out_precision:.3f}, 召回率={held_out_recall:.3f}")
+    
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "chars": len(text),
+        "names": len(truth),
+        "detector_seconds": round(detector_time, 3),
+        "detector_precision": round(precision, 4),
+        "detector_recall": round(recall, 4),
+        "regex_seconds": round(regex_time, 3),
+        "regex_precision": round(regex_precision, 4),
+        "regex_recall": round(regex_recall, 4),
+        "held_out_precision": round(held_out_precision, 4),
+        "held_out_recall": round(held_out_recall, 4),
+        "target_chars_per_second": 1_000_000,
+        "pass": precision >= 0.9 and recall >= 0.9 and held_out_precision >= 0.9 and len(text) / detector_time >= 1_000_000
+    }
+    print(f"结果: {'[PASS]' if result['pass'] else '[FAIL]'} 目标 精确率/召回率 >= 0.9（留出样本精确率 >= 0.9）, 吞吐量 >= 1M字符/秒")
+    
+    with open(Path(output_dir) / "name_detector_result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    return result
+
+def test_name_detector(tmp_path):
+    """pytest入口：结果写入临时目录"""
+    result = run_name_detector_benchmark(output_dir=tmp_path)
+    assert result["pass"]
+    assert result["held_out_precision"] >= 0.9
+    
+    # 提示词后的姓名（含复姓）整体识别，药名、地名开头的姓氏用字不识别
+    detector = get_name_detector()
+    text = "患者欧阳明，男，56岁。林可霉素过敏，现住黄山市。"
+    assert [text[s:e] for s, e, _ in detector.find(text)] == ["欧阳明"]
+
+if __name__ == "__main__":
+    chars = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    result = run_name_detector_benchmark(chars)
+    exit(0 if result["pass"] else 1)
@@ -0,0 +1,166 @@
+"""
+NER单遍扫描引擎微基准
+测试目标：长篇临床报告上，单遍组合正则（含跨起点冲突探测）比逐模式finditer快1.3倍以上，且实体互不重叠、数量明显减少
+"""
+import re
+import gc
+import time
+import json
+import sys
+import random
+from pathlib import Path
+from services.ner_service import NERService
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚"
+SENTENCES = [
+    "患者{name}，{sex}，{age}岁，因反复咳嗽伴发热{days}天入院。",
+    "身份证号{id_number}，联系电话{phone}，住{city}市{district}区{road}路{no}号。",
+    "{date}于{city}市第一人民医院行胸部CT检查，检查号CT{accession}，影像号{pid}。",
+    "查体：体温38.{t}℃，脉搏{pulse}次/分，呼吸{resp}次/分，血压{sbp}/{dbp}mmHg。",
+    "双肺呼吸音粗，可闻及少量湿啰音，心律齐，各瓣膜听诊区未闻及病理性杂音。",
+    "实验室检查：白细胞{wbc}×10^9/L，中性粒细胞百分比{neu}%，C反应蛋白{crp}mg/L。",
+    "诊断：社区获得性肺炎。予头孢曲松钠2g静脉滴注，每日1次，治疗{days}天后复查。",
+    "Patient {en_name}, {en_sex}, referred by Dr. Smith for follow-up imaging.",
+]
+
+def build_report(rng: random.Random, target_chars: int) -> str:
+    """生成模拟临床报告（中文为主，夹杂少量英文）"""
+    parts = []
+    length = 0
+    while length < target_chars:
+        sentence = rng.choice(SENTENCES).format(
+            name=rng.choice(SURNAMES) + "".join(rng.choice(GIVEN) for _ in range(rng.randint(1, 2))),
+            sex=rng.choice("男女"), age=rng.randint(18, 90), days=rng.randint(1, 14),
+            id_number=f"{rng.randint(110000, 659999)}{rng.randint(1940, 2005)}{rng.randint(1, 12):02d}"
+                      f"{rng.randint(1, 28):02d}{rng.randint(100, 999)}{rng.choice('0123456789X')}",
+            phone=f"1{rng.choice('3456789')}{rng.randint(100000000, 999999999)}",
+            city=rng.choice(["北京", "上海", "广州", "成都"]), district=rng.choice(["朝阳", "海淀", "天河", "武侯"]),
+            road=rng.choice(["建国", "中山", "人民", "解放"]), no=rng.randint(1, 300),
+            date=f"{rng.randint(2015, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            accession=rng.randint(10 ** 9, 10 ** 10), pid=f"P{rng.randint(10 ** 5, 10 ** 6)}",
+            t=rng.randint(0, 9), pulse=rng.randint(60, 120), resp=rng.randint(12, 30),
+            sbp=rng.randint(100, 160), dbp=rng.randint(60, 100), wbc=rng.randint(4, 20), neu=rng.randint(40, 95),
+            crp=rng.randint(1, 200), en_name=rng.choice(["John Smith", "Mary Jones", "Wei Zhang"]),
+            en_sex=rng.choice(["Male", "Female"])
+        )
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+# 旧实现的中文姓名正则（现由姓氏前缀树识别）与检查号正则（与患者ID相同，现统一报告为PATIENT_ID）
+LEGACY_NAME_PATTERN = r"([\u4e00-\u9fa5]{2,4})"
+LEGACY_ACCESSION_PATTERN = r"([A-Za-z0-9]+)"
+
+def legacy_detect(ner: NERService, text: str):
+    """旧实现：每种实体类型各做一次finditer（共扫描10遍，结果互相重叠）"""
+    entities = []
+    for entity_type, pattern in {"NAME": LEGACY_NAME_PATTERN, **ner.patterns, "ACCESSION": LEGACY_ACCESSION_PATTERN}.items():
+        for match in re.finditer(pattern, text):
+            entities.append({
+                "type": entity_type,
+                "text": match.group(1),
+                "start": match.start(1),
+                "end": match.end(1),
+                "confidence": ner._calc_confidence(entity_type, match.group(1))
+            })
+    return entities
+
+def best_time(func, repeat: int):
+    """运行func共repeat次，返回(最短耗时, 结果)；计时期间关闭GC（同timeit），避免另一实现留下的垃圾回收计入本次耗时"""
+    best, value = float("inf"), None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start_time = time.time()
+            value = func()
+            best = min(best, time.time() - start_time)
+        finally:
+            gc.enable()
+    return best, value
+
+def run_ner_benchmark(reports: int = 200, report_chars: int = 20_000, compare_legacy: bool = True,
+                      output_dir: Path = Path("."), repeat: int = 2):
+    """
+    测试单遍扫描引擎速度，结果写入output_dir/ner_performance_result.json
+    :param repeat: 每篇报告上两种实现各运行的次数，取最快的一次（减少单核机器上的计时抖动）
+    """
+    print("=" * 60)
+    print("  NER 单遍扫描引擎微基准")
+    print("=" * 60)
+    
+    rng = random.Random(42)
+    texts = [build_report(rng, report_chars) for _ in range(reports)]
+    total_chars = sum(len(t) for t in texts)
+    print(f"报告数: {reports}, 总字符数: {total_chars}")
+    
+    ner = NERService()
+    # 两种实现逐篇报告交替计时，机器负载的波动同时作用于双方
+    engine_time = legacy_time = 0.0
+    engine_entities = legacy_entities = 0
+    for text in texts:
+        seconds, entities = best_time(lambda: ner.detect_from_text(text), repeat)
+        engine_time += seconds
+        engine_entities += len(entities)
+        if compare_legacy:
+            seconds, entities = best_time(lambda: legacy_detect(ner, text), repeat)
+            legacy_time += seconds
+            legacy_entities += len(entities)
+    print(f"单遍引擎: {engine_time:.3f}秒 ({total_chars / engine_time / 1e6:.2f} M字符/秒), 实体数={engine_entities}")
+    
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "reports": reports,
+        "total_chars": total_chars,
+        "repeat": repeat,
+        "engine_seconds": round(engine_time, 3),
+        "engine_entities": engine_entities,
+        "target_speedup": 1.3
+    }
+    
+    # 单遍引擎的结果互不重叠
+    spans = sorted((e["start"], e["end"]) for e in ner.detect_from_text(texts[0]))
+    assert all(prev[1] <= cur[0] for prev, cur in zip(spans, spans[1:]))
+    # 汉字串中间的单字实体不会被整段跳过（"患者为女性"中的性别）
+    assert [(e["type"], e["text"]) for e in ner.detect_from_text("患者为女性，45岁")] == [("SEX", "女"), ("AGE", "45")]
+    # 起点靠前的低优先级匹配不会吞掉其后的高优先级实体（英文地址不跨越电话号码）
+    mixed = ner.detect_from_text("Patient John Smith, phone 13800138000, lives at 北京市朝阳区建国路88号", use_english=True)
+    assert ("PHONE", "13800138000") in [(e["type"], e["text"]) for e in mixed]
+    # 检查号内嵌的日期按优先级报告为DATE，而不是被整个编号吞掉
+    assert ("DATE", "2024-01-05") in [(e["type"], e["text"]) for e in ner.detect_from_text("检查号CT2024-01-05，45岁")]
+    
+    if compare_legacy:
+        speedup = legacy_time / max(engine_time, 1e-6)
+        print(f"旧实现(逐模式): {legacy_time:.3f}秒, 实体数={legacy_entities}，加速比 {speedup:.1f}x")
+        result.update({
+            "legacy_seconds": round(legacy_time, 3),
+            "legacy_entities": legacy_entities,
+            "speedup": round(speedup, 2)
+        })
+        result["pass"] = speedup >= result["target_speedup"] and engine_entities < legacy_entities
+    else:
+        result["pass"] = True
+    
+    print(f"结果: {'[PASS]' if result['pass'] else '[FAIL]'} 目标加速比 {result['target_speedup']}x")
+    
+    with open(Path(output_dir) / "ner_performance_result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    return result
+
+def test_ner_engine_speed(tmp_path):
+    """pytest入口：结果写入临时目录"""
+    result = run_ner_benchmark(output_dir=tmp_path)
+    assert result["pass"]
+    # 报告中的每个手机号与身份证号都按类型报告（不会被宽泛模式吞掉或截断）
+    report = build_report(random.Random(7), 20_000)
+    found = {(e["type"], e["text"]) for e in NERService(max_workers=1).detect_from_text(report)}
+    expected = {("PHONE", m) for m in re.findall(r"联系电话(\d+)", report)}
+    expected |= {("ID", m) for m in re.findall(r"身份证号(\w+)", report)}
+    assert expected and expected <= found
+
+if __name__ == "__main__":
+    reports = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    result = run_ner_benchmark(reports=reports)
+    exit(0 if result["pass"] else 1)